@@ -12,5 +12,6 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'kokebok.settings')
+os.environ.setdefault('KOKEBOK_ASYNC_VIEWS', '1')  # see settings.ASYNC_VIEWS
 
 application = get_asgi_application()
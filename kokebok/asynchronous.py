@@ -0,0 +1,23 @@
+"""
+Helpers for async code using the database.
+
+Django 3.2 has no async ORM (QuerySet.aget() and friends came in 4.1), so queries have to run in a thread. Its own
+sync_to_async adapters run sync views and middleware in one thread shared by every request, so that they are safe
+for code that isn't thread safe. The database code here is, and runs in threads of its own instead, so the queries
+of concurrent requests run in parallel.
+"""
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+
+def database_sync_to_async(func):
+    """
+    sync_to_async for functions using the database, run in a thread from the event loop's default executor.
+    The connections the thread opened are closed afterwards like at the end of a request (settings.CONN_MAX_AGE).
+    """
+    def run(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=False)
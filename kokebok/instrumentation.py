@@ -0,0 +1,216 @@
+"""
+Per-request instrumentation: wall time, database queries and their time, template render time and the view.
+Every request is logged as one line of JSON to the 'kokebok.requests' logger, and aggregated into the histograms
+served to staff at /stats/requests/. See settings.REQUEST_QUERY_BUDGET for flagging requests with too many queries.
+
+Template time is measured by TimedDjangoTemplates, which must be the template backend (settings.TEMPLATES).
+Queries run while rendering count towards both database and template time. Queries are attributed to the request
+through a context variable, so those run in other threads on its behalf (sync_to_async) count too.
+"""
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template.backends.django import DjangoTemplates
+
+logger = logging.getLogger('kokebok.requests')
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self._render_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        """ connection.execute_wrapper hook """
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+
+def _execute_wrapper(execute, sql, params, many, context):
+    """ Installed on every connection. Counts the query towards the request it is run for, if any """
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics(execute, sql, params, many, context)
+
+
+def _install(connection):
+    if _execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute_wrapper)
+
+
+@receiver(request_started)
+def _install_on_request(**kwargs):
+    for connection in connections.all():  # of the thread handling the request. Usually opened already
+        _install(connection)
+
+
+@receiver(connection_created)
+def _install_on_connect(sender, connection, **kwargs):
+    _install(connection)  # connections opened by other threads
+
+
+class TimedTemplate:
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        metrics = _current.get()
+        if metrics is None:
+            return self.template.render(context, request)
+        metrics._render_depth += 1  # only time the outermost render, templates can render templates
+        start = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            metrics._render_depth -= 1
+            if not metrics._render_depth:
+                metrics.template_time += time.perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """ The Django template backend, timing renders for RequestMetricsMiddleware """
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last one is for values above every bound
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def as_dict(self):
+        count = sum(self.counts)
+        return {
+            'buckets': {f'<={bound}': n for bound, n in zip(self.bounds, self.counts)} | {'inf': self.counts[-1]},
+            'count': count,
+            'mean': self.total / count if count else 0.0,
+            'max': self.max,
+        }
+
+
+class MetricsRegistry:
+    """ Histograms of the requests to each view, in this process """
+    MS_BOUNDS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+    QUERY_BOUNDS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def record(self, record):
+        with self._lock:
+            view = self._views.get(record['view'])
+            if view is None:
+                view = self._views[record['view']] = {
+                    'wall_ms': Histogram(self.MS_BOUNDS),
+                    'db_ms': Histogram(self.MS_BOUNDS),
+                    'template_ms': Histogram(self.MS_BOUNDS),
+                    'queries': Histogram(self.QUERY_BOUNDS),
+                    'over_query_budget': 0,
+                }
+            for name in ('wall_ms', 'db_ms', 'template_ms', 'queries'):
+                view[name].record(record[name])
+            view['over_query_budget'] += record['over_query_budget']
+
+    def clear(self):
+        with self._lock:
+            self._views.clear()
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                view: {name: value.as_dict() if isinstance(value, Histogram) else value for name, value in data.items()}
+                for view, data in self._views.items()
+            }
+
+
+metrics_registry = MetricsRegistry()
+
+
+class RequestMetricsMiddleware:
+    """
+    Should be first in settings.MIDDLEWARE, to include the time spent in the other middleware.
+    Works both ways, so it doesn't force Django to run async views in a thread under ASGI
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)  # __call__ returns a coroutine then, see below
+
+    def __call__(self, request):
+        if iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, metrics, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, metrics, time.perf_counter() - start)
+        return response
+
+    @staticmethod
+    def record(request, response, metrics, wall_time):
+        budget = settings.REQUEST_QUERY_BUDGET
+        match = request.resolver_match
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'view': match.view_name if match else None,
+            'wall_ms': round(wall_time * 1000, 3),
+            'db_ms': round(metrics.db_time * 1000, 3),
+            'template_ms': round(metrics.template_time * 1000, 3),
+            'queries': metrics.queries,
+            'over_query_budget': budget is not None and metrics.queries > budget,
+        }
+        metrics_registry.record(record)
+        logger.log(logging.WARNING if record['over_query_budget'] else logging.INFO, json.dumps(record))
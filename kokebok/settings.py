@@ -44,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'kokebok.instrumentation.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -57,7 +58,7 @@ ROOT_URLCONF = 'kokebok.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'kokebok.instrumentation.TimedDjangoTemplates',  # DjangoTemplates, timing renders
         'DIRS': [os.path.join(BASE_DIR, 'templates')]
         ,
         'APP_DIRS': True,
@@ -85,6 +86,59 @@ DATABASES = {
     }
 }
 
+# How recipes.views.search answers ingredient searches. Both find, sort and paginate the recipes with a single
+# aggregated query (recipes.search.database_search).
+# 'database': the searched ingredients are resolved in the query.
+# 'index': the searched ingredients are resolved to ids with the in-memory indexes (recipes.search.IngredientIndex),
+#          kept current by model signals. Every process has its own copy, which it rebuilds when another process
+#          changed the data. It learns of those changes through version stamps in the default cache, so 'index' needs
+#          a cache shared by all processes, e.g. Redis or memcached (see recipes.caching.LocalIndex and recipes.checks).
+#          With local memory, imports and scrapes run by management commands or other workers are never seen.
+RECIPE_SEARCH_BACKEND = 'database'
+
+# Search results and rendered recipe pages are cached, see recipes.caching. Local memory is per process; use a shared
+# backend in production, e.g. django-redis or django.core.cache.backends.memcached.PyMemcacheCache
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'kokebok',
+    }
+}
+RECIPE_CACHE_TIMEOUT = 60 * 60
+
+# Serve the async views in recipes.async_views. kokebok.asgi turns them on, as they only help under ASGI
+ASYNC_VIEWS = os.environ.get('KOKEBOK_ASYNC_VIEWS') == '1'
+
+# Threads scraping recipes submitted through the scrape page, see recipes.jobs. 0 to scrape in the request instead
+SCRAPE_JOB_WORKERS = 4
+
+# On-disk cache of scraped pages, see scrape.cache. None to disable
+SCRAPE_CACHE_DIR = os.path.join(BASE_DIR, 'scrape_cache')
+SCRAPE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+
+# Requests running more queries than this are logged as warnings by kokebok.instrumentation. None to disable
+REQUEST_QUERY_BUDGET = 20
+
+TEST_RUNNER = 'kokebok.test_runner.TestRunner'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'kokebok.requests': {  # one line of JSON per request
+            'handlers': ['console'],
+            'level': 'INFO',  # only requests over budget while testing, see kokebok.test_runner
+            'propagate': False,
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -0,0 +1,17 @@
+import logging
+
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+    """ Only logs the requests over the query budget of kokebok.instrumentation, rather than one line per request """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        logger = logging.getLogger('kokebok.requests')
+        self._request_log_level = logger.level
+        logger.setLevel(logging.WARNING)
+
+    def teardown_test_environment(self, **kwargs):
+        logging.getLogger('kokebok.requests').setLevel(self._request_log_level)
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,69 @@
+import asyncio
+import json
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.http import HttpResponse
+from django.test import TestCase, RequestFactory, override_settings
+from django.urls import reverse
+
+from kokebok.asynchronous import database_sync_to_async
+from kokebok.instrumentation import metrics_registry, RequestMetricsMiddleware
+from recipes.models import Recipe
+
+
+class RequestMetricsTest(TestCase):
+
+    def setUp(self):
+        metrics_registry.clear()
+        self.recipe = Recipe.objects.create(name='omelette', content='<p>Fry</p>')
+
+    def tearDown(self):
+        metrics_registry.clear()
+
+    def get_logged(self, url):
+        with self.assertLogs('kokebok.requests', 'INFO') as logs:
+            self.client.get(url)
+        return logs.records[0].levelname, json.loads(logs.records[0].getMessage())
+
+    def test_logged(self):
+        with self.assertNumQueries(3) as queries:
+            level, record = self.get_logged(self.recipe.get_absolute_url())
+        self.assertEqual(level, 'INFO')
+        self.assertEqual(record['view'], 'recipe_detail')
+        self.assertEqual((record['method'], record['status']), ('GET', 200))
+        self.assertEqual(record['queries'], len(queries))
+        self.assertGreater(record['template_ms'], 0)
+        self.assertGreaterEqual(record['wall_ms'], record['template_ms'])
+
+    @override_settings(REQUEST_QUERY_BUDGET=1)
+    def test_query_budget(self):
+        level, record = self.get_logged(self.recipe.get_absolute_url())
+        self.assertEqual(level, 'WARNING')
+        self.assertTrue(record['over_query_budget'])
+
+    def test_async(self):
+        def query(request):
+            with connection.cursor() as cursor:  # tables are locked by this test's transaction
+                cursor.execute('SELECT 1')
+            return HttpResponse()
+
+        async def view(request):
+            return await database_sync_to_async(query)(request)  # queries in another thread
+
+        middleware = RequestMetricsMiddleware(view)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        with self.assertLogs('kokebok.requests', 'INFO') as logs:
+            async_to_sync(middleware)(RequestFactory().get('/'))
+        self.assertEqual(json.loads(logs.records[0].getMessage())['queries'], 1)
+
+    def test_histograms_are_staff_only(self):
+        self.assertEqual(self.client.get(reverse('request_metrics')).status_code, 302)
+        staff = get_user_model().objects.create_user(email='staff@example.com', password='123', is_staff=True)
+        self.client.force_login(staff)
+        for _ in range(3):
+            self.client.get(self.recipe.get_absolute_url())
+        histograms = self.client.get(reverse('request_metrics')).json()
+        self.assertEqual(histograms['recipe_detail']['wall_ms']['count'], 3)
+        self.assertEqual(sum(histograms['recipe_detail']['queries']['buckets'].values()), 3)
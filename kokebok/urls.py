@@ -1,10 +1,13 @@
 from django.contrib import admin
 from django.urls import path, include
 
+from kokebok.views import request_metrics
+
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('_nested_admin/', include('nested_admin.urls')),
+    path('stats/requests/', request_metrics, name='request_metrics'),
 
     path('', include('recipes.urls')),
 ]
\ No newline at end of file
@@ -0,0 +1,10 @@
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
+
+from kokebok.instrumentation import metrics_registry
+
+
+@staff_member_required
+def request_metrics(request):
+    """ Histograms of time and queries per view, in this process. See kokebok.instrumentation """
+    return JsonResponse(metrics_registry.as_dict())
@@ -0,0 +1,8 @@
+from itertools import islice
+
+
+def chunked(iterable, size):
+    """ Yields lists of up to size items of iterable, consuming it lazily """
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
@@ -0,0 +1,76 @@
+import base64
+import json
+from functools import reduce
+from operator import or_, and_
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def keyset_paginate(queryset, ordering, cursor=None, per_page=20):
+    """
+    Paginates by filtering on the sort key of the last row of the previous page instead of using OFFSET,
+    so every page costs the same regardless of how deep into the results it is.
+    :param ordering: order_by() arguments. Must end in a unique field (e.g. 'id') so the order is total.
+        May reference annotations.
+    :param cursor: next_cursor of the previous page. None for the first page
+    :raise ValueError: if the cursor can't be decoded
+    :return: KeysetPage
+    """
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        queryset = queryset.filter(_after(ordering, _decode_cursor(queryset.model, ordering, cursor)))
+    object_list = list(queryset[:per_page + 1])
+    next_cursor = None
+    if len(object_list) > per_page:
+        object_list = object_list[:per_page]
+        next_cursor = _encode_cursor([getattr(object_list[-1], field.lstrip('-')) for field in ordering])
+    return KeysetPage(object_list, next_cursor)
+
+
+def _after(ordering, values):
+    """ (a > x) OR (a = x AND b > y) OR ... with < for descending fields """
+    conditions = []
+    for i, field in enumerate(ordering):
+        equal = [Q(**{name.lstrip('-'): value}) for name, value in zip(ordering[:i], values[:i])]
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        conditions.append(reduce(and_, equal + [Q(**{f"{field.lstrip('-')}__{lookup}": values[i]})]))
+    return reduce(or_, conditions)
+
+
+def _encode_cursor(values):
+    data = json.dumps([value if isinstance(value, (int, float)) else str(value) for value in values])
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def _decode_cursor(model, ordering, cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError) as e:
+        raise ValueError("Malformed cursor") from e
+    if not isinstance(values, list) or len(values) != len(ordering):
+        raise ValueError("Malformed cursor")
+    decoded = []
+    for field, value in zip(ordering, values):
+        try:
+            decoded.append(model._meta.get_field(field.lstrip('-')).to_python(value))
+        except FieldDoesNotExist:  # annotation. Stored as a json number
+            decoded.append(value)
+        except ValidationError as e:
+            raise ValueError("Malformed cursor") from e
+    return decoded
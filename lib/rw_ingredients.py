@@ -1,19 +1,25 @@
 from django.utils.text import slugify
 
 import recipes.models
+from lib.iterables import chunked
+
+CHUNK_SIZE = 1000
 
 
 def write_ingredients():
     Ingredient = recipes.models.Ingredient
     with open('ingredients.txt', mode='w', encoding='utf-8') as f:
-        f.writelines([ingredient.name + "\n" for ingredient in Ingredient.objects.all()])
+        for name in Ingredient.objects.order_by('name').values_list('name', flat=True).iterator(chunk_size=CHUNK_SIZE):
+            f.write(name + "\n")
 
 
 def read_ingredients():
+    """ Creates the ingredients listed in ingredients.txt, one name per line, that don't already exist """
     Ingredient = recipes.models.Ingredient
-    with open('ingredients.txt', mode='r') as f:
-        for ingredient_name in f.readlines():
-            Ingredient.objects.create(name=ingredient_name)
+    with open('ingredients.txt', mode='r', encoding='utf-8') as f:
+        names = (line.strip() for line in f)
+        for chunk in chunked(filter(None, names), CHUNK_SIZE):
+            Ingredient.bulk_create_roots(chunk)  # skips the existing ones
 
 
 def slugify_norwegian(name):
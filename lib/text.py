@@ -0,0 +1,18 @@
+import re
+from html import unescape
+
+from django.utils.html import strip_tags
+from django.utils.text import Truncator
+
+EXCERPT_LENGTH = 140
+
+
+def html_to_text(html):
+    """ Plain text of a html fragment, with runs of whitespace collapsed """
+    # put a space between blocks so "<p>a</p><p>b</p>" doesn't become "ab"
+    text = strip_tags(re.sub(r'<(br|/p|/li|/h\d|/div)\b[^>]*>', r'\g<0> ', html or ''))
+    return re.sub(r'\s+', ' ', unescape(text)).strip()
+
+
+def excerpt(text, length=EXCERPT_LENGTH):
+    return Truncator(text).chars(length)
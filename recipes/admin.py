@@ -1,7 +1,8 @@
 from django.contrib import admin
+from django.forms import BaseInlineFormSet
 from django.urls import resolve
 
-from recipes.models import Ingredient, Recipe, RecipeIngredient
+from recipes.models import Ingredient, Recipe, RecipeIngredient, ScrapeJob
 
 
 def get_parent_id_from_request(request):
@@ -9,8 +10,31 @@ def get_parent_id_from_request(request):
     return resolved.kwargs.get('object_id')
 
 
+class RecipeIngredientFormSet(BaseInlineFormSet):
+
+    def clean(self):
+        """ Rejects base ingredients of the same family as one the recipe already uses, e.g. "parmesan" and "ost" """
+        super().clean()
+        changed = [form for form in self.forms if form.has_changed() or self._should_delete_form(form)]
+        added = [
+            form for form in changed
+            if not self._should_delete_form(form) and form.cleaned_data.get('base_ingredient') is not None
+        ]
+        if not added or self.instance.pk is None:
+            return
+        changed_ids = [form.instance.pk for form in changed if form.instance.pk]
+        kept = self.instance.recipe_ingredients.exclude(pk__in=changed_ids).values_list('id', flat=True)
+        found = Ingredient.objects_in_families([form.cleaned_data['base_ingredient'] for form in added],
+                                               'recipe_usages', list(kept))
+        for form in added:
+            ingredient = form.cleaned_data['base_ingredient']
+            if found[ingredient.id]:
+                form.add_error('base_ingredient', f"The recipe already uses an ingredient of the {ingredient} family")
+
+
 class RecipeIngredientInline(admin.TabularInline):
     model = RecipeIngredient
+    formset = RecipeIngredientFormSet
     extra = 1
 
 
@@ -30,5 +54,14 @@ class RecipeAdmin(admin.ModelAdmin):
         return super(RecipeAdmin, self).get_form(request, obj, change, **kwargs)
 
 
+class ScrapeJobAdmin(admin.ModelAdmin):
+    list_display = ('url', 'status', 'recipe', 'datetime_created', 'queued_seconds', 'scrape_seconds', 'save_seconds')
+    list_filter = ('status',)
+    search_fields = ('url',)
+    readonly_fields = ('recipe', 'datetime_created', 'datetime_started', 'datetime_finished', 'queued_seconds',
+                       'scrape_seconds', 'save_seconds')
+
+
 admin.site.register(Ingredient)
 admin.site.register(Recipe, RecipeAdmin)
+admin.site.register(ScrapeJob, ScrapeJobAdmin)
@@ -0,0 +1,64 @@
+"""
+Async versions of the views doing the most work, served instead of those in recipes.views under ASGI
+(settings.ASYNC_VIEWS, set by kokebok.asgi).
+
+Django 3.2 runs sync views in one thread shared by all requests when serving ASGI, so a slow search holds up every
+other page. These views do their queries and rendering in a thread per request instead, see
+kokebok.asynchronous. Each does all of it in one call, as every hop between the event loop and a thread costs.
+Scraping waits for the other site on the event loop, see recipes.jobs.asubmit.
+"""
+import asyncio
+from functools import update_wrapper
+
+from django.http import HttpResponseRedirect
+from django.shortcuts import render
+from django.urls import reverse
+
+from kokebok.asynchronous import database_sync_to_async
+from recipes import jobs, views
+from scrape.scrape import get_sites
+
+
+class AsyncViewMixin:
+    """
+    For class-based views with async handlers. Django 3.2's View.as_view() always returns a sync function, which
+    Django would run in a thread, while 4.1 checks whether the handlers are async
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+
+        async def async_view(request, *args, **kwargs):
+            response = view(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):  # not for methods without handlers, e.g. http_method_not_allowed()
+                response = await response
+            return response
+        return update_wrapper(async_view, view)
+
+    async def get(self, request, *args, **kwargs):
+        return await database_sync_to_async(self.render_get)(request, *args, **kwargs)
+
+    def render_get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs).render()  # the template makes queries too
+
+
+class RecipeListView(AsyncViewMixin, views.RecipeListView):
+    pass
+
+
+class RecipeDetailView(AsyncViewMixin, views.RecipeDetailView):
+    pass
+
+
+async def search(request):
+    return await database_sync_to_async(views.search)(request)
+
+
+async def scrape_view(request):
+    if url := request.POST.get("scrape_url"):
+        job = await jobs.asubmit(url)  # scraped by a task on the event loop
+        return HttpResponseRedirect(reverse('scrape_job', kwargs={'uuid': job.id}))
+    return await database_sync_to_async(render)(
+        request, template_name='scrape.html', context={'supported_sites': get_sites().keys()},
+    )
@@ -0,0 +1,197 @@
+"""
+Caching of search result pages and rendered recipe pages in the Django cache (settings.CACHES).
+
+Entries are never deleted. Instead their keys contain version stamps, which the model signals in recipes.signals
+bump, so that stale entries are simply never read again and expire. Stamps are stored in the cache too, so every
+process sharing a cache backend sees the same versions.
+    search results: one stamp for all of them, bumped by any change to recipes, ingredients or recipe ingredients
+    recipe pages: keyed by recipe id and datetime_updated, plus a stamp per recipe for changes to its ingredients
+    scaled recipes: keyed like recipe pages, plus the servings. Only common serving counts are cached
+The in-memory indexes of recipes.search and recipes.matching are versioned the same way, see LocalIndex.
+"""
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+SEARCH = 'search'
+RECIPE_DETAIL = 'recipe_detail'
+SCALED_RECIPE = 'scaled_recipe'
+COMMON_SERVINGS = range(1, 13)
+
+
+class CacheStats:
+    """ Hits and misses per kind of entry, in this process """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def record(self, name, hit):
+        with self._lock:
+            counts = self._counts.setdefault(name, [0, 0])
+            counts[0 if hit else 1] += 1
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                name: {'hits': hits, 'misses': misses, 'hit_ratio': hits / (hits + misses)}
+                for name, (hits, misses) in self._counts.items()
+            }
+
+
+cache_stats = CacheStats()
+
+
+def _version_key(name):
+    return f'version:{name}'
+
+
+def get_version(name):
+    key = _version_key(name)
+    version = cache.get(key)
+    if version is None:
+        # start from the clock rather than 1, so a stamp that was evicted can't come back to match old entries
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(name):
+    """ :return: the new version """
+    try:
+        return cache.incr(_version_key(name))
+    except ValueError:  # not set, or evicted
+        version = time.time_ns()
+        cache.set(_version_key(name), version, timeout=None)
+        return version
+
+
+class LocalIndex:
+    """
+    Base of the in-memory indexes, of which every process builds its own copy from the database.
+    Each index has a version stamp in the default cache, which every change to the data it covers bumps. A copy is
+    rebuilt on next use once the stamp no longer matches the version it was built at, so changes made by other
+    processes are seen too, as long as the cache is shared by all of them (see recipes.checks).
+    Changes made by this process are applied to its copy incrementally instead (see _change), as long as no other
+    process changed the data in between.
+    Subclasses define version_name, _reset and _build, and call _ensure_built before reading.
+    """
+    version_name = None
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._version = None  # the copy is current with this version. None when not built
+
+    def clear(self):
+        """ Drop the copy. It is rebuilt from the database on next use """
+        with self._lock:
+            self._version = None
+            self._reset()
+
+    def invalidate(self):
+        """ For changes that bypass _change, e.g. bulk imports: every process rebuilds its copy on next use """
+        bump_version(self.version_name)
+
+    def _ensure_built(self):
+        version = get_version(self.version_name)
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            self._reset()
+            self._build()
+            self._version = version
+
+    def _change(self, apply):
+        """
+        Bumps the version, and applies the change to the copy if it is built and current. A copy that isn't is rebuilt
+        on next use. Only call once the change has been committed (transaction.on_commit), so that no process can build
+        a copy without the change at the new version
+        :param apply: function changing the copy
+        """
+        with self._lock:
+            version = bump_version(self.version_name)
+            if self._version is not None and version == self._version + 1:  # no other process changed the data
+                apply()
+                self._version = version
+
+    def _reset(self):
+        raise NotImplementedError
+
+    def _build(self):
+        raise NotImplementedError
+
+
+def _get(name, key):
+    value = cache.get(key)
+    cache_stats.record(name, value is not None)
+    return value
+
+
+def _digest(value):
+    return hashlib.md5(json.dumps(value, sort_keys=True).encode()).hexdigest()
+
+
+def search_key(**params):
+    """ :param params: the normalised search. Equal searches must give equal params """
+    return f'{SEARCH}:{get_version(SEARCH)}:{_digest(params)}'
+
+
+def get_search(key):
+    """ :return: (recipe ids, next cursor) of the result page, or None """
+    return _get(SEARCH, key)
+
+
+def set_search(key, recipe_ids, next_cursor):
+    cache.set(key, (list(recipe_ids), next_cursor), settings.RECIPE_CACHE_TIMEOUT)
+
+
+def invalidate_search():
+    bump_version(SEARCH)
+
+
+def _recipe_key(name, recipe):
+    """ Key of an entry derived from the recipe and its ingredients. See invalidate_recipe_detail """
+    return f'{name}:{recipe.id}:{recipe.datetime_updated.timestamp()}:{get_version(f"{RECIPE_DETAIL}:{recipe.id}")}'
+
+
+def recipe_detail(recipe, render):
+    """
+    :param render: function rendering the page (fragment) of the recipe. Called on cache misses
+    :return: the cached rendering of the recipe
+    """
+    key = _recipe_key(RECIPE_DETAIL, recipe)
+    html = _get(RECIPE_DETAIL, key)
+    if html is None:
+        html = render()
+        cache.set(key, html, settings.RECIPE_CACHE_TIMEOUT)
+    return html
+
+
+def scaled_recipe(recipe, servings, scale):
+    """
+    :param scale: function scaling the recipe's ingredients to servings. Called on cache misses
+    :return: the cached scaling of the recipe, see recipes.units.scale_recipe
+    """
+    if servings not in COMMON_SERVINGS:
+        return scale()
+    key = f'{_recipe_key(SCALED_RECIPE, recipe)}:{servings}'
+    ingredients = _get(SCALED_RECIPE, key)
+    if ingredients is None:
+        ingredients = scale()
+        cache.set(key, ingredients, settings.RECIPE_CACHE_TIMEOUT)
+    return ingredients
+
+
+def invalidate_recipe_detail(recipe_id):
+    """ Invalidates the recipe's page and its scalings """
+    bump_version(f'{RECIPE_DETAIL}:{recipe_id}')
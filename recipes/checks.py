@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+# cache backends that every process has its own copy of
+PROCESS_LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache',)
+
+
+@register()
+def check_search_backend(app_configs, **kwargs):
+    """
+    The in-memory indexes of the 'index' search backend find out about changes made by other processes through version
+    stamps in the default cache (see recipes.caching.LocalIndex), so the cache must be shared by all processes
+    """
+    if settings.RECIPE_SEARCH_BACKEND != 'index' or settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_CACHES:
+        return []
+    return [Warning(
+        "RECIPE_SEARCH_BACKEND 'index' needs a default cache shared by all processes",
+        hint="Configure a shared cache, e.g. Redis or memcached, or use RECIPE_SEARCH_BACKEND = 'database'. Otherwise "
+             "changes made by other processes (management commands, other workers) are never seen by the search",
+        id='recipes.W001',
+    )]
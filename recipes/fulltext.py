@@ -0,0 +1,246 @@
+"""
+Full-text search over recipe names, ingredient names and instructions (Recipe.plain_text).
+Uses an FTS5 table on SQLite and a tsvector column with a GIN index on PostgreSQL, see migration 0005.
+
+Both are fed text that has already been folded and stemmed here (analyze), so Norwegian is handled the same way on
+either database: ø/æ/å are folded as in slugify_norwegian and common inflection suffixes are stripped
+("tomatene" and "tomater" are both indexed as "tomat"). Every search term is a prefix query.
+The index is kept current by the signals in recipes.signals, which call schedule().
+Searches join it to the recipe query (see RecipeTextIndex), so they can be combined with other filters and paginated
+in the database.
+"""
+import re
+import threading
+import unicodedata
+import uuid
+
+from django.db import connection, transaction, NotSupportedError
+from django.db.models import Value, FloatField, Q, Lookup, Func
+
+from recipes.models import Recipe, RecipeIngredient, RecipeTextIndex, TextDocumentField
+
+TABLE = RecipeTextIndex._meta.db_table
+
+_FOLDING = str.maketrans({'ø': 'o', 'æ': 'a', 'å': 'a'})
+# inflection suffixes, from step 1 of the Snowball Norwegian stemmer (folded). Longest first
+_SUFFIXES = sorted((
+    'a', 'e', 'ede', 'ande', 'ende', 'ane', 'ene', 'hetene', 'en', 'heten', 'ar', 'er', 'heter', 'as', 'es', 'edes',
+    'endes', 'enes', 'hetenes', 'ens', 'hetens', 'ers', 'ets', 'et', 'het', 'ast', 'erte', 'ert',
+), key=len, reverse=True)
+_MIN_STEM = 3
+
+
+def fold(text):
+    """ Lowercase, with ø/æ/å folded as in slugify_norwegian and other accents removed """
+    text = unicodedata.normalize('NFKD', text.lower().translate(_FOLDING))
+    return ''.join(char for char in text if not unicodedata.combining(char))
+
+
+def stem(word):
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= _MIN_STEM:
+            return word[:-len(suffix)]
+    if word.endswith('s') and len(word) > _MIN_STEM and word[-2] in 'bcdfghjlmnoprtvyz':
+        return word[:-1]
+    return word
+
+
+def analyze(text):
+    """ :return: the folded and stemmed terms of text """
+    return [stem(word) for word in re.findall(r'[^\W_]+', fold(text or ''))]
+
+
+def _document(text):
+    return ' '.join(analyze(text))
+
+
+class SqliteBackend:
+    # bm25 weights per column: recipe_id, name, ingredients, content
+    WEIGHTS = (0.0, 10.0, 5.0, 1.0)
+
+    @staticmethod
+    def db_id(recipe_id):
+        return uuid.UUID(str(recipe_id)).hex  # how Django stores UUIDFields on SQLite
+
+    def create(self, cursor):
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE {TABLE} USING fts5(recipe_id UNINDEXED, name, ingredients, content, "
+            f"tokenize='unicode61 remove_diacritics 2')"
+        )
+
+    def drop(self, cursor):
+        cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+    def delete(self, cursor, recipe_ids):
+        cursor.execute(f"DELETE FROM {TABLE} WHERE recipe_id IN ({', '.join(['%s'] * len(recipe_ids))})",
+                       [self.db_id(recipe_id) for recipe_id in recipe_ids])
+
+    def insert(self, cursor, documents):
+        cursor.executemany(
+            f"INSERT INTO {TABLE} (recipe_id, name, ingredients, content) VALUES (%s, %s, %s, %s)",
+            [(self.db_id(recipe_id), *texts) for recipe_id, *texts in documents],
+        )
+
+    def match(self, table, terms):
+        """
+        :param table: the (quoted) alias of the index table in the query
+        :return: (sql, params) of the condition
+        """
+        # the rank column is bm25() with the given weights. Unlike bm25(), it can be compared and grouped by
+        weights = ', '.join(map(str, self.WEIGHTS))
+        return f"({table} MATCH %s AND {table}.rank MATCH %s)", [' '.join(f'"{term}"*' for term in terms),
+                                                                 f'bm25({weights})']
+
+    def rank(self, table, terms):
+        """ :return: (sql, params) of the rank of matched rows, lower is better """
+        return f"{table}.rank", []
+
+
+class PostgresBackend:
+    # name, ingredients and content are weighted A, B and C by ts_rank_cd
+
+    @staticmethod
+    def db_id(recipe_id):
+        return uuid.UUID(str(recipe_id))
+
+    def create(self, cursor):
+        cursor.execute(f"CREATE TABLE {TABLE} (recipe_id uuid PRIMARY KEY, document tsvector NOT NULL)")
+        cursor.execute(f"CREATE INDEX {TABLE}_document ON {TABLE} USING GIN (document)")
+
+    def drop(self, cursor):
+        cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+    def delete(self, cursor, recipe_ids):
+        cursor.execute(f"DELETE FROM {TABLE} WHERE recipe_id = ANY(%s)",
+                       [[self.db_id(recipe_id) for recipe_id in recipe_ids]])
+
+    def insert(self, cursor, documents):
+        cursor.executemany(
+            f"INSERT INTO {TABLE} (recipe_id, document) VALUES (%s, "
+            f"setweight(to_tsvector('simple', %s), 'A') || setweight(to_tsvector('simple', %s), 'B') || "
+            f"setweight(to_tsvector('simple', %s), 'C'))",
+            [(self.db_id(recipe_id), *texts) for recipe_id, *texts in documents],
+        )
+
+    @staticmethod
+    def _query(terms):
+        return ' & '.join(f"'{term}':*" for term in terms)
+
+    def match(self, table, terms):
+        return f"{table}.document @@ to_tsquery('simple', %s)", [self._query(terms)]
+
+    def rank(self, table, terms):
+        return f"-ts_rank_cd({table}.document, to_tsquery('simple', %s))", [self._query(terms)]
+
+
+BACKENDS = {'sqlite': SqliteBackend(), 'postgresql': PostgresBackend()}
+
+
+def get_backend(conn=connection):
+    """ :return: the backend for the database, or None if it has no full-text index (searches fall back to LIKE) """
+    return BACKENDS.get(conn.vendor)
+
+
+def documents(recipes, recipe_ingredients):
+    """
+    :param recipes: (id, name, plain text) of each recipe
+    :param recipe_ingredients: (recipe id, name, base ingredient name) of their ingredients
+    :return: (id, name, ingredients, content) rows to index
+    """
+    ingredients = {}
+    for recipe_id, name, base_name in recipe_ingredients:
+        ingredients.setdefault(recipe_id, []).extend(n for n in (name, base_name) if n)
+    return [
+        (recipe_id, _document(name), _document(' '.join(ingredients.get(recipe_id, ()))), _document(text))
+        for recipe_id, name, text in recipes
+    ]
+
+
+def index_recipes(recipe_ids):
+    """ (Re)index the recipes. Ids of recipes that no longer exist are removed from the index """
+    backend = get_backend()
+    recipe_ids = list(recipe_ids)
+    if backend is None or not recipe_ids:
+        return
+    recipes = Recipe.objects.filter(id__in=recipe_ids).order_by().values_list('id', 'name', 'plain_text')
+    rows = RecipeIngredient.objects.filter(recipe_id__in=recipe_ids).order_by()\
+        .values_list('recipe_id', 'name', 'base_ingredient__name')
+    docs = documents(recipes, rows)
+    with transaction.atomic(), connection.cursor() as cursor:
+        backend.delete(cursor, recipe_ids)
+        if docs:
+            backend.insert(cursor, docs)
+
+
+_pending = threading.local()
+
+
+def schedule(recipe_id):
+    """
+    Reindex the recipe when the current transaction commits (immediately outside of transactions), so that saving a
+    recipe along with all of its ingredients reindexes it once.
+    """
+    if not hasattr(_pending, 'ids'):
+        _pending.ids = set()
+    _pending.ids.add(recipe_id)
+    transaction.on_commit(flush)
+
+
+def flush():
+    ids = getattr(_pending, 'ids', None)
+    if ids:
+        _pending.ids = set()
+        index_recipes(ids)
+
+
+def _index_table(compiler, connection, document):
+    """ :return: the quoted alias of the index table, see RecipeTextIndex """
+    backend = get_backend(connection)
+    if backend is None:
+        raise NotSupportedError(f"No full-text index on {connection.vendor}")
+    return backend, compiler.quote_name_unless_alias(document.alias)
+
+
+@TextDocumentField.register_lookup
+class Match(Lookup):
+    """ text_index__document__match=terms: the recipe's document contains every term (see analyze) """
+    lookup_name = 'match'
+    prepare_rhs = False
+
+    def as_sql(self, compiler, connection):
+        backend, table = _index_table(compiler, connection, self.lhs)
+        return backend.match(table, self.rhs)
+
+
+class TextRank(Func):
+    """ Rank of the recipe's document in a query filtered with the match lookup, lower is better """
+    output_field = FloatField()
+
+    def __init__(self, document, terms):
+        super().__init__(document)
+        self.terms = terms
+
+    def as_sql(self, compiler, connection, **extra_context):
+        backend, table = _index_table(compiler, connection, self.source_expressions[0])
+        return backend.rank(table, self.terms)
+
+
+def search(text, limit=None):
+    """ :return: ids of the recipes matching every term of text, best match (BM25 on SQLite) first """
+    recipes = rank_recipes(Recipe.objects.all(), text).order_by('text_rank', 'id')
+    return list(recipes.values_list('id', flat=True)[:limit])
+
+
+def rank_recipes(recipes, text):
+    """
+    :return: the recipes matching every term of text, annotated with text_rank. Order by it for most relevant first
+    """
+    terms = analyze(text)
+    if not terms:
+        return recipes.none().annotate(text_rank=Value(0.0, output_field=FloatField()))
+    if get_backend() is None:
+        for word in re.findall(r'[^\W_]+', text):
+            recipes = recipes.filter(Q(name__icontains=word) | Q(plain_text__icontains=word))
+        return recipes.annotate(text_rank=Value(0.0, output_field=FloatField()))
+    return recipes.filter(text_index__document__match=terms)\
+        .annotate(text_rank=TextRank('text_index__document', terms))
@@ -0,0 +1,163 @@
+"""
+Background scraping. Jobs are ScrapeJob rows, so their state survives restarts and is visible in the admin, and
+are run by a thread pool in the web process, or as tasks on the event loop when submitted by async views (asubmit).
+Pending jobs left behind by a stopped process are picked up by manage.py run_scrape_jobs.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import IntegrityError, transaction, close_old_connections
+from django.utils import timezone
+
+from kokebok.asynchronous import database_sync_to_async
+from recipes.models import ScrapeJob
+from scrape.scrape import scrape, scrape_async
+from scrape.utils import create_recipe_from_scrape
+
+_executor = None
+_executor_lock = threading.Lock()
+_tasks = set()  # the event loop only keeps weak references to tasks
+
+
+def get_executor():
+    """ :return: the process' worker pool, or None if SCRAPE_JOB_WORKERS is 0 and jobs run in the caller's thread """
+    global _executor
+    if not settings.SCRAPE_JOB_WORKERS:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(settings.SCRAPE_JOB_WORKERS, thread_name_prefix='scrape-job')
+        return _executor
+
+
+def submit(url):
+    """
+    Queues a job scraping the url, or returns the job already pending or running for it.
+    The job is started once the current transaction commits.
+    :return: ScrapeJob
+    """
+    job, created = _get_or_create(url)
+    if created:
+        transaction.on_commit(lambda: start(job.id))
+    return job
+
+
+async def asubmit(url):
+    """
+    submit() for async views. The job runs as a task on the event loop rather than in the worker pool, see arun.
+    It is awaited instead if SCRAPE_JOB_WORKERS is 0.
+    :return: ScrapeJob
+    """
+    job, created = await database_sync_to_async(_get_or_create)(url)
+    if created:
+        if settings.SCRAPE_JOB_WORKERS:
+            task = asyncio.create_task(arun(job.id))
+            _tasks.add(task)
+            task.add_done_callback(_tasks.discard)
+        else:
+            await arun(job.id)
+    return job
+
+
+def _get_or_create(url):
+    """ :return: (the job pending or running for the url, whether it was created) """
+    job = ScrapeJob.objects.filter(url=url, status__in=ScrapeJob.IN_FLIGHT).first()
+    if job is not None:
+        return job, False
+    try:
+        with transaction.atomic():
+            return ScrapeJob.objects.create(url=url), True
+    except IntegrityError:  # submitted concurrently
+        return ScrapeJob.objects.get(url=url, status__in=ScrapeJob.IN_FLIGHT), False
+
+
+def start(job_id):
+    executor = get_executor()
+    if executor is None:
+        run(job_id)
+    else:
+        executor.submit(_run_in_thread, job_id)
+
+
+def _run_in_thread(job_id):
+    try:
+        run(job_id)
+    finally:
+        close_old_connections()  # each worker thread has its own connection
+
+
+def run(job_id):
+    """ Runs the job if it is still pending. Failures are recorded on the job """
+    job, timings = _claim(job_id)
+    if job is None:
+        return  # claimed by another worker
+    try:
+        with _timed(timings, 'scrape_seconds'):  # fetching and parsing
+            scrape_dict = scrape(job.url)
+        with _timed(timings, 'save_seconds'):
+            recipe = create_recipe_from_scrape(scrape_dict)
+        result = {'status': ScrapeJob.Status.DONE, 'recipe': recipe}
+    except Exception as e:  # recorded on the job, for the status page and admin
+        result = {'status': ScrapeJob.Status.FAILED, 'error': f"{type(e).__name__}: {e}"}
+    _finish(job_id, timings, result)
+
+
+async def arun(job_id):
+    """ run() on the event loop. The page is fetched with the async HTTP client, parsing and saving run in threads """
+    job, timings = await database_sync_to_async(_claim)(job_id)
+    if job is None:
+        return
+    try:
+        with _timed(timings, 'scrape_seconds'):
+            scrape_dict = await scrape_async(job.url)
+        with _timed(timings, 'save_seconds'):
+            recipe = await database_sync_to_async(create_recipe_from_scrape)(scrape_dict)
+        result = {'status': ScrapeJob.Status.DONE, 'recipe': recipe}
+    except Exception as e:
+        result = {'status': ScrapeJob.Status.FAILED, 'error': f"{type(e).__name__}: {e}"}
+    await database_sync_to_async(_finish)(job_id, timings, result)
+
+
+def _claim(job_id):
+    """ :return: (the job, its timings so far) if it was pending and is now running. (None, None) otherwise """
+    started = timezone.now()
+    if not ScrapeJob.objects.filter(id=job_id, status=ScrapeJob.Status.PENDING)\
+            .update(status=ScrapeJob.Status.RUNNING, datetime_started=started):
+        return None, None
+    job = ScrapeJob.objects.get(id=job_id)
+    return job, {'queued_seconds': (started - job.datetime_created).total_seconds()}
+
+
+@contextmanager
+def _timed(timings, stage):
+    """ Records the duration of the stage in timings, also if it fails """
+    start_time = time.monotonic()
+    try:
+        yield
+    finally:
+        timings[stage] = time.monotonic() - start_time
+
+
+def _finish(job_id, timings, result):
+    ScrapeJob.objects.filter(id=job_id).update(datetime_finished=timezone.now(), **timings, **result)
+
+
+def submit_pending():
+    """ Starts every pending job. :return: their ids """
+    job_ids = list(ScrapeJob.objects.filter(status=ScrapeJob.Status.PENDING).values_list('id', flat=True))
+    for job_id in job_ids:
+        start(job_id)
+    return job_ids
+
+
+def shutdown():
+    """ Waits for the started jobs to finish """
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
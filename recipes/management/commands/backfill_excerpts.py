@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = "Compute the plain text and excerpt of every recipe. Saving a recipe does this for that recipe"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        chunk, done = [], 0
+        for recipe in Recipe.objects.order_by().only('id', 'content').iterator(chunk_size=options['chunk_size']):
+            recipe.update_text()
+            chunk.append(recipe)
+            if len(chunk) >= options['chunk_size']:
+                done += self.save(chunk)
+                chunk = []
+        done += self.save(chunk)
+        self.stdout.write(self.style.SUCCESS(f"Updated {done} recipes"))
+
+    @staticmethod
+    def save(recipes):
+        with transaction.atomic():  # bulk_update leaves datetime_updated alone
+            Recipe.objects.bulk_update(recipes, ['plain_text', 'excerpt'])
+        return len(recipes)
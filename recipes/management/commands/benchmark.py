@@ -0,0 +1,149 @@
+import json
+import random
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from recipes import caching
+from recipes.models import Recipe, Ingredient
+from recipes.views import search, RecipeListView, RecipeDetailView
+from scrape.utils import create_recipe_from_scrape
+
+
+def summarize(timings, query_counts=None):
+    """ :return: latency percentiles in milliseconds, and the query counts if given """
+    ms = sorted(t * 1000 for t in timings)
+    quantiles = statistics.quantiles(ms, n=100, method='inclusive') if len(ms) > 1 else ms * 99
+    summary = {
+        'runs': len(ms),
+        'mean_ms': round(statistics.fmean(ms), 3),
+        'p50_ms': round(quantiles[49], 3),
+        'p90_ms': round(quantiles[89], 3),
+        'p99_ms': round(quantiles[98], 3),
+        'max_ms': round(ms[-1], 3),
+    }
+    if query_counts:
+        summary.update({'queries_min': min(query_counts), 'queries_max': max(query_counts)})
+    return summary
+
+
+def invalidate_result_caches(recipes):
+    """
+    The cached search results and pages of the recipes. Rather than cache.clear(), which would drop the version stamps
+    of the in-memory indexes too, and so rebuild them on every run
+    """
+    caching.invalidate_search()
+    for recipe in recipes:
+        caching.invalidate_recipe_detail(recipe.id)
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=settings.BASE_DIR).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = "Time the search, listing, detail and scrape import code paths on the current data, and write the " \
+           "latency percentiles and query counts as JSON. See manage.py generate_catalogue for test data"
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--repeat', type=int, default=50, help="runs per scenario")
+        parser.add_argument('-o', '--output', help="file to write the results to. Default stdout")
+        parser.add_argument('--seed', type=int, default=0, help="picks the searched ingredients and recipes")
+        parser.add_argument('--warm-cache', action='store_true',
+                            help="keep the result caches between runs. By default they are cleared before each run")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        popular = list(
+            Ingredient.objects.annotate(usages=Count('recipe_usages')).filter(usages__gt=0)
+            .order_by('-usages', 'id').values_list('name', flat=True)[:50]
+        )
+        recipes = list(Recipe.objects.order_by('id').only('id', 'slug'))
+        if len(popular) < 3 or not recipes:
+            raise CommandError("Not enough data. Add some with manage.py generate_catalogue")
+
+        factory = RequestFactory()
+        searches = [','.join(rng.sample(popular, rng.randint(2, 6))) for _ in range(options['repeat'])]
+        details = [rng.choice(recipes) for _ in range(options['repeat'])]
+        pages = [rng.randint(1, max(1, len(recipes) // RecipeListView.paginate_by)) for _ in range(options['repeat'])]
+        scenarios = {
+            f'search_{mode}': [
+                lambda query=query, params=params: search(factory.get('/', {'ingredients': query, **params}))
+                for query in searches
+            ]
+            for mode, params in (
+                ('exclusive', {'exclusive': 'exclusive', 'sort_by': 'alphabetical'}),
+                ('inclusive', {'exclusive': 'inclusive', 'sort_by': 'alphabetical'}),
+                ('best_match', {'exclusive': 'inclusive', 'sort_by': 'best_match'}),
+            )
+        }
+        scenarios['recipe_list'] = [
+            lambda page=page: RecipeListView.as_view()(factory.get('/recipes/', {'page': page})).render()
+            for page in pages
+        ]
+        scenarios['recipe_detail'] = [
+            lambda recipe=recipe: RecipeDetailView.as_view()(
+                factory.get(recipe.get_absolute_url()), uuid=recipe.id, slug=recipe.slug
+            ).render()
+            for recipe in details
+        ]
+        scenarios['create_recipe_from_scrape'] = [
+            lambda i=i: self.create_recipe(rng, popular, i) for i in range(options['repeat'])
+        ]
+
+        results = {}
+        for name, runs in scenarios.items():
+            self.stderr.write(f"{name}...")
+            runs[0]()  # warm up: builds the in-memory indexes
+            timings, query_counts = [], []
+            for run in runs:
+                if not options['warm_cache']:
+                    invalidate_result_caches(details)
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    run()
+                    timings.append(time.perf_counter() - start)
+                query_counts.append(len(queries))
+            results[name] = summarize(timings, query_counts)
+
+        report = {
+            'revision': git_revision(),
+            'time': datetime.now(timezone.utc).isoformat(),
+            'database': connection.vendor,
+            'search_backend': settings.RECIPE_SEARCH_BACKEND,
+            'warm_cache': options['warm_cache'],
+            'recipes': len(recipes),
+            'ingredients': Ingredient.objects.count(),
+            'results': results,
+        }
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
+
+    @staticmethod
+    def create_recipe(rng, ingredients, i):
+        """ Imports a scraped recipe, then rolls it back so runs don't affect each other """
+        scrape_dict = {
+            'name': f'benchmark {i}',
+            'content': '<p>Stek alt i en panne.</p>',
+            'serves': 4,
+            'ami': [(rng.randint(1, 5), 'dl', name) for name in rng.sample(ingredients, min(8, len(ingredients)))],
+        }
+        with transaction.atomic():
+            create_recipe_from_scrape(scrape_dict)
+            transaction.set_rollback(True)
@@ -0,0 +1,67 @@
+import os
+import time
+import tracemalloc
+
+from bs4 import BeautifulSoup
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from scrape.http import CHUNK_SIZE
+from scrape.parsing import extract_json_ld_recipe
+from scrape.schema_org import scrape_json_ld
+from scrape.scrape import get_sites
+
+FIXTURES_DIR = os.path.join(settings.BASE_DIR, 'scrape', 'fixtures')
+
+
+def soup_parser(backend):
+    def parse(html, site):
+        return get_sites()[site](BeautifulSoup(html.lower(), backend))
+    return parse
+
+
+def json_ld_parser(html, site):
+    chunks = (html[i:i + CHUNK_SIZE] for i in range(0, len(html), CHUNK_SIZE))
+    recipe, _ = extract_json_ld_recipe(chunks)
+    return scrape_json_ld(recipe)
+
+
+def available_parsers(site, html):
+    parsers = {'soup (html.parser)': soup_parser('html.parser')}
+    try:
+        import lxml  # noqa: F401
+        parsers['soup (lxml)'] = soup_parser('lxml')
+    except ImportError:
+        pass
+    if extract_json_ld_recipe([html])[0] is not None:
+        parsers['json-ld stream'] = json_ld_parser
+    return parsers
+
+
+class Command(BaseCommand):
+    help = "Compare time and peak memory per page of the scrape parsers on saved pages named <site>.html"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fixtures-dir', default=FIXTURES_DIR)
+        parser.add_argument('-n', '--repeat', type=int, default=50)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'page':<10} {'parser':<20} {'ms/page':>10} {'peak KiB':>10}")
+        for site in get_sites():
+            path = os.path.join(options['fixtures_dir'], f'{site}.html')
+            if not os.path.exists(path):
+                self.stderr.write(f"No saved page for {site} at {path}")
+                continue
+            with open(path, encoding='utf-8') as f:
+                html = f.read()
+            for name, parse in available_parsers(site, html).items():
+                start = time.perf_counter()
+                for _ in range(options['repeat']):
+                    parse(html, site)
+                ms = (time.perf_counter() - start) / options['repeat'] * 1000
+
+                tracemalloc.start()
+                parse(html, site)
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                self.stdout.write(f"{site:<10} {name:<20} {ms:>10.2f} {peak / 1024:>10.1f}")
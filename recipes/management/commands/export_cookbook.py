@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from recipes.jsonl import export_lines, open_file, CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = "Export all recipes and ingredients, with the ingredient tree, as JSON Lines. Read back with " \
+           "manage.py import_cookbook"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="file to write. Gzip compressed if it ends in .gz. '-' for stdout")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="rows loaded at a time")
+
+    def handle(self, *args, **options):
+        lines = export_lines(chunk_size=options['chunk_size'])
+        if options['path'] == '-':
+            for line in lines:
+                self.stdout.write(line)
+            return
+        count = 0
+        with open_file(options['path'], 'w') as f:
+            for count, line in enumerate(lines):
+                f.write(line + '\n')
+        self.stderr.write(self.style.SUCCESS(f"Exported {count} objects to {options['path']}"))
@@ -0,0 +1,129 @@
+import random
+from itertools import accumulate
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+
+from recipes import caching, fulltext
+from recipes.models import Recipe, Ingredient, RecipeIngredient
+from recipes.signals import invalidate_indexes
+
+WORDS = (
+    'stek', 'kok', 'hakk', 'rør', 'visp', 'server', 'smak', 'til', 'med', 'salt', 'pepper', 'i', 'en', 'panne',
+    'gryte', 'ovnen', 'minutter', 'på', 'middels', 'varme', 'til', 'det', 'er', 'gyllent', 'og', 'mørt', 'ferdig',
+)
+MEASUREMENTS = [value for value, _ in RecipeIngredient.Measurements.choices if value is not None]
+
+
+class Command(BaseCommand):
+    help = "Add a synthetic catalogue of recipes and ingredients, for benchmarking. See manage.py benchmark"
+
+    def add_arguments(self, parser):
+        parser.add_argument('-r', '--recipes', type=int, default=1000)
+        parser.add_argument('-i', '--ingredients', type=int, default=500)
+        parser.add_argument('--per-recipe', type=int, default=8, help="mean number of ingredients per recipe")
+        parser.add_argument('--zipf', type=float, default=1.1,
+                            help="exponent s of the Zipf distribution of ingredient usage. Higher is more skewed")
+        parser.add_argument('--ubiquitous', type=float, default=0.03,
+                            help="share of the ingredients, the most used ones, marked as ubiquitous")
+        parser.add_argument('--children', type=float, default=0.4,
+                            help="share of the ingredients that are varieties of another ingredient")
+        parser.add_argument('--max-depth', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=0,
+                            help="names include it, so catalogues with different seeds can be added to one database")
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            ingredients = self.create_ingredients(rng, options)
+            recipe_ids = self.create_recipes(rng, ingredients, options)
+            transaction.on_commit(invalidate_indexes)  # written in bulk, without signals
+        for i in range(0, len(recipe_ids), options['chunk_size']):
+            fulltext.index_recipes(recipe_ids[i:i + options['chunk_size']])
+        caching.invalidate_search()  # again, for the text searches cached before the recipes were indexed
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {len(ingredients)} ingredients and {len(recipe_ids)} recipes"
+        ))
+
+    def create_ingredients(self, rng, options):
+        """
+        Ingredients are created with their tree fields set directly: a random share become children of an earlier
+        ingredient, and the nested sets are numbered by walking each tree.
+        :return: the ingredients, most used (per the Zipf distribution) first
+        """
+        count, prefix = options['ingredients'], f'ingredient {options["seed"]}-'
+        parents, levels, children = [None] * count, [0] * count, [[] for _ in range(count)]
+        for i in range(1, count):
+            if rng.random() < options['children']:
+                parent = rng.randrange(i)
+                if levels[parent] < options['max_depth']:
+                    parents[i], levels[i] = parent, levels[parent] + 1
+                    children[parent].append(i)
+
+        next_tree_id = (Ingredient.objects.aggregate(Max('tree_id'))['tree_id__max'] or 0) + 1
+        tree_fields = {}  # index -> (tree_id, lft, rght)
+        for root in (i for i in range(count) if parents[i] is None):
+            self.number_tree(root, children, next_tree_id, tree_fields)
+            next_tree_id += 1
+
+        popularity = list(range(count))
+        rng.shuffle(popularity)
+        ubiquitous = set(popularity[:round(count * options['ubiquitous'])])
+        Ingredient.objects.bulk_create(
+            (Ingredient(name=f'{prefix}{i}', ubiquitous=i in ubiquitous, level=levels[i], tree_id=tree_fields[i][0],
+                        lft=tree_fields[i][1], rght=tree_fields[i][2]) for i in range(count)),
+            batch_size=options['chunk_size'],
+        )
+        ids = dict(Ingredient.objects.filter(name__startswith=prefix).values_list('name', 'id'))
+        created = Ingredient.objects.in_bulk(ids.values())
+        for i, parent in enumerate(parents):
+            if parent is not None:
+                created[ids[f'{prefix}{i}']].parent_id = ids[f'{prefix}{parent}']
+        Ingredient.objects.bulk_update(created.values(), ['parent'], batch_size=options['chunk_size'])
+        return [created[ids[f'{prefix}{i}']] for i in popularity]
+
+    @staticmethod
+    def number_tree(root, children, tree_id, tree_fields):
+        """ Assigns the nested set numbers (lft, rght) of MPTT by a depth first walk """
+        counter, stack = 1, [(root, 1, iter(children[root]))]
+        while stack:
+            node, lft, remaining = stack[-1]
+            child = next(remaining, None)
+            counter += 1
+            if child is None:
+                tree_fields[node] = (tree_id, lft, counter)
+                stack.pop()
+            else:
+                stack.append((child, counter, iter(children[child])))
+
+    def create_recipes(self, rng, ingredients, options):
+        """ :return: ids of the created recipes """
+        weights = list(accumulate(1 / rank ** options['zipf'] for rank in range(1, len(ingredients) + 1)))
+        recipe_ids = []
+        for start in range(0, options['recipes'], options['chunk_size']):
+            recipes, rows = [], []
+            for i in range(start, min(start + options['chunk_size'], options['recipes'])):
+                content = ''.join(
+                    f"<p>{' '.join(rng.choices(WORDS, k=rng.randint(6, 20))).capitalize()}.</p>"
+                    for _ in range(rng.randint(2, 6))
+                )
+                recipe = Recipe(name=f'recipe {options["seed"]}-{i}', content=content, serves=rng.choice((2, 4, 6)))
+                recipe.slug = recipe.name.replace(' ', '-')
+                recipe.update_text()  # bulk_create doesn't call save()
+                recipes.append(recipe)
+                size = max(1, round(rng.gauss(options['per_recipe'], options['per_recipe'] / 3)))
+                chosen = rng.choices(ingredients, cum_weights=weights, k=size)
+                used = {ingredient.id: ingredient for ingredient in chosen}  # distinct
+                rows.extend(
+                    RecipeIngredient(recipe=recipe, base_ingredient=ingredient, name=ingredient.name,
+                                     amount_per_serving=round(rng.uniform(0.1, 5), 1),
+                                     measurement=rng.choice(MEASUREMENTS))
+                    for ingredient in used.values()
+                )
+            Recipe.objects.bulk_create(recipes)
+            RecipeIngredient.objects.bulk_create(rows, batch_size=options['chunk_size'])
+            recipe_ids.extend(recipe.id for recipe in recipes)
+            self.stdout.write(f"{len(recipe_ids)} recipes")
+        return recipe_ids
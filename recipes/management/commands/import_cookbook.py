@@ -0,0 +1,26 @@
+import sys
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.jsonl import import_lines, open_file, CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = "Import recipes and ingredients exported with manage.py export_cookbook. Recipes and ingredients that " \
+           "already exist (same id / name) are updated, so importing the same file twice changes nothing"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="file to read. Gzip compressed if it ends in .gz. '-' for stdin")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="objects saved at a time")
+
+    def handle(self, *args, **options):
+        try:
+            if options['path'] == '-':
+                stats = import_lines(sys.stdin, chunk_size=options['chunk_size'])
+            else:
+                with open_file(options['path']) as f:
+                    stats = import_lines(f, chunk_size=options['chunk_size'])
+        except (OSError, ValueError, ValidationError) as e:
+            raise CommandError(e)
+        self.stdout.write(self.style.SUCCESS(str(stats)))
@@ -0,0 +1,133 @@
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.urls import reverse
+
+from recipes.management.commands.benchmark import summarize, git_revision
+from recipes.models import Recipe, Ingredient
+from recipes.views import RecipeListView
+
+# share of the requests going to each kind of page
+MIX = {'search': 0.5, 'recipe_detail': 0.35, 'recipe_list': 0.15}
+
+
+class Command(BaseCommand):
+    help = "Load test running servers with the same mix of search, recipe and listing pages, and write their " \
+           "requests per second and latency percentiles as JSON. To compare WSGI and ASGI, serve this database " \
+           "with both (e.g. gunicorn kokebok.wsgi -b :8000 and uvicorn kokebok.asgi:application --port 8001) and " \
+           "run: manage.py loadtest wsgi=http://127.0.0.1:8000 asgi=http://127.0.0.1:8001"
+
+    def add_arguments(self, parser):
+        parser.add_argument('targets', nargs='+', metavar='NAME=URL', help="servers to test, one after the other")
+        parser.add_argument('-n', '--requests', type=int, default=1000, help="requests per server")
+        parser.add_argument('-c', '--concurrency', type=int, default=16, help="requests in flight at once")
+        parser.add_argument('--warmup', type=int, default=50, help="requests per server before measuring")
+        parser.add_argument('--seed', type=int, default=0, help="picks the pages. Every server gets the same ones")
+        parser.add_argument('-o', '--output', help="file to write the results to. Default stdout")
+
+    def handle(self, *args, **options):
+        targets = {}
+        for target in options['targets']:
+            name, sep, url = target.partition('=')
+            if not sep or not url.startswith(('http://', 'https://')):
+                raise CommandError(f"Expected NAME=URL, got {target}")
+            targets[name] = url.rstrip('/')
+
+        rng = random.Random(options['seed'])
+        paths = self.paths(rng, options['warmup'] + options['requests'])
+        results = {}
+        for name, base_url in targets.items():
+            self.stderr.write(f"{name}...")
+            self.load(base_url, paths[:options['warmup']], options['concurrency'])
+            results[name] = self.load(base_url, paths[options['warmup']:], options['concurrency'])
+
+        first, *others = results
+        report = {
+            'revision': git_revision(),
+            'time': datetime.now(timezone.utc).isoformat(),
+            'recipes': Recipe.objects.count(),
+            'concurrency': options['concurrency'],
+            'results': results,
+            'compared_to': first,  # ratios to the first server
+            'comparison': {
+                name: {
+                    'requests_per_second': round(
+                        results[name]['requests_per_second'] / results[first]['requests_per_second'], 3),
+                    'p99': round(results[name]['latency']['p99_ms'] / results[first]['latency']['p99_ms'], 3),
+                }
+                for name in others
+            },
+        }
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
+
+    @staticmethod
+    def paths(rng, count):
+        """ :return: (kind of page, path) of count requests, mixed as in MIX """
+        popular = list(
+            Ingredient.objects.annotate(usages=Count('recipe_usages')).filter(usages__gt=0)
+            .order_by('-usages', 'id').values_list('name', flat=True)[:50]
+        )
+        recipes = list(Recipe.objects.order_by('id').only('id', 'slug'))
+        if len(popular) < 2 or not recipes:
+            raise CommandError("Not enough data. Add some with manage.py generate_catalogue")
+        pages = max(1, len(recipes) // RecipeListView.paginate_by)
+        make_path = {
+            'search': lambda: reverse('search') + '?' + urlencode({
+                'ingredients': ','.join(rng.sample(popular, rng.randint(2, min(6, len(popular))))),
+                'exclusive': rng.choice(('exclusive', 'inclusive')),
+                'sort_by': rng.choice(('alphabetical', 'best_match')),
+            }),
+            'recipe_detail': lambda: rng.choice(recipes).get_absolute_url(),
+            'recipe_list': lambda: reverse('recipe_list') + f'?page={rng.randint(1, pages)}',
+        }
+        kinds = rng.choices(list(MIX), weights=list(MIX.values()), k=count)
+        return [(kind, make_path[kind]()) for kind in kinds]
+
+    @staticmethod
+    def load(base_url, paths, concurrency):
+        """ Requests the paths, concurrency at a time. Each thread has a keep-alive session """
+        local = threading.local()
+        sessions = []
+
+        def get(kind, path):
+            if not hasattr(local, 'session'):
+                local.session = requests.Session()
+                sessions.append(local.session)
+            start = time.perf_counter()
+            try:
+                ok = local.session.get(base_url + path, timeout=60).ok
+            except requests.RequestException:
+                ok = False
+            return kind, time.perf_counter() - start, ok
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            responses = list(pool.map(lambda request: get(*request), paths))
+        elapsed = time.perf_counter() - start
+        for session in sessions:
+            session.close()
+        if not responses:
+            return {}
+
+        timings = {}
+        for kind, timing, _ in responses:
+            timings.setdefault(kind, []).append(timing)
+        return {
+            'requests': len(responses),
+            'errors': sum(not ok for *_, ok in responses),
+            'requests_per_second': round(len(responses) / elapsed, 3),
+            'latency': summarize([timing for _, timing, _ in responses]),
+            'pages': {kind: summarize(kind_timings) for kind, kind_timings in timings.items()},
+        }
@@ -0,0 +1,85 @@
+import json
+import os
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe
+from scrape.bulk import scrape_many
+from scrape.utils import hash_scrape, update_recipe_from_scrape
+
+
+class Command(BaseCommand):
+    help = "Re-scrape every recipe with an origin url, and update those whose scraped data changed. Resumable"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=200)
+        parser.add_argument('-w', '--workers', type=int, default=8, help="max concurrent fetches")
+        parser.add_argument('-r', '--rate', type=float, default=2.0,
+                            help="max requests per second per domain. 0 for no limit")
+        parser.add_argument('--checkpoint', default='refresh_recipes.checkpoint',
+                            help="file recording progress. An interrupted run continues from it")
+        parser.add_argument('--restart', action='store_true', help="ignore the checkpoint and start over")
+        parser.add_argument('--offline', action='store_true', help="only use pages from the response cache")
+        parser.add_argument('--force', action='store_true',
+                            help="also update recipes scraped before their hash was stored. Their edits are lost")
+
+    def handle(self, *args, **options):
+        checkpoint = options['checkpoint']
+        state = {'last_id': None, 'updated': 0, 'unchanged': 0, 'failed': 0}
+        if os.path.exists(checkpoint) and not options['restart']:
+            with open(checkpoint) as f:
+                state = json.load(f)
+            self.stdout.write(f"Continuing after recipe {state['last_id']}")
+
+        recipes = Recipe.objects.exclude(origin_url__isnull=True).exclude(origin_url='').order_by('id')
+        start, done = time.monotonic(), 0
+        while True:
+            chunk = recipes.filter(id__gt=state['last_id']) if state['last_id'] else recipes
+            chunk = list(chunk.only('id', 'origin_url', 'scrape_hash', 'slug')[:options['chunk_size']])
+            if not chunk:
+                break
+            self.refresh(chunk, state, options)
+            state['last_id'] = str(chunk[-1].id)
+            self.save_checkpoint(checkpoint, state)
+            done += len(chunk)
+            rate = done / (time.monotonic() - start)
+            self.stdout.write(
+                f"{done} recipes ({rate:.1f}/s): {state['updated']} updated, {state['unchanged']} unchanged, "
+                f"{state['failed']} failed"
+            )
+
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        self.stdout.write(self.style.SUCCESS(
+            f"Done. {state['updated']} updated, {state['unchanged']} unchanged, {state['failed']} failed"
+        ))
+
+    def refresh(self, chunk, state, options):
+        by_url = defaultdict(list)
+        for recipe in chunk:
+            by_url[recipe.origin_url].append(recipe)
+        results = scrape_many(by_url, workers=options['workers'], per_domain_rate=options['rate'] or None,
+                              offline=options['offline'])
+        for result in results:
+            for recipe in by_url[result.url]:
+                if not result.ok:
+                    state['failed'] += 1
+                    self.stderr.write(f"FAILED {result.url}: {result.error}")
+                elif (scrape_hash := hash_scrape(result.data)) == recipe.scrape_hash:
+                    state['unchanged'] += 1
+                elif not recipe.scrape_hash and not options['force']:
+                    # scraped before the hash was stored: whether it changed since is unknown, and it may have been
+                    # edited. Store the hash, so later runs pick up changes to the page
+                    Recipe.objects.filter(id=recipe.id).update(scrape_hash=scrape_hash)
+                    state['unchanged'] += 1
+                else:
+                    update_recipe_from_scrape(recipe, result.data)
+                    state['updated'] += 1
+
+    @staticmethod
+    def save_checkpoint(path, state):
+        with open(path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(path + '.tmp', path)
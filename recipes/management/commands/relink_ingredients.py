@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.matching import ingredient_matcher
+from recipes.models import RecipeIngredient
+from recipes.signals import recipe_ingredients_changed
+
+
+class Command(BaseCommand):
+    help = "Link recipe ingredients to the base ingredient named in them. Only unlinked ones unless --all is given"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="also re-link recipe ingredients that are linked")
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        recipe_ingredients = RecipeIngredient.objects.order_by().only('id', 'name', 'recipe_id', 'base_ingredient_id')
+        if not options['all']:
+            recipe_ingredients = recipe_ingredients.filter(base_ingredient__isnull=True)
+
+        changed, recipe_ids, chunk = 0, set(), []
+        for recipe_ingredient in recipe_ingredients.iterator(chunk_size=options['chunk_size']):
+            match = ingredient_matcher.match(recipe_ingredient.name)
+            if match is not None and match != recipe_ingredient.base_ingredient_id:
+                recipe_ingredient.base_ingredient_id = match
+                chunk.append(recipe_ingredient)
+                recipe_ids.add(recipe_ingredient.recipe_id)
+            if len(chunk) >= options['chunk_size']:
+                changed += self.save(chunk)
+                chunk = []
+        changed += self.save(chunk)
+
+        for recipe_id in recipe_ids:
+            recipe_ingredients_changed.send(sender=RecipeIngredient, recipe_id=recipe_id)
+        self.stdout.write(self.style.SUCCESS(f"Re-linked {changed} recipe ingredients in {len(recipe_ids)} recipes"))
+
+    @staticmethod
+    def save(recipe_ingredients):
+        with transaction.atomic():
+            RecipeIngredient.objects.bulk_update(recipe_ingredients, ['base_ingredient'])
+        return len(recipe_ingredients)
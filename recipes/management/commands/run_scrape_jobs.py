@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from recipes import jobs
+from recipes.models import ScrapeJob
+
+
+class Command(BaseCommand):
+    help = "Run the pending scrape jobs, e.g. those left behind when the web process was stopped"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requeue-running', action='store_true',
+                            help="also rerun jobs marked as running. Only use when no other process is running jobs")
+
+    def handle(self, *args, **options):
+        if options['requeue_running']:
+            requeued = ScrapeJob.objects.filter(status=ScrapeJob.Status.RUNNING)\
+                .update(status=ScrapeJob.Status.PENDING, datetime_started=None)
+            self.stdout.write(f"Requeued {requeued} running jobs")
+        job_ids = jobs.submit_pending()
+        jobs.shutdown()
+        failed = ScrapeJob.objects.filter(id__in=job_ids, status=ScrapeJob.Status.FAILED)
+        for job in failed:
+            self.stderr.write(f"FAILED {job.url}: {job.error}")
+        self.stdout.write(self.style.SUCCESS(f"Ran {len(job_ids)} jobs, {len(failed)} failed"))
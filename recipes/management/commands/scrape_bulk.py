@@ -0,0 +1,58 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from scrape.bulk import scrape_many, ScrapeStats
+from scrape.cache import get_cache
+from scrape.utils import create_recipe_from_scrape
+
+
+class Command(BaseCommand):
+    help = "Scrape recipes from many urls concurrently and save them"
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='*', help="urls to scrape")
+        parser.add_argument('-f', '--file', help="file with one url per line. '-' for stdin")
+        parser.add_argument('-w', '--workers', type=int, default=8, help="max concurrent fetches")
+        parser.add_argument('-r', '--rate', type=float, default=2.0,
+                            help="max requests per second per domain. 0 for no limit")
+        parser.add_argument('--dry-run', action='store_true', help="scrape and parse, but don't save anything")
+        parser.add_argument('--offline', action='store_true',
+                            help="only use pages from the response cache. For re-parsing after parser changes")
+
+    def handle(self, *args, **options):
+        urls = list(options['urls'])
+        if options['file']:
+            urls += self.read_urls(options['file'])
+        urls = list(dict.fromkeys(urls))  # drop duplicates, keep order
+        if not urls:
+            raise CommandError("No urls given")
+
+        stats = ScrapeStats()
+        results = scrape_many(urls, workers=options['workers'], per_domain_rate=options['rate'] or None, stats=stats,
+                              offline=options['offline'])
+        for i, result in enumerate(results, start=1):
+            if not result.ok:
+                self.stderr.write(f"[{i}/{len(urls)}] FAILED {result.url}: {result.error}")
+                continue
+            if not options['dry_run']:
+                try:
+                    with transaction.atomic():  # rolls back the recipe's ingredients too
+                        create_recipe_from_scrape(result.data)
+                except Exception as e:  # one bad recipe should not stop the batch, as in scrape.bulk._scrape_one
+                    stats.mark_failed()
+                    self.stderr.write(f"[{i}/{len(urls)}] FAILED to save {result.url}: {e!r}")
+                    continue
+            self.stdout.write(f"[{i}/{len(urls)}] {result.url} ({result.seconds:.2f}s)")
+        self.stdout.write(self.style.SUCCESS(str(stats)))
+        if cache := get_cache():
+            self.stdout.write("Response cache: {hits} hits, {misses} misses".format(**cache.stats()))
+
+    def read_urls(self, path):
+        if path == '-':
+            lines = sys.stdin.readlines()
+        else:
+            with open(path, encoding='utf-8') as f:
+                lines = f.readlines()
+        return [line.strip() for line in lines if line.strip() and not line.startswith('#')]
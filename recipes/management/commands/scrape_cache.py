@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from scrape.cache import get_cache
+
+
+class Command(BaseCommand):
+    help = "Show the size of the scrape response cache, or clear it"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clear', action='store_true')
+
+    def handle(self, *args, **options):
+        cache = get_cache()
+        if cache is None:
+            raise CommandError("The response cache is disabled. See SCRAPE_CACHE_DIR")
+        if options['clear']:
+            cache.clear()
+        stats = cache.stats()
+        self.stdout.write(f"{stats['entries']} pages, {stats['bytes'] / 1024 / 1024:.1f} MiB in {cache.directory}")
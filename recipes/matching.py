@@ -0,0 +1,91 @@
+from lib.rw_ingredients import slugify_norwegian
+from recipes.caching import LocalIndex
+from recipes.models import Ingredient
+
+_END = None  # trie key holding {ingredient id: name} for the phrases ending at a node
+
+
+def tokenize(text):
+    """ Lowercased words with æ, ø and å folded as in slugify_norwegian. Punctuation is dropped """
+    return [token for token in slugify_norwegian(text.lower()).split('-') if token]
+
+
+class IngredientMatcher(LocalIndex):
+    """
+    Finds the ingredient named in a free text ingredient line, e.g. "2 ss finhakket rød løk" -> "rød løk".
+    Built from the Ingredient table into a token trie, then kept current by the Ingredient signals in recipes.signals.
+    Matching walks the trie from each word of the text and picks the longest ingredient name found.
+    """
+    version_name = 'ingredient_matcher'
+
+    def __init__(self):
+        super().__init__()
+        self._trie = {}
+        self._tokens = {}  # ingredient id -> tokens of its name
+
+    def _reset(self):
+        self._trie = {}
+        self._tokens.clear()
+
+    def _build(self):
+        for ingredient_id, name in Ingredient.objects.order_by().values_list('id', 'name').iterator():
+            self._add(ingredient_id, name)
+
+    def update(self, ingredient_id, name):
+        def apply():
+            self._remove(ingredient_id)
+            self._add(ingredient_id, name)
+        self._change(apply)
+
+    def remove(self, ingredient_id):
+        self._change(lambda: self._remove(ingredient_id))
+
+    def _add(self, ingredient_id, name):
+        tokens = tokenize(name)
+        if not tokens:
+            return
+        node = self._trie
+        for token in tokens:
+            node = node.setdefault(token, {})
+        node.setdefault(_END, {})[ingredient_id] = name
+        self._tokens[ingredient_id] = tokens
+
+    def _remove(self, ingredient_id):
+        tokens = self._tokens.pop(ingredient_id, None)
+        if tokens is None:
+            return
+        node = self._trie
+        for token in tokens:
+            node = node[token]
+        del node[_END][ingredient_id]
+        if not node[_END]:
+            del node[_END]
+
+    def match(self, text):
+        """
+        :return: id of the ingredient with the longest name (in words) found in the text. The earliest one on ties.
+            None if no ingredient is named
+        """
+        self._ensure_built()
+        tokens = tokenize(text)
+        best, best_length = None, 0
+        with self._lock:
+            for start in range(len(tokens)):
+                node = self._trie
+                for end in range(start, len(tokens)):
+                    node = node.get(tokens[end])
+                    if node is None:
+                        break
+                    length = end - start + 1
+                    if _END in node and length > best_length:
+                        best, best_length = node[_END], length
+        if best is None:
+            return None
+        return min(best, key=best.get)  # names folding to the same tokens: take the alphabetically first
+
+    def match_many(self, texts):
+        """ :return: dict of text -> ingredient id or None """
+        return {text: self.match(text) for text in texts}
+
+
+ingredient_matcher = IngredientMatcher()
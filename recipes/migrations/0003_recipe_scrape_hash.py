@@ -0,0 +1,24 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:40
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0002_auto_20201021_1649'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='scrape_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='recipeingredient',
+            name='amount_per_serving',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(0.0)]),
+        ),
+    ]
@@ -0,0 +1,112 @@
+import re
+import unicodedata
+import uuid
+from html import unescape
+
+from django.db import migrations
+from django.utils.html import strip_tags
+
+# A frozen copy of what recipes.fulltext and lib.text did when this migration was written, so later changes to those
+# modules don't change what it does. Documents indexed here are rewritten by recipes.fulltext.index_recipes on the
+# recipe's next change.
+
+TABLE = 'recipes_recipe_fts'
+
+_FOLDING = str.maketrans({'ø': 'o', 'æ': 'a', 'å': 'a'})
+_SUFFIXES = sorted((
+    'a', 'e', 'ede', 'ande', 'ende', 'ane', 'ene', 'hetene', 'en', 'heten', 'ar', 'er', 'heter', 'as', 'es', 'edes',
+    'endes', 'enes', 'hetenes', 'ens', 'hetens', 'ers', 'ets', 'et', 'het', 'ast', 'erte', 'ert',
+), key=len, reverse=True)
+_MIN_STEM = 3
+
+
+def html_to_text(html):
+    text = strip_tags(re.sub(r'<(br|/p|/li|/h\d|/div)\b[^>]*>', r'\g<0> ', html or ''))
+    return re.sub(r'\s+', ' ', unescape(text)).strip()
+
+
+def fold(text):
+    text = unicodedata.normalize('NFKD', text.lower().translate(_FOLDING))
+    return ''.join(char for char in text if not unicodedata.combining(char))
+
+
+def stem(word):
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= _MIN_STEM:
+            return word[:-len(suffix)]
+    if word.endswith('s') and len(word) > _MIN_STEM and word[-2] in 'bcdfghjlmnoprtvyz':
+        return word[:-1]
+    return word
+
+
+def document(text):
+    return ' '.join(stem(word) for word in re.findall(r'[^\W_]+', fold(text or '')))
+
+
+def documents(recipes, recipe_ingredients):
+    """
+    :param recipes: (id, name, plain text) of each recipe
+    :param recipe_ingredients: (recipe id, name, base ingredient name) of their ingredients
+    :return: (id, name, ingredients, content) rows to index
+    """
+    ingredients = {}
+    for recipe_id, name, base_name in recipe_ingredients:
+        ingredients.setdefault(recipe_id, []).extend(n for n in (name, base_name) if n)
+    return [
+        (recipe_id, document(name), document(' '.join(ingredients.get(recipe_id, ()))), document(text))
+        for recipe_id, name, text in recipes
+    ]
+
+
+def create_sqlite(cursor, docs):
+    cursor.execute(
+        f"CREATE VIRTUAL TABLE {TABLE} USING fts5(recipe_id UNINDEXED, name, ingredients, content, "
+        f"tokenize='unicode61 remove_diacritics 2')"
+    )
+    cursor.executemany(
+        f"INSERT INTO {TABLE} (recipe_id, name, ingredients, content) VALUES (%s, %s, %s, %s)",
+        [(uuid.UUID(str(recipe_id)).hex, *texts) for recipe_id, *texts in docs],
+    )
+
+
+def create_postgresql(cursor, docs):
+    cursor.execute(f"CREATE TABLE {TABLE} (recipe_id uuid PRIMARY KEY, document tsvector NOT NULL)")
+    cursor.execute(f"CREATE INDEX {TABLE}_document ON {TABLE} USING GIN (document)")
+    cursor.executemany(
+        f"INSERT INTO {TABLE} (recipe_id, document) VALUES (%s, "
+        f"setweight(to_tsvector('simple', %s), 'A') || setweight(to_tsvector('simple', %s), 'B') || "
+        f"setweight(to_tsvector('simple', %s), 'C'))",
+        [(uuid.UUID(str(recipe_id)), *texts) for recipe_id, *texts in docs],
+    )
+
+
+CREATE = {'sqlite': create_sqlite, 'postgresql': create_postgresql}
+
+
+def create_index(apps, schema_editor):
+    create = CREATE.get(schema_editor.connection.vendor)
+    if create is None:  # searches fall back to LIKE
+        return
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    recipes = [(r.id, r.name, html_to_text(r.content)) for r in Recipe.objects.only('id', 'name', 'content')]
+    rows = RecipeIngredient.objects.values_list('recipe_id', 'name', 'base_ingredient__name')
+    with schema_editor.connection.cursor() as cursor:
+        create(cursor, documents(recipes, rows) if recipes else [])
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor in CREATE:
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_recipe_plain_text_excerpt'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+import recipes.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_scrapejob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeTextIndex',
+            fields=[
+                ('recipe', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='text_index', serialize=False, to='recipes.recipe')),
+                ('document', recipes.models.TextDocumentField()),
+            ],
+            options={
+                'db_table': 'recipes_recipe_fts',
+                'managed': False,
+            },
+        ),
+    ]
@@ -1,16 +1,35 @@
 import uuid
+from collections import defaultdict
 
 from ckeditor.fields import RichTextField
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
-from django.db import models
-from django.db.models import SET_NULL, CASCADE
+from django.db import models, transaction
+from django.db.models import SET_NULL, CASCADE, Prefetch
+from django.db.models.signals import post_save
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
 from mptt.fields import TreeForeignKey
 from mptt.models import MPTTModel
 
 from lib.rw_ingredients import slugify_norwegian
+from lib.text import html_to_text, excerpt
+
+
+class RecipeQuerySet(models.QuerySet):
+
+    def for_listing(self):
+        """
+        Loads what recipes/recipe_listing.html needs, and nothing more: the ingredient names are prefetched in a
+        single query, and the (large) content is replaced by the precomputed excerpt.
+        """
+        return self.only('id', 'name', 'slug', 'excerpt', 'datetime_created').prefetch_related(
+            Prefetch(
+                'recipe_ingredients',
+                queryset=RecipeIngredient.objects.order_by('id').select_related('base_ingredient')
+                .only('recipe', 'base_ingredient__name'),
+            )
+        )
 
 
 class Recipe(models.Model):
@@ -21,10 +40,16 @@ class Recipe(models.Model):
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     slug = models.SlugField(blank=True)
+    # derived from content on save. Listings only need these. See manage.py backfill_excerpts
+    plain_text = models.TextField(blank=True, editable=False)
+    excerpt = models.CharField(max_length=160, blank=True, editable=False)
+    scrape_hash = models.CharField(max_length=64, blank=True, editable=False)  # of the scraped data. See scrape.utils
 
     datetime_created = models.DateTimeField(auto_now_add=True)
     datetime_updated = models.DateTimeField(auto_now=True)
 
+    objects = RecipeQuerySet.as_manager()
+
     def __str__(self):
         return self.name
 
@@ -34,10 +59,24 @@ class Recipe(models.Model):
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify_norwegian(self.name)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'content' in update_fields:
+            self.update_text()
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'plain_text', 'excerpt'}
         return super().save(*args, **kwargs)
 
+    def update_text(self):
+        self.plain_text = html_to_text(self.content)
+        self.excerpt = excerpt(self.plain_text)
+
     class Meta:
         ordering = ('name',)
+        indexes = [
+            # the sort orders of search and the recipe list. See recipes.search.SORT_ORDERINGS
+            models.Index(fields=['name', 'id'], name='recipe_name_id_idx'),
+            models.Index(fields=['-datetime_created', 'id'], name='recipe_recent_idx'),
+        ]
 
 
 class Ingredient(MPTTModel):
@@ -53,18 +92,84 @@ class Ingredient(MPTTModel):
     )
 
     def object_already_in_family(self, field, object_id):
-        family = self.get_ancestors() | self.get_children()
-        filter_dict = {'id': object_id}
-        for ingredient in family:
-            if ingredient.__getattribute__(field).filter(**filter_dict).exists():
-                return True
-        return False
+        return object_id in Ingredient.objects_in_families([self], field, [object_id])[self.id]
+
+    @classmethod
+    def objects_in_families(cls, ingredients, field, object_ids):
+        """
+        Batch version of object_already_in_family. Runs a single query regardless of the number of ingredients.
+        An ingredient's family is all of its ancestors and descendants, not including the ingredient itself.
+        :param ingredients: Ingredient instances. Their tree fields (tree_id, lft, rght) must be current
+        :param field: name of a relation on Ingredient, e.g. 'recipe_usages'
+        :param object_ids: ids of the related objects to look for
+        :return: dict of ingredient id -> set of the object_ids related to any member of the ingredient's family
+        """
+        found = {ingredient.id: set() for ingredient in ingredients}
+        if not found:
+            return found
+        members = cls.objects.filter(
+            tree_id__in={ingredient.tree_id for ingredient in ingredients},
+            **{f'{field}__pk__in': object_ids},
+        ).order_by().values_list('tree_id', 'lft', 'rght', f'{field}__pk')
+        by_tree = defaultdict(list)
+        for tree_id, lft, rght, object_id in members:
+            by_tree[tree_id].append((lft, rght, object_id))
+        for ingredient in ingredients:
+            for lft, rght, object_id in by_tree[ingredient.tree_id]:
+                is_ancestor = lft < ingredient.lft and rght > ingredient.rght
+                is_descendant = lft > ingredient.lft and rght < ingredient.rght
+                if is_ancestor or is_descendant:
+                    found[ingredient.id].add(object_id)
+        return found
+
+    @classmethod
+    def bulk_create_roots(cls, names):
+        """
+        Creates root ingredients in bulk for the names that don't exist yet, assigning their tree fields directly
+        instead of through MPTT. Names someone else creates in the meantime are left to them.
+        Sends post_save for each created one, as bulk_create does not. Like those of save(), the receivers in
+        recipes.signals apply their changes once the transaction commits.
+        :return: the ingredients with the names, created here or not
+        """
+        names = list(dict.fromkeys(names))
+        if not names:
+            return []
+        with transaction.atomic(savepoint=False):
+            next_tree_id = cls._lock_next_tree_id()
+            # existing names are skipped by the database, leaving gaps in the tree ids
+            tree_ids = {name: next_tree_id + i for i, name in enumerate(names)}
+            cls.objects.bulk_create(
+                (cls(name=name, tree_id=tree_id, lft=1, rght=2, level=0) for name, tree_id in tree_ids.items()),
+                ignore_conflicts=True,
+            )
+            ingredients = list(cls.objects.filter(name__in=names))  # bulk_create returns no ids with ignore_conflicts
+            for ingredient in ingredients:
+                if tree_ids[ingredient.name] == ingredient.tree_id:  # created here
+                    post_save.send(sender=cls, instance=ingredient, created=True)
+        return ingredients
+
+    @classmethod
+    def _lock_next_tree_id(cls):
+        """
+        :return: the tree id after the largest one. Concurrent callers are serialised until the transaction ends, by
+            locking the root of the last tree: once it's locked and still the last, no one else can add trees after it
+        """
+        locked = None
+        while True:
+            last = cls.objects.select_for_update().filter(level=0).order_by('-tree_id')\
+                .values_list('tree_id', flat=True).first()
+            if last is None or last == locked:
+                return (last or 0) + 1
+            locked = last
 
     def __str__(self):
         return self.name
 
     class Meta:
         ordering = ('name',)
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(ubiquitous=True), name='ingredient_ubiquitous_idx'),
+        ]
 
 
 class RecipeIngredient(models.Model):
@@ -96,6 +201,7 @@ class RecipeIngredient(models.Model):
         related_name='recipe_ingredients',
         blank=True,
         null=True,
+        db_index=False,  # covered by the indexes in Meta
     )
     base_ingredient = models.ForeignKey(
         to='recipes.Ingredient',
@@ -103,6 +209,7 @@ class RecipeIngredient(models.Model):
         related_name='recipe_usages',
         blank=True,
         null=True,
+        db_index=False,
     )
     amount_per_serving = models.FloatField(
         blank=True,
@@ -118,6 +225,12 @@ class RecipeIngredient(models.Model):
 
     class Meta:
         ordering = ('recipe__name', )
+        indexes = [
+            # a recipe's ingredients (listings, exclusive search), and the recipes using an ingredient (search).
+            # Both hold the two columns the search aggregates on, so they answer it without reading the table
+            models.Index(fields=['recipe', 'base_ingredient'], name='ri_recipe_ingredient_idx'),
+            models.Index(fields=['base_ingredient', 'recipe'], name='ri_ingredient_recipe_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name} [{self.recipe.name}]"
@@ -135,3 +248,59 @@ class RecipeIngredient(models.Model):
             if not self.name and self.base_ingredient:
                 self.name = self.base_ingredient.name
         super().save(**kwargs)
+
+
+class ScrapeJob(models.Model):
+    """
+    A recipe page to scrape in the background, by recipes.jobs. Timings are in seconds.
+    There is at most one pending or running job per url.
+    """
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', _('pending')
+        RUNNING = 'running', _('running')
+        DONE = 'done', _('done')
+        FAILED = 'failed', _('failed')
+
+    IN_FLIGHT = (Status.PENDING, Status.RUNNING)
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    url = models.URLField(max_length=300)
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.PENDING)
+    recipe = models.ForeignKey(to='recipes.Recipe', on_delete=SET_NULL, blank=True, null=True)
+    error = models.TextField(blank=True)
+
+    datetime_created = models.DateTimeField(auto_now_add=True)
+    datetime_started = models.DateTimeField(blank=True, null=True)
+    datetime_finished = models.DateTimeField(blank=True, null=True)
+    queued_seconds = models.FloatField(blank=True, null=True)  # waiting for a worker
+    scrape_seconds = models.FloatField(blank=True, null=True)  # fetching and parsing the page
+    save_seconds = models.FloatField(blank=True, null=True)  # creating the recipe
+
+    def __str__(self):
+        return f"{self.url} [{self.status}]"
+
+    class Meta:
+        ordering = ('-datetime_created',)
+        constraints = [
+            models.UniqueConstraint(fields=['url'], condition=models.Q(status__in=('pending', 'running')),
+                                    name='scrape_job_in_flight_url'),
+        ]
+
+
+class TextDocumentField(models.TextField):
+    """ The document column of the full-text index. Filter on it with the match lookup, see recipes.fulltext """
+
+
+class RecipeTextIndex(models.Model):
+    """
+    The full-text index of recipes.fulltext, so that recipe queries can join it. The table is created and written by
+    recipes.fulltext: an FTS5 table on SQLite, where document stands for the table itself, and a tsvector on PostgreSQL
+    """
+    recipe = models.OneToOneField(to='recipes.Recipe', on_delete=models.DO_NOTHING, primary_key=True,
+                                  related_name='text_index', db_constraint=False)
+    document = TextDocumentField()
+
+    class Meta:
+        managed = False
+        db_table = 'recipes_recipe_fts'
@@ -0,0 +1,234 @@
+from bisect import bisect_left, insort
+from collections import OrderedDict
+
+from django.db.models import Count, F, Q, ExpressionWrapper, FloatField, Exists, OuterRef
+from django.db.models.functions import Cast
+
+from recipes.caching import LocalIndex
+from recipes.fulltext import fold
+from recipes.models import Recipe, Ingredient
+
+
+class IngredientIndex(LocalIndex):
+    """
+    In-memory map of ingredient names to ids, so ingredient searches (database_search) don't have to join the
+    ingredient table. Built lazily on first use and kept current by the Ingredient signals in recipes.signals.
+    """
+    version_name = 'ingredient_index'
+
+    def __init__(self):
+        super().__init__()
+        self._ingredient_ids = {}  # name -> id
+        self._ingredient_names = {}  # id -> name
+
+    def _reset(self):
+        self._ingredient_ids.clear()
+        self._ingredient_names.clear()
+
+    def _build(self):
+        for ingredient_id, name in Ingredient.objects.order_by().values_list('id', 'name'):
+            self._set_ingredient(ingredient_id, name)
+
+    # --- incremental maintenance, once committed. See LocalIndex._change ---
+
+    def update_ingredient(self, ingredient_id, name):
+        def apply():
+            self._remove_ingredient(ingredient_id)
+            self._set_ingredient(ingredient_id, name)
+        self._change(apply)
+
+    def remove_ingredient(self, ingredient_id):
+        self._change(lambda: self._remove_ingredient(ingredient_id))
+
+    def _set_ingredient(self, ingredient_id, name):
+        self._ingredient_ids[name] = ingredient_id
+        self._ingredient_names[ingredient_id] = name
+
+    def _remove_ingredient(self, ingredient_id):
+        name = self._ingredient_names.pop(ingredient_id, None)
+        if name is not None and self._ingredient_ids.get(name) == ingredient_id:
+            del self._ingredient_ids[name]
+
+    # --- queries ---
+
+    def ingredient_ids(self, names):
+        self._ensure_built()
+        with self._lock:
+            return {self._ingredient_ids[name] for name in names if name in self._ingredient_ids}
+
+
+ingredient_index = IngredientIndex()
+
+
+class DescendantCache(LocalIndex):
+    """
+    Maps sets of ingredient names to the ids of those ingredients and all their descendants in the ingredient tree.
+    Entries are only valid for the tree version they were computed for. The version is bumped by the Ingredient
+    signals in recipes.signals, which drops the whole cache.
+    """
+    version_name = 'ingredient_tree'
+
+    def __init__(self, max_size=512):
+        super().__init__()
+        self._entries = OrderedDict()
+        self._max_size = max_size
+
+    def _reset(self):
+        self._entries.clear()
+
+    def _build(self):
+        pass  # filled as names are looked up
+
+    def descendant_ids(self, names):
+        key = frozenset(names)
+        self._ensure_built()
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            version = self._version
+        ids = self._query(key)
+        with self._lock:
+            if version == self._version:  # the tree may have changed while querying
+                self._entries[key] = ids
+                if len(self._entries) > self._max_size:
+                    self._entries.popitem(last=False)
+        return ids
+
+    @staticmethod
+    def _query(names):
+        # one query: every node lying inside the lft/rght range of a named node in the same tree
+        ancestors = Ingredient.objects.filter(
+            name__in=names, tree_id=OuterRef('tree_id'), lft__lte=OuterRef('lft'), rght__gte=OuterRef('rght'),
+        )
+        return frozenset(Ingredient.objects.filter(Exists(ancestors)).values_list('id', flat=True))
+
+
+descendant_cache = DescendantCache()
+
+
+class IngredientPrefixIndex(LocalIndex):
+    """
+    Sorted index over the folded (see recipes.fulltext.fold) ingredient names, for autocompletion.
+    Every word of a name is a key, so "ost" finds both "ost" and "revet ost". Lookups are a binary search.
+    Built lazily and kept current by the Ingredient signals in recipes.signals.
+    """
+    version_name = 'ingredient_prefix_index'
+
+    def __init__(self):
+        super().__init__()
+        self._keys = []  # sorted (folded name from a word start, name, id)
+        self._names = {}  # id -> name
+
+    def _reset(self):
+        self._keys.clear()
+        self._names.clear()
+
+    def _build(self):
+        for ingredient_id, name in Ingredient.objects.order_by().values_list('id', 'name'):
+            self._names[ingredient_id] = name
+            self._keys.extend(self._entries(ingredient_id, name))
+        self._keys.sort()
+
+    @staticmethod
+    def _entries(ingredient_id, name):
+        words = fold(name).split()
+        return {(' '.join(words[i:]), name, ingredient_id) for i in range(len(words))}
+
+    def update(self, ingredient_id, name):
+        def apply():
+            self._remove(ingredient_id)
+            self._names[ingredient_id] = name
+            for entry in self._entries(ingredient_id, name):
+                insort(self._keys, entry)
+        self._change(apply)
+
+    def remove(self, ingredient_id):
+        self._change(lambda: self._remove(ingredient_id))
+
+    def _remove(self, ingredient_id):
+        name = self._names.pop(ingredient_id, None)
+        if name is not None:
+            for entry in self._entries(ingredient_id, name):
+                del self._keys[bisect_left(self._keys, entry)]
+
+    def suggest(self, prefix, limit=10):
+        """ :return: names of ingredients with a word starting with prefix. Names starting with it first """
+        prefix = ' '.join(fold(prefix).split())
+        if not prefix:
+            return []
+        self._ensure_built()
+        with self._lock:
+            names = set()
+            i = bisect_left(self._keys, (prefix,))
+            while i < len(self._keys) and self._keys[i][0].startswith(prefix):
+                names.add(self._keys[i][1])
+                i += 1
+        return sorted(names, key=lambda name: (not fold(name).startswith(prefix), len(name), name))[:limit]
+
+
+ingredient_prefix_index = IngredientPrefixIndex()
+
+
+def requested_ingredients_q(ingredients, descendants=False, prefix='recipe_ingredients__base_ingredient',
+                            ingredient_ids=None):
+    """
+    :param ingredients: base ingredient names
+    :param descendants: also match every descendant of the named ingredients
+    :param ingredient_ids: ids of the searched for ingredients, if already known (see IngredientIndex.ingredient_ids).
+        Used instead of ingredients and descendants, and saves joining the ingredient table
+    """
+    if ingredient_ids is not None:
+        return Q(**{f'{prefix}__in': ingredient_ids})
+    if descendants:
+        return Q(**{f'{prefix}__in': descendant_cache.descendant_ids(ingredients)})
+    return Q(**{f'{prefix}__name__in': ingredients})
+
+
+# order_by() arguments for each sort_by option. All end in 'id' so they can be used for keyset pagination
+SORT_ORDERINGS = {
+    'best_match': ('-match_count', '-coverage', '-datetime_created', 'id'),
+    'recent': ('-datetime_created', 'id'),
+    'alphabetical': ('name', 'id'),
+    'relevance': ('text_rank', 'id'),  # full-text searches. See recipes.fulltext.rank_recipes
+}
+
+
+def annotate_matches(recipes, ingredients, descendants=False, ingredient_ids=None):
+    """
+    :param ingredients: base ingredient names
+    :param descendants, ingredient_ids: see requested_ingredients_q
+    :return: the queryset annotated with
+        match_count: number of the recipe's ingredients that were searched for
+        ingredient_count: number of the recipe's ingredients with a base ingredient
+        coverage: match_count / ingredient_count
+    """
+    requested = requested_ingredients_q(ingredients, descendants, ingredient_ids=ingredient_ids)
+    return recipes.annotate(
+        match_count=Count('recipe_ingredients__base_ingredient', filter=requested),
+        ingredient_count=Count('recipe_ingredients__base_ingredient'),
+    ).annotate(
+        coverage=ExpressionWrapper(Cast('match_count', FloatField()) / F('ingredient_count'), FloatField()),
+    )
+
+
+def database_search(ingredients, exclusive=True, include_ubiquitous=False, descendants=False, ingredient_ids=None):
+    """
+    Answers the search with a single aggregated query, so that it can be sorted and paginated in the database:
+    recipes are grouped on their ingredients, and for exclusive searches the number of ingredients covered by the
+    search is compared to the recipe's total. Ingredients without a base ingredient (free text, e.g. "secret sauce")
+    are never covered, so exclusive searches leave out their recipes.
+    :param ingredients: base ingredient names
+    :param descendants, ingredient_ids: see requested_ingredients_q
+    :return: Recipe queryset annotated as in annotate_matches
+    """
+    recipes = annotate_matches(Recipe.objects.all(), ingredients, descendants, ingredient_ids)\
+        .order_by(*Recipe._meta.ordering)  # Meta.ordering is not applied to aggregating queries
+    if not exclusive:
+        return recipes.filter(match_count__gt=0)
+    requested = requested_ingredients_q(ingredients, descendants, ingredient_ids=ingredient_ids)
+    allowed = requested | Q(recipe_ingredients__base_ingredient__ubiquitous=True) if include_ubiquitous else requested
+    return recipes.annotate(
+        row_count=Count('recipe_ingredients'),
+        allowed_count=Count('recipe_ingredients__base_ingredient', filter=allowed),
+    ).filter(match_count__gt=0, allowed_count=F('row_count'))
@@ -0,0 +1,117 @@
+"""
+Shopping lists: the ingredients of a set of recipes, each scaled to some servings, added up per base ingredient.
+
+Amounts are added up in the base unit of their family (see recipes.units), so 3 dl and 2 tbsp of milk make 330 ml,
+and shown normalised (3.3 dl). Spoons are only shown as ml when added to other volumes. Amounts that can't be added
+up, e.g. 2 eggs and 100 g of egg, are listed side by side.
+Recipe ingredients without a base ingredient are grouped by name.
+Runs two queries, three when rolling up ingredient families, whatever the number of recipes.
+"""
+from django.core.exceptions import ValidationError
+
+from recipes.models import Recipe, RecipeIngredient, Ingredient
+from recipes.units import FAMILIES, scale_ratio, to_base, from_base, family, format_amount
+from scrape.utils import conversions
+
+MAX_RECIPES = 100
+
+
+class ShoppingItem:
+    def __init__(self, name, ingredient_id=None):
+        self.name = name
+        self.ingredient_id = ingredient_id
+        self.amounts = {}  # family -> the sum in its base unit, or unit -> the sum for units that can't be converted
+        self.unspecified = False  # used without an amount by some recipe
+        self.recipe_ids = set()
+
+    def add(self, recipe_id, amount, measurement):
+        self.recipe_ids.add(recipe_id)
+        if amount is None:
+            self.unspecified = True
+            return
+        key = family(measurement) or measurement
+        amount, _ = to_base(amount, measurement)
+        self.amounts[key] = self.amounts.get(key, 0) + amount
+
+    @property
+    def quantities(self):
+        """ :return: (amount, unit) of each sum, normalised """
+        amounts = dict(self.amounts)
+        if 'spoons' in amounts and 'volume' in amounts:
+            amounts['volume'] += amounts.pop('spoons')
+        return [
+            from_base(amount, key) if key in FAMILIES else (amount, key)
+            for key, amount in sorted(amounts.items())
+        ]
+
+    @property
+    def amount_display(self):
+        return ' + '.join(f'{format_amount(amount)} {unit}'.strip() for amount, unit in self.quantities)
+
+
+def format_selection(selection):
+    """ The inverse of parse_selection """
+    return ','.join(
+        f'{recipe_id}:{servings}' if servings else str(recipe_id) for recipe_id, servings in selection.items()
+    )
+
+
+def parse_selection(value):
+    """
+    :param value: comma separated recipe ids, each optionally followed by :servings. E.g. '<id>:4,<id>'
+    :raise ValueError: if it is malformed
+    :return: dict of recipe id -> servings, None for the recipe's own
+    """
+    selection = {}
+    for part in filter(None, value.split(',')):
+        recipe_id, _, servings = part.partition(':')
+        servings = int(servings) if servings else None
+        if servings is not None and servings < 1:
+            raise ValueError(f"Invalid servings: {part}")
+        try:
+            selection[Recipe._meta.pk.to_python(recipe_id)] = servings
+        except ValidationError:
+            raise ValueError(f"Invalid recipe id: {recipe_id}")
+    if len(selection) > MAX_RECIPES:
+        raise ValueError(f"More than {MAX_RECIPES} recipes")
+    return selection
+
+
+def shopping_list(selection, drop_ubiquitous=False, roll_up=False):
+    """
+    :param selection: dict of recipe id -> servings, None for the recipe's own. See parse_selection
+    :param drop_ubiquitous: leave out ubiquitous ingredients (salt, water, ...)
+    :param roll_up: count ingredients as the root of their family in the ingredient tree ("parmesan" as "ost")
+    :return: (the recipes found, list of ShoppingItem sorted by name)
+    """
+    recipes = list(Recipe.objects.filter(id__in=selection).order_by('name').only('id', 'name', 'slug', 'serves'))
+    ratios = {recipe.id: scale_ratio(recipe.serves, selection[recipe.id]) for recipe in recipes}
+    rows = list(RecipeIngredient.objects.filter(recipe_id__in=ratios).order_by().values_list(
+        'recipe_id', 'name', 'amount_per_serving', 'measurement',
+        'base_ingredient_id', 'base_ingredient__name', 'base_ingredient__ubiquitous',
+        'base_ingredient__tree_id', 'base_ingredient__level',
+    ))
+
+    roots = {}  # tree id -> (id, name, ubiquitous) of its root
+    if roll_up:
+        trees = {tree_id for *_, tree_id, level in rows if level}
+        if trees:
+            roots = {
+                tree_id: (root_id, name, ubiquitous) for tree_id, root_id, name, ubiquitous in Ingredient.objects
+                .filter(tree_id__in=trees, level=0).values_list('tree_id', 'id', 'name', 'ubiquitous')
+            }
+
+    items = {}
+    for recipe_id, name, amount, measurement, base_id, base_name, ubiquitous, tree_id, level in rows:
+        if base_id is not None and level and tree_id in roots:
+            base_id, base_name, root_ubiquitous = roots[tree_id]
+            ubiquitous = ubiquitous or root_ubiquitous
+        if drop_ubiquitous and ubiquitous:
+            continue
+        key = base_id if base_id is not None else name.strip().lower()
+        if key not in items:
+            items[key] = ShoppingItem(base_name or name.strip(), base_id)
+        if amount is not None:
+            amount *= ratios[recipe_id]
+        items[key].add(recipe_id, amount, conversions.get(measurement, measurement))
+    return recipes, sorted(items.values(), key=lambda item: item.name.lower())
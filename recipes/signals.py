@@ -0,0 +1,95 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver, Signal
+
+from recipes import fulltext, caching
+from recipes.matching import ingredient_matcher
+from recipes.models import Recipe, Ingredient, RecipeIngredient
+from recipes.search import ingredient_index, descendant_cache, ingredient_prefix_index
+
+# Sent after a recipe's ingredients were written in bulk (bulk_create etc.), which skips the model signals.
+# Arguments: recipe_id
+recipe_ingredients_changed = Signal()
+
+# kept current by the receivers below. Changes are applied once committed, see recipes.caching.LocalIndex
+IN_MEMORY_INDEXES = (ingredient_index, descendant_cache, ingredient_matcher, ingredient_prefix_index)
+
+
+def invalidate_indexes():
+    """ For bulk writes that skip the model signals. Call once committed: every process rebuilds its indexes """
+    for index in IN_MEMORY_INDEXES:
+        index.invalidate()
+    caching.invalidate_search()
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def index_recipe_ingredient(sender, instance, **kwargs):
+    recipe_id = instance.recipe_id
+
+    def on_commit():
+        caching.invalidate_search()
+        if recipe_id:
+            caching.invalidate_recipe_detail(recipe_id)
+    transaction.on_commit(on_commit)
+    if recipe_id:
+        fulltext.schedule(recipe_id)
+
+
+@receiver(recipe_ingredients_changed)
+def reindex_recipe(sender, recipe_id, **kwargs):
+    def on_commit():
+        caching.invalidate_search()
+        caching.invalidate_recipe_detail(recipe_id)
+    transaction.on_commit(on_commit)
+    fulltext.schedule(recipe_id)
+
+
+@receiver(post_delete, sender=RecipeIngredient)
+def unindex_recipe_ingredient(sender, instance, **kwargs):
+    recipe_id = instance.recipe_id
+
+    def on_commit():
+        caching.invalidate_search()
+        if recipe_id:
+            caching.invalidate_recipe_detail(recipe_id)
+    transaction.on_commit(on_commit)
+    if recipe_id:
+        fulltext.schedule(recipe_id)
+
+
+@receiver(post_save, sender=Recipe)
+def index_recipe_text(sender, instance, **kwargs):
+    fulltext.schedule(instance.id)
+    transaction.on_commit(caching.invalidate_search)
+
+
+@receiver(post_delete, sender=Recipe)
+def unindex_recipe(sender, instance, **kwargs):
+    fulltext.schedule(instance.id)
+    transaction.on_commit(caching.invalidate_search)
+
+
+@receiver(post_save, sender=Ingredient)
+def index_ingredient(sender, instance, **kwargs):
+    ingredient_id, name = instance.id, instance.name
+
+    def on_commit():
+        descendant_cache.invalidate()
+        ingredient_matcher.update(ingredient_id, name)
+        ingredient_prefix_index.update(ingredient_id, name)
+        ingredient_index.update_ingredient(ingredient_id, name)
+        caching.invalidate_search()
+    transaction.on_commit(on_commit)
+
+
+@receiver(post_delete, sender=Ingredient)
+def unindex_ingredient(sender, instance, **kwargs):
+    ingredient_id = instance.id
+
+    def on_commit():
+        descendant_cache.invalidate()
+        ingredient_matcher.remove(ingredient_id)
+        ingredient_prefix_index.remove(ingredient_id)
+        ingredient_index.remove_ingredient(ingredient_id)
+        caching.invalidate_search()
+    transaction.on_commit(on_commit)
@@ -0,0 +1,24 @@
+from django.core.cache import cache
+
+from recipes.signals import IN_MEMORY_INDEXES
+
+
+class FreshIndexesMixin:
+    """
+    Starts and ends each test with empty in-memory indexes (see recipes.signals) and an empty cache. Test data is
+    rolled back behind the indexes' backs, so an index built during one test would be stale in the next
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.reset_indexes()
+
+    def tearDown(self):
+        self.reset_indexes()
+        super().tearDown()
+
+    @staticmethod
+    def reset_indexes():
+        for index in IN_MEMORY_INDEXES:
+            index.clear()
+        cache.clear()
@@ -1,8 +1,34 @@
+import json
+import os
+import tempfile
+import uuid
+from io import StringIO
+from unittest import skipUnless
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from django.db import IntegrityError
-from django.test import TestCase
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.db.models import QuerySet
+from django.db.models.signals import post_save, post_delete
+from django.http import Http404
+from django.test import TestCase, TransactionTestCase, LiveServerTestCase, AsyncRequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.forms import inlineformset_factory
+from django.urls import reverse
 
+from lib.rw_ingredients import read_ingredients, write_ingredients
+from recipes import fulltext, caching, checks, async_views, units, shopping, jsonl
+from recipes.admin import RecipeIngredientFormSet
+from recipes.matching import ingredient_matcher
 from recipes.models import Recipe, Ingredient, RecipeIngredient
+from recipes.search import (
+    IngredientIndex, ingredient_index, descendant_cache, database_search, SORT_ORDERINGS,
+)
+from recipes.testing import FreshIndexesMixin
+from recipes import views
+from recipes.views import SEARCH_PAGE_SIZE
 
 
 class RecipeTest(TestCase):
@@ -22,10 +48,11 @@ class RecipeTest(TestCase):
         self.assertEqual(str(self.recipe), self.recipe.name)
 
 
-class IngredientTest(TestCase):
+class IngredientTest(FreshIndexesMixin, TestCase):
     ingredient_name = 'base_ingredient'
 
     def setUp(self):
+        super().setUp()
         self.ingredient = Ingredient.objects.create(name=self.ingredient_name)
 
     def test_unique_error(self):
@@ -37,6 +64,67 @@ class IngredientTest(TestCase):
         self.ingredient.ubiquitous = True
         self.ingredient.save()
 
+    def test_objects_in_families(self):
+        child = Ingredient.objects.create(name='child', parent=self.ingredient)
+        grandchild = Ingredient.objects.create(name='grandchild', parent=child)
+        other = Ingredient.objects.create(name='other')
+        recipe, unrelated_recipe = Recipe.objects.create(name='recipe'), Recipe.objects.create(name='unrelated')
+        usage = RecipeIngredient.objects.create(recipe=recipe, base_ingredient=grandchild)
+        unrelated_usage = RecipeIngredient.objects.create(recipe=unrelated_recipe, base_ingredient=other)
+        ingredients = list(Ingredient.objects.all())  # refreshed tree fields
+
+        with self.assertNumQueries(1):
+            found = Ingredient.objects_in_families(ingredients, 'recipe_usages', [usage.id, unrelated_usage.id])
+        self.assertEqual(found[self.ingredient.id], {usage.id})  # grandchild is a full descendant
+        self.assertEqual(found[child.id], {usage.id})
+        self.assertEqual(found[grandchild.id], set())  # not in its own family
+        self.assertEqual(found[other.id], set())
+        ingredient = Ingredient.objects.get(id=self.ingredient.id)
+        self.assertTrue(ingredient.object_already_in_family('recipe_usages', usage.id))
+
+    def test_admin_rejects_families(self):
+        child = Ingredient.objects.create(name='child', parent=self.ingredient)
+        other = Ingredient.objects.create(name='other')
+        recipe = Recipe.objects.create(name='recipe')
+        usage = RecipeIngredient.objects.create(recipe=recipe, base_ingredient=self.ingredient, name='usage')
+        FormSet = inlineformset_factory(Recipe, RecipeIngredient, formset=RecipeIngredientFormSet,
+                                        fields=('name', 'base_ingredient'))
+
+        def formset(*rows, delete_usage=False):
+            data = {'recipe_ingredients-TOTAL_FORMS': len(rows) + 1, 'recipe_ingredients-INITIAL_FORMS': 1,
+                    'recipe_ingredients-0-id': usage.id, 'recipe_ingredients-0-recipe': recipe.id,
+                    'recipe_ingredients-0-name': 'usage', 'recipe_ingredients-0-base_ingredient': self.ingredient.id}
+            if delete_usage:
+                data['recipe_ingredients-0-DELETE'] = 'on'
+            for i, ingredient in enumerate(rows, 1):
+                data |= {f'recipe_ingredients-{i}-name': ingredient.name,
+                         f'recipe_ingredients-{i}-base_ingredient': ingredient.id}
+            return FormSet(data, instance=recipe)
+
+        self.assertFalse(formset(child).is_valid())
+        self.assertTrue(formset(other).is_valid())
+        self.assertTrue(formset(child, delete_usage=True).is_valid())
+
+    def test_bulk_create_roots(self):
+        sent = []
+
+        def receiver(sender, instance, created, **kwargs):
+            sent.append(instance.name)
+        post_save.connect(receiver, sender=Ingredient)
+        self.addCleanup(post_save.disconnect, receiver, sender=Ingredient)
+
+        ingredient_matcher.match('')  # build it
+        with self.captureOnCommitCallbacks() as callbacks:
+            ingredients = Ingredient.bulk_create_roots(['a', self.ingredient_name, 'b', 'a'])
+        self.assertEqual(sorted(sent), ['a', 'b'])  # not the existing one
+        self.assertIsNone(ingredient_matcher.match('a'))  # not until committed
+        for callback in callbacks:
+            callback()
+        self.assertIsNotNone(ingredient_matcher.match('a'))
+        self.assertEqual({ingredient.name for ingredient in ingredients}, {'a', 'b', self.ingredient_name})
+        tree_ids = Ingredient.objects.values_list('tree_id', flat=True)
+        self.assertEqual(len(set(tree_ids)), len(tree_ids))
+
 
 class RecipeIngredientTest(TestCase):
 
@@ -64,3 +152,694 @@ class RecipeIngredientTest(TestCase):
         # choices are only validated in clean methods, not on save() or other db-related methods.
         self.ri.measurement = 'test'
         self.assertRaises(ValidationError, self.ri.full_clean)
+
+
+class SearchTest(FreshIndexesMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.egg, self.milk, self.flour, self.salt, self.cheese = (
+            Ingredient.objects.create(name=name) for name in ('egg', 'milk', 'flour', 'salt', 'cheese')
+        )
+        self.salt.ubiquitous = True
+        self.salt.save()
+        self.omelette = self.create_recipe('omelette', self.egg, self.milk, self.salt)
+        self.pancakes = self.create_recipe('pancakes', self.egg, self.milk, self.flour)
+        self.cheese_toast = self.create_recipe('cheese toast', self.cheese, self.flour)
+
+    @staticmethod
+    def create_recipe(name, *ingredients):
+        recipe = Recipe.objects.create(name=name)
+        for ingredient in ingredients:
+            RecipeIngredient.objects.create(recipe=recipe, base_ingredient=ingredient)
+        return recipe
+
+    def search(self, **params):
+        response = self.client.get(reverse('search'), params)
+        return [recipe.name for recipe in response.context['recipes']]
+
+    def test_exclusive(self):
+        self.assertEqual(self.search(ingredients='egg,milk,flour'), ['pancakes'])
+        self.assertEqual(self.search(ingredients='egg,milk', **{'include-ubiquitous': 'on'}), ['omelette'])
+        self.assertEqual(self.search(ingredients='egg,milk'), [])
+
+    def test_exclusive_with_unlinked_ingredient(self):
+        RecipeIngredient.objects.create(recipe=self.pancakes, name='secret sauce')
+        self.assertEqual(self.search(ingredients='egg,milk,flour'), [])
+        self.assertIn('pancakes', self.search(ingredients='egg,milk,flour', exclusive='inclusive'))
+
+    def test_inclusive(self):
+        self.assertEqual(self.search(ingredients='flour', exclusive='inclusive'), ['cheese toast', 'pancakes'])
+        self.assertEqual(
+            self.search(ingredients='egg,milk,flour', exclusive='inclusive', sort_by='best_match')[0], 'pancakes'
+        )
+
+    def test_index_follows_signals(self):
+        self.assertEqual(ingredient_index.ingredient_ids(['egg', 'butter']), {self.egg.id})
+        with self.captureOnCommitCallbacks(execute=True):
+            butter = Ingredient.objects.create(name='butter')
+        self.assertEqual(ingredient_index.ingredient_ids(['egg', 'butter']), {self.egg.id, butter.id})
+        butter.name = 'smør'
+        with self.captureOnCommitCallbacks(execute=True):
+            butter.save()
+        self.assertEqual(ingredient_index.ingredient_ids(['butter', 'smør']), {butter.id})
+        with self.captureOnCommitCallbacks(execute=True):
+            butter.delete()
+        self.assertEqual(ingredient_index.ingredient_ids(['smør']), set())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            RecipeIngredient.objects.create(recipe=self.pancakes, base_ingredient=self.cheese)
+        self.assertEqual(self.search(ingredients='egg,milk,flour'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pancakes.recipe_ingredients.filter(base_ingredient=self.cheese).get().delete()
+        self.assertEqual(self.search(ingredients='egg,milk,flour'), ['pancakes'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pancakes.delete()
+        self.assertEqual(self.search(ingredients='egg', exclusive='inclusive'), ['omelette'])
+
+    def test_rebuilt_after_changes_by_other_processes(self):
+        other_process = IngredientIndex()
+        self.assertEqual(other_process.ingredient_ids(['egg', 'butter']), {self.egg.id})
+        with self.captureOnCommitCallbacks(execute=True):
+            butter = Ingredient.objects.create(name='butter')
+        self.assertEqual(other_process.ingredient_ids(['egg', 'butter']), {self.egg.id, butter.id})
+
+    def test_changes_apply_on_commit(self):
+        ingredient_index.ingredient_ids(['egg'])  # build the index
+        with self.captureOnCommitCallbacks() as callbacks:
+            butter = Ingredient.objects.create(name='butter')
+        self.assertEqual(ingredient_index.ingredient_ids(['butter']), set())  # not committed yet, could be rolled back
+        for callback in callbacks:
+            callback()
+        self.assertEqual(ingredient_index.ingredient_ids(['butter']), {butter.id})
+
+    def test_duplicate_usage(self):
+        duplicate = RecipeIngredient.objects.create(recipe=self.omelette, base_ingredient=self.egg, name='egg yolk')
+        duplicate.delete()
+        self.assertIn('omelette', self.search(ingredients='egg', exclusive='inclusive'))
+
+    def test_best_match_ranking(self):
+        self.create_recipe('egg on toast', self.egg, self.flour, self.cheese, self.milk, self.salt)
+        # pancakes and egg on toast match 3, pancakes has the better coverage
+        self.assertEqual(
+            self.search(ingredients='egg,milk,flour', exclusive='inclusive', sort_by='best_match'),
+            ['pancakes', 'egg on toast', 'omelette', 'cheese toast'],
+        )
+
+    def test_keyset_pagination(self):
+        for i in range(SEARCH_PAGE_SIZE + 5):
+            self.create_recipe(f'flatbread {i:02}', self.flour)
+        params = {'ingredients': 'flour', 'exclusive': 'inclusive', 'sort_by': 'recent'}
+        response = self.client.get(reverse('search'), params)
+        first_page = [recipe.name for recipe in response.context['recipes']]
+        self.assertEqual(len(first_page), SEARCH_PAGE_SIZE)
+        self.assertEqual(first_page[0], f'flatbread {SEARCH_PAGE_SIZE + 4}')
+
+        response = self.client.get(reverse('search') + '?' + response.context['next_page_query'])
+        second_page = [recipe.name for recipe in response.context['recipes']]
+        self.assertEqual(len(second_page), 7)  # 5 flatbreads, pancakes and cheese toast
+        self.assertFalse(set(first_page) & set(second_page))
+        self.assertNotIn('next_page_query', response.context)
+
+        response = self.client.get(reverse('search'), params | {'cursor': 'not a cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_paginated_in_database(self):
+        for i in range(SEARCH_PAGE_SIZE * 2):
+            self.create_recipe(f'flatbread {i:02}', self.flour)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(len(self.search(ingredients='flour', exclusive='inclusive')), SEARCH_PAGE_SIZE)
+        # not a list of the ids of every match
+        self.assertFalse(any(self.pancakes.id.hex in query['sql'] for query in queries))
+
+    def test_descendants(self):
+        parmesan = Ingredient.objects.create(name='parmesan', parent=self.cheese)
+        aged_parmesan = Ingredient.objects.create(name='aged parmesan', parent=parmesan)
+        self.create_recipe('pasta', aged_parmesan, self.flour, self.egg)
+        params = {'ingredients': 'cheese,flour,egg', 'include-descendants': 'on'}
+        self.assertEqual(self.search(**params), ['cheese toast', 'pasta'])
+        self.assertEqual(self.search(**params | {'include-descendants': ''}), ['cheese toast'])
+
+        with self.assertNumQueries(0):  # cached until the tree changes
+            ids = descendant_cache.descendant_ids(['cheese', 'flour', 'egg'])
+        self.assertEqual(ids, {self.cheese.id, parmesan.id, aged_parmesan.id, self.flour.id, self.egg.id})
+        with self.captureOnCommitCallbacks(execute=True):
+            aged_parmesan.delete()
+        with self.assertNumQueries(1):
+            self.assertNotIn(aged_parmesan.id, descendant_cache.descendant_ids(['cheese', 'flour', 'egg']))
+
+    def test_query_count_is_constant(self):
+        for i in range(10):
+            self.create_recipe(f'pancakes {i}', self.egg, self.milk, self.flour, self.salt)
+        with self.assertNumQueries(1):
+            recipes = list(database_search(['egg', 'milk', 'flour'], include_ubiquitous=True))
+        self.assertEqual(len(recipes), 12)  # + omelette
+        with self.assertNumQueries(1):
+            self.assertEqual(len(database_search(['flour'], exclusive=False)), 12)
+
+
+@override_settings(RECIPE_SEARCH_BACKEND='index')
+class IndexSearchTest(SearchTest):
+
+    def test_needs_a_shared_cache(self):
+        self.assertEqual([warning.id for warning in checks.check_search_backend(None)], ['recipes.W001'])
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache'}}
+        with override_settings(CACHES=shared):
+            self.assertEqual(checks.check_search_backend(None), [])
+
+
+class RelinkIngredientsCommandTest(FreshIndexesMixin, TestCase):
+
+    def test_relink(self):
+        recipe = Recipe.objects.create(name='recipe')
+        unlinked = RecipeIngredient.objects.create(recipe=recipe, name='2 dl hakket rød løk')
+        linked = RecipeIngredient.objects.create(recipe=recipe, name='salt',
+                                                 base_ingredient=Ingredient.objects.create(name='pepper'))
+        red_onion = Ingredient.objects.create(name='rød løk')
+        salt = Ingredient.objects.create(name='salt')
+
+        call_command('relink_ingredients', stdout=StringIO())
+        unlinked.refresh_from_db()
+        linked.refresh_from_db()
+        self.assertEqual(unlinked.base_ingredient, red_onion)
+        self.assertNotEqual(linked.base_ingredient, salt)
+
+        call_command('relink_ingredients', '--all', stdout=StringIO())
+        linked.refresh_from_db()
+        self.assertEqual(linked.base_ingredient, salt)
+
+
+class RecipeListingTest(FreshIndexesMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        ingredients = [Ingredient.objects.create(name=f'ingredient{i}') for i in range(5)]
+        for i in range(30):
+            recipe = Recipe.objects.create(name=f'recipe {i:02}', content='<p>Step</p>' * 1000)
+            for ingredient in ingredients[i % 3:i % 3 + 3]:
+                RecipeIngredient.objects.create(recipe=recipe, base_ingredient=ingredient)
+
+    def test_list_query_count(self):
+        with self.assertNumQueries(3):  # count, recipes, recipe ingredients
+            response = self.client.get(reverse('recipe_list'))
+        self.assertEqual(len(response.context['recipe_list']), 24)
+        self.assertContains(response, 'ingredient0, ingredient1, ingredient2')
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('recipe_list'), {'page': 2})
+        self.assertEqual(len(response.context['recipe_list']), 6)
+
+    def test_search_query_count(self):
+        ingredient_index.ingredient_ids([])  # built once per process
+        params = {'ingredients': 'ingredient2', 'exclusive': 'inclusive'}
+        with self.assertNumQueries(2):  # recipes, recipe ingredients
+            response = self.client.get(reverse('search'), params)
+        self.assertEqual(len(response.context['recipes']), SEARCH_PAGE_SIZE)
+        self.assertContains(response, 'ingredient2, ingredient3, ingredient4')
+
+    def test_listing_does_not_load_content(self):
+        recipe = Recipe.objects.for_listing().first()
+        self.assertEqual(recipe.get_deferred_fields() & {'content', 'plain_text'}, {'content', 'plain_text'})
+        self.assertTrue(recipe.excerpt.startswith('Step Step'))
+        self.assertLessEqual(len(recipe.excerpt), 140)
+
+
+class RecipeTextTest(TestCase):
+
+    def test_computed_on_save(self):
+        recipe = Recipe.objects.create(name='r', content='<p>Kok &amp; rør</p><p>Server</p>')
+        self.assertEqual(recipe.plain_text, 'Kok & rør Server')
+        self.assertEqual(recipe.excerpt, 'Kok & rør Server')
+        recipe.content = '<p>Stek</p>'
+        recipe.save(update_fields=['content'])
+        recipe.refresh_from_db()
+        self.assertEqual((recipe.plain_text, recipe.excerpt), ('Stek', 'Stek'))
+
+    def test_backfill_excerpts(self):
+        recipe = Recipe.objects.create(name='r', content='<p>Stek</p>')
+        Recipe.objects.update(plain_text='', excerpt='')
+        call_command('backfill_excerpts', chunk_size=1, stdout=StringIO())
+        recipe.refresh_from_db()
+        self.assertEqual((recipe.plain_text, recipe.excerpt), ('Stek', 'Stek'))
+
+
+class FullTextSearchTest(FreshIndexesMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.egg = Ingredient.objects.create(name='egg')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.omelette = Recipe.objects.create(name='Omelett med sopp', content='<p>Stek eggene i smør</p>')
+            RecipeIngredient.objects.create(recipe=self.omelette, base_ingredient=self.egg, name='egg')
+            self.soup = Recipe.objects.create(name='Tomatsuppe', content='<p>Kok tomatene med løk</p>')
+            RecipeIngredient.objects.create(recipe=self.soup, name='hakkede tomater')
+
+    def search(self, **params):
+        response = self.client.get(reverse('search'), params)
+        return [recipe.name for recipe in response.context['recipes']]
+
+    def test_analyze(self):
+        self.assertEqual(fulltext.analyze('Tomatene og LØKEN'), ['tomat', 'og', 'lok'])
+        self.assertEqual(fulltext.analyze('tomater'), fulltext.analyze('tomaten'))
+
+    def test_search(self):
+        self.assertEqual(fulltext.search('tomater'), [self.soup.id])  # stemmed
+        self.assertEqual(fulltext.search('SMØR'), [self.omelette.id])  # folded
+        self.assertEqual(fulltext.search('omel'), [self.omelette.id])  # prefix
+        self.assertEqual(fulltext.search('egg tomat'), [])  # all terms must match
+        self.assertEqual(fulltext.search('egg'), [self.omelette.id])  # ingredient names
+
+    def test_ranking(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipe.objects.create(name='Pasta', content='<p>Server med sopp</p>')
+        # a match in the name weighs more than in the instructions
+        self.assertEqual(self.search(q='sopp'), ['Omelett med sopp', 'Pasta'])
+
+    def test_index_is_kept_current(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.soup.name = 'Gulrotsuppe'
+            self.soup.save()
+        self.assertEqual(fulltext.search('gulrot'), [self.soup.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.soup.recipe_ingredients.all().delete()
+        self.assertEqual(fulltext.search('hakkede'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.omelette.delete()
+        self.assertEqual(fulltext.search('sopp'), [])
+
+    def test_combined_with_ingredients(self):
+        self.assertEqual(self.search(q='kok'), ['Tomatsuppe'])
+        self.assertEqual(self.search(q='stek', ingredients='egg'), ['Omelett med sopp'])
+        self.assertEqual(self.search(q='kok', ingredients='egg'), [])
+
+    def test_many_matches_combined_with_ingredients(self):
+        # more recipes match the text than a fixed number of best ranked ones, and the one using egg ranks last
+        Recipe.objects.bulk_create(Recipe(name=f'Stekt fisk {i}', slug=f'stekt-fisk-{i}') for i in range(600))
+        fulltext.index_recipes(Recipe.objects.values_list('id', flat=True))
+        ids = fulltext.search('stek')
+        self.assertEqual((len(ids), ids[-1]), (601, self.omelette.id))
+        self.assertEqual(self.search(q='stek', ingredients='egg'), ['Omelett med sopp'])
+        self.assertEqual(self.search(q='stek', ingredients='egg', exclusive='inclusive'), ['Omelett med sopp'])
+
+
+class IngredientSuggestionTest(FreshIndexesMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        for name in ('ost', 'revet ost', 'ostepop', 'østers', 'oliven'):
+            Ingredient.objects.create(name=name)
+
+    def suggest(self, prefix, **headers):
+        return self.client.get(reverse('ingredient_suggestions'), {'q': prefix}, **headers)
+
+    def test_suggest(self):
+        self.assertEqual(self.suggest('ost').json()['ingredients'], ['ost', 'østers', 'ostepop', 'revet ost'])
+        self.assertEqual(self.suggest('REV').json()['ingredients'], ['revet ost'])
+        self.assertEqual(self.suggest('').json()['ingredients'], [])
+        with self.assertNumQueries(0):  # built on first use
+            self.suggest('ol')
+
+    def test_kept_current(self):
+        self.suggest('o')
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='olivenolje')
+            Ingredient.objects.get(name='ostepop').delete()
+            oliven = Ingredient.objects.get(name='oliven')
+            oliven.name = 'sorte oliven'
+            oliven.save()
+        self.assertEqual(self.suggest('o').json()['ingredients'],
+                         ['ost', 'østers', 'olivenolje', 'revet ost', 'sorte oliven'])
+
+    def test_etag(self):
+        response = self.suggest('ost')
+        self.assertEqual(self.suggest('ost', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='ostekake')
+        self.assertEqual(self.suggest('ost', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+
+class CachingTest(FreshIndexesMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        caching.cache_stats.clear()
+        self.egg = Ingredient.objects.create(name='egg')
+        self.recipe = Recipe.objects.create(name='omelette', content='<p>Fry</p>', serves=2)
+        self.row = RecipeIngredient.objects.create(recipe=self.recipe, base_ingredient=self.egg, name='egg')
+
+    def search(self):
+        response = self.client.get(reverse('search'), {'ingredients': 'egg'})
+        return [recipe.name for recipe in response.context['recipes']]
+
+    def test_search_results(self):
+        self.assertEqual(self.search(), ['omelette'])
+        with self.assertNumQueries(2):  # recipes, recipe ingredients. The search itself is cached
+            self.assertEqual(self.search(), ['omelette'])
+        # the same search, written differently
+        self.client.get(reverse('search'), {'ingredients': 'egg,egg', 'sort_by': 'alphabetical'})
+        self.assertEqual(caching.cache_stats.stats()['search'], {'hits': 2, 'misses': 1, 'hit_ratio': 2 / 3})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other = Recipe.objects.create(name='boiled egg')
+            RecipeIngredient.objects.create(recipe=other, base_ingredient=self.egg)
+        self.assertEqual(self.search(), ['boiled egg', 'omelette'])
+
+    def test_recipe_detail(self):
+        url = self.recipe.get_absolute_url()
+        self.assertContains(self.client.get(url), 'Fry')
+        with self.assertNumQueries(1):  # the recipe. Its page is cached
+            self.assertContains(self.client.get(url), 'Fry')
+
+        self.row.name = 'eggs'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.row.save()
+        self.assertContains(self.client.get(url), 'eggs')
+        self.recipe.content = '<p>Scramble</p>'
+        self.recipe.save()  # changes the key of its page
+        self.assertContains(self.client.get(url), 'Scramble')
+        self.assertEqual(caching.cache_stats.stats()['recipe_detail']['hits'], 1)
+
+    def test_stats_are_staff_only(self):
+        self.assertEqual(self.client.get(reverse('cache_stats')).status_code, 302)
+        staff = get_user_model().objects.create_user(email='staff@example.com', password='123', is_staff=True)
+        self.client.force_login(staff)
+        self.search()
+        self.assertEqual(self.client.get(reverse('cache_stats')).json()['search']['misses'], 1)
+
+
+class UnitsTest(TestCase):
+    M = RecipeIngredient.Measurements
+
+    def setUp(self):
+        cache.clear()
+        self.recipe = Recipe.objects.create(name='pancakes', serves=4)
+        for amount, measurement, name in ((3, 'dl', 'milk'), (600, 'g', 'flour'), (2, 'tsp', 'sugar'),
+                                          (3, '', 'eggs'), (None, 'g', 'butter')):
+            RecipeIngredient.objects.create(recipe=self.recipe, name=name, amount_per_serving=amount,
+                                            measurement=measurement)
+
+    def test_normalise(self):
+        self.assertEqual(units.normalise(1500, self.M.GRAMS), (1.5, self.M.KILOGRAMS))
+        self.assertEqual(units.normalise(0.4, self.M.KILOGRAMS), (400, self.M.GRAMS))
+        self.assertEqual(units.normalise(0.5, self.M.KILOGRAMS), (0.5, self.M.KILOGRAMS))
+        self.assertEqual(units.normalise(12, self.M.DECILITERS), (1.2, self.M.LITERS))
+        self.assertEqual(units.normalise(6, self.M.TEASPOONS), (2, self.M.TABLESPOONS))
+        self.assertEqual(units.normalise(7, self.M.SLICES), (7, self.M.SLICES))
+        self.assertEqual(units.convert(2, self.M.TABLESPOONS, self.M.DECILITERS), 0.3)
+        self.assertEqual(units.to_base(2, self.M.LITERS), (2000, self.M.MILLILITERS))
+        with self.assertRaises(ValueError):
+            units.convert(1, self.M.GRAMS, self.M.LITERS)
+        self.assertEqual([units.format_amount(x) for x in (1.333, 0.333, 250.0, None)], ['1.3', '0.33', '250', ''])
+
+    def test_scale(self):
+        scaled = [(i.name, i.amount_display, i.measurement) for i in units.scale_recipe(self.recipe, 8)]
+        self.assertEqual(scaled, [('milk', '6', 'dl'), ('flour', '1.2', 'kg'), ('sugar', '1.3', 'tbsp'),
+                                  ('eggs', '6', ''), ('butter', '', 'g')])
+
+    def test_api(self):
+        url = reverse('recipe_servings', kwargs={'uuid': self.recipe.id})
+        data = self.client.get(url, {'servings': 2}).json()
+        self.assertEqual(data['servings'], 2)
+        self.assertEqual(data['ingredients'][0], {
+            'id': self.recipe.recipe_ingredients.get(name='milk').id, 'name': 'milk', 'amount': 1.5,
+            'measurement': 'dl', 'amount_display': '1.5',
+        })
+        with self.assertNumQueries(1):  # the recipe. Common serving counts are cached
+            self.client.get(url, {'servings': 2})
+        for servings in (0, 'x', views.MAX_SERVINGS + 1):
+            self.assertEqual(self.client.get(url, {'servings': servings}).status_code, 404)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            RecipeIngredient.objects.filter(name='milk').get().delete()
+        self.assertEqual(len(self.client.get(url, {'servings': 2}).json()['ingredients']), 4)
+
+    def test_detail_page(self):
+        response = self.client.get(self.recipe.get_absolute_url())
+        self.assertContains(response, '<span class="serving-span">600</span>', html=False)
+        self.assertContains(response, reverse('recipe_servings', kwargs={'uuid': self.recipe.id}))
+
+
+class ShoppingListTest(FreshIndexesMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        cheese = Ingredient.objects.create(name='ost')
+        parmesan = Ingredient.objects.create(name='parmesan', parent=cheese)
+        milk = Ingredient.objects.create(name='melk')
+        salt = Ingredient.objects.create(name='salt', ubiquitous=True)
+        self.pasta = Recipe.objects.create(name='pasta', serves=2)
+        self.pancakes = Recipe.objects.create(name='pancakes', serves=4)
+        self.salad = Recipe.objects.create(name='salad')
+        for recipe, ingredient, amount, measurement in (
+                (self.pasta, parmesan, 50, 'g'), (self.pasta, milk, 1, 'dl'), (self.pasta, salt, 1, 'tsp'),
+                (self.pancakes, milk, 6, 'dl'), (self.pancakes, milk, 2, 'tbsp'), (self.pancakes, cheese, 2, 'dl'),
+                (self.salad, cheese, 0.1, 'kg'), (self.salad, None, 2, 'slices')):
+            RecipeIngredient.objects.create(recipe=recipe, base_ingredient=ingredient, amount_per_serving=amount,
+                                            measurement=measurement, name='' if ingredient else 'Brød')
+        # unnormalised units, as scraped. See scrape.utils.conversions
+        RecipeIngredient.objects.filter(measurement='tbsp').update(measurement='ss')
+
+    def items(self, selection, **kwargs):
+        with self.assertNumQueries(3 if kwargs.get('roll_up') else 2):
+            recipes, items = shopping.shopping_list(selection, **kwargs)
+        return {item.name: item.amount_display for item in items}
+
+    def test_shopping_list(self):
+        selection = {self.pasta.id: 4, self.pancakes.id: None, self.salad.id: 3}
+        self.assertEqual(self.items(selection), {
+            'Brød': '2 slices', 'melk': '8.3 dl', 'ost': '100 g + 2 dl', 'parmesan': '100 g', 'salt': '2 tsp',
+        })
+        self.assertEqual(self.items(selection, drop_ubiquitous=True, roll_up=True), {
+            'Brød': '2 slices', 'melk': '8.3 dl', 'ost': '200 g + 2 dl',
+        })
+
+    def test_selection(self):
+        value = f'{self.pasta.id}:4,{self.salad.id}'
+        self.assertEqual(shopping.parse_selection(value), {self.pasta.id: 4, self.salad.id: None})
+        self.assertEqual(shopping.format_selection(shopping.parse_selection(value)), value)
+        for invalid in (f'{self.pasta.id}:0', f'{self.pasta.id}:x', 'nope'):
+            with self.assertRaises(ValueError):
+                shopping.parse_selection(invalid)
+
+    def test_view(self):
+        params = {'recipes': f'{self.pasta.id}:4', 'drop-ubiquitous': 'on'}
+        response = self.client.get(reverse('shopping_list'), params)
+        self.assertContains(response, 'parmesan')
+        self.assertNotContains(response, 'salt')
+        self.assertEqual(self.client.get(reverse('shopping_list'), {'recipes': 'nope'}).status_code, 404)
+
+
+class CookbookExportTest(FreshIndexesMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    @staticmethod
+    def snapshot():
+        return (
+            list(Ingredient.objects.order_by('tree_id', 'lft')
+                 .values_list('name', 'parent__name', 'level', 'ubiquitous')),
+            list(Recipe.objects.order_by('id')
+                 .values_list('id', 'name', 'slug', 'serves', 'excerpt', 'datetime_created')),
+            sorted(RecipeIngredient.objects.values_list(
+                'recipe_id', 'name', 'base_ingredient__name', 'amount_per_serving', 'measurement')),
+        )
+
+    def test_round_trip(self):
+        call_command('generate_catalogue', recipes=30, ingredients=25, stdout=StringIO())
+        RecipeIngredient.objects.filter(measurement='tbsp').update(measurement='ss')  # converted on import
+        before = self.snapshot()
+        path = os.path.join(self.directory, 'cookbook.jsonl.gz')
+        call_command('export_cookbook', path, chunk_size=7, stderr=StringIO())
+
+        RecipeIngredient.objects.all().delete()
+        Recipe.objects.all().delete()
+        Ingredient.objects.all().delete()
+        out = StringIO()
+        call_command('import_cookbook', path, chunk_size=7, stdout=out)
+        self.assertIn('Recipes: 30 created, 0 updated', out.getvalue())
+        after = self.snapshot()
+        self.assertEqual(after[:2], before[:2])
+        self.assertEqual(after[2], sorted(row[:4] + ('tbsp' if row[4] == 'ss' else row[4],) for row in before[2]))
+        self.assertEqual(len(fulltext.search('recipe')), 30)
+
+        call_command('import_cookbook', path, stdout=out)  # upserts
+        self.assertIn('Ingredients: 0 created, 25 updated. Recipes: 0 created, 30 updated', out.getvalue())
+        self.assertEqual(self.snapshot(), after)
+
+    def test_export_lines(self):
+        cheese = Ingredient.objects.create(name='ost')
+        Ingredient.objects.create(name='parmesan', parent=cheese)
+        recipe = Recipe.objects.create(name='pasta', content='<p>Kok</p>', serves=2)
+        RecipeIngredient.objects.create(recipe=recipe, name='Parmesan', base_ingredient=cheese, amount_per_serving=50,
+                                        measurement='g')
+        header, *objects = map(json.loads, jsonl.export_lines())
+        self.assertEqual(header, {'type': 'cookbook', 'version': jsonl.FORMAT_VERSION})
+        self.assertEqual(objects[:2], [
+            {'type': 'ingredient', 'name': 'ost', 'parent': None, 'ubiquitous': False},
+            {'type': 'ingredient', 'name': 'parmesan', 'parent': 'ost', 'ubiquitous': False},
+        ])
+        self.assertEqual(objects[2]['id'], str(recipe.id))
+        self.assertEqual(objects[2]['ingredients'], [
+            {'name': 'Parmesan', 'base_ingredient': 'ost', 'amount_per_serving': 50.0, 'measurement': 'g'},
+        ])
+        with self.assertRaises(ValueError):
+            jsonl.import_lines(['{"type": "recipes"}'])
+
+    def test_import_invalidates_indexes(self):
+        cheese, butter = Ingredient.objects.create(name='ost'), Ingredient.objects.create(name='smør')
+        recipe = Recipe.objects.create(name='pasta')
+        RecipeIngredient.objects.create(recipe=recipe, base_ingredient=cheese)
+        lines = [line.replace('"base_ingredient": "ost"', '"base_ingredient": "smør"')
+                 for line in jsonl.export_lines()]
+        deleted = []
+
+        def receiver(sender, instance, **kwargs):
+            deleted.append(instance)
+        post_delete.connect(receiver, sender=RecipeIngredient)
+        self.addCleanup(post_delete.disconnect, receiver, sender=RecipeIngredient)
+
+        ingredient_index.ingredient_ids(['ost'])  # build the index
+        with self.captureOnCommitCallbacks(execute=True):
+            butter.delete()  # the import creates it again
+        self.assertEqual(ingredient_index.ingredient_ids(['smør']), set())
+        with self.captureOnCommitCallbacks(execute=True):
+            jsonl.import_lines(lines)
+        self.assertEqual(deleted, [])  # the recipe's ingredients were replaced without signals
+        self.assertEqual(ingredient_index.ingredient_ids(['smør']), {Ingredient.objects.get(name='smør').id})
+        search = {'ingredients': 'smør', 'exclusive': 'inclusive'}
+        self.assertEqual(list(self.client.get(reverse('search'), search).context['recipes']), [recipe])
+
+    def test_raw_delete_exists(self):
+        # private Django API the import relies on, see jsonl._import_recipes
+        self.assertTrue(callable(getattr(QuerySet, '_raw_delete', None)))
+
+    def test_read_ingredients(self):
+        Ingredient.objects.create(name='ost')
+        cwd = os.getcwd()
+        os.chdir(self.directory)
+        try:
+            with open('ingredients.txt', 'w', encoding='utf-8') as f:
+                f.write('ost\nrømme\n\nrømme\nløk\n')
+            read_ingredients()
+            write_ingredients()
+            with open('ingredients.txt', encoding='utf-8') as f:
+                self.assertEqual(f.read(), 'løk\nost\nrømme\n')
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(Ingredient.objects.count(), 3)
+
+
+@skipUnless(connection.vendor == 'sqlite', "reads SQLite query plans")
+class QueryPlanTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        ingredients = [Ingredient.objects.create(name=f'ingredient{i}', ubiquitous=i % 10 == 0) for i in range(50)]
+        for i in range(200):
+            recipe = Recipe.objects.create(name=f'recipe {i}')
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, base_ingredient=ingredients[(i * 7 + k) % 50]) for k in range(6)
+            )
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(index, plan)
+        self.assertNotRegex(plan, r'(?m)SCAN \w+$')  # a full table scan
+
+    def test_listing_orders(self):
+        for sort_by, index in (('alphabetical', 'recipe_name_id_idx'), ('recent', 'recipe_recent_idx')):
+            with self.subTest(sort_by):
+                self.assertUsesIndex(Recipe.objects.for_listing().order_by(*SORT_ORDERINGS[sort_by])[:21], index)
+
+    def test_recipe_ingredients(self):
+        recipe_ids = list(Recipe.objects.values_list('id', flat=True)[:20])
+        self.assertUsesIndex(RecipeIngredient.objects.filter(recipe__in=recipe_ids), 'ri_recipe_ingredient_idx')
+
+    def test_search(self):
+        self.assertUsesIndex(database_search(['ingredient1', 'ingredient2']), 'COVERING INDEX ri_recipe_ingredient_idx')
+        usages = Recipe.objects.filter(recipe_ingredients__base_ingredient__name__in=['ingredient1'])
+        self.assertUsesIndex(usages.values('id'), 'COVERING INDEX ri_ingredient_recipe_idx')
+
+    def test_ubiquitous(self):
+        self.assertUsesIndex(Ingredient.objects.filter(ubiquitous=True).values_list('id'), 'ingredient_ubiquitous_idx')
+
+
+class BenchmarkCommandsTest(FreshIndexesMixin, TestCase):
+
+    @staticmethod
+    def tree():
+        return list(Ingredient.objects.order_by('id').values_list('parent', 'level', 'lft', 'rght'))
+
+    def test_generate_catalogue(self):
+        ingredient_index.ingredient_ids([])  # build the index
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('generate_catalogue', recipes=50, ingredients=40, ubiquitous=0.1, chunk_size=20,
+                         stdout=StringIO())
+        self.assertEqual(len(ingredient_index.ingredient_ids(Ingredient.objects.values_list('name', flat=True))), 40)
+        self.assertEqual(Recipe.objects.count(), 50)
+        self.assertEqual(Ingredient.objects.filter(ubiquitous=True).count(), 4)
+        self.assertTrue(RecipeIngredient.objects.exists())
+        self.assertTrue(Recipe.objects.exclude(excerpt='').exists())
+        self.assertEqual(len(fulltext.search('recipe')), 50)
+
+        generated = self.tree()
+        self.assertTrue(any(parent is not None for parent, *_ in generated))
+        Ingredient.objects.rebuild()
+        self.assertEqual(self.tree(), generated)  # the tree fields were numbered as MPTT would
+
+    def test_benchmark(self):
+        call_command('generate_catalogue', recipes=30, ingredients=20, stdout=StringIO())
+        out = StringIO()
+        call_command('benchmark', repeat=3, stdout=out, stderr=StringIO())
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['recipes'], 30)
+        self.assertEqual(set(report['results']), {
+            'search_exclusive', 'search_inclusive', 'search_best_match', 'recipe_list', 'recipe_detail',
+            'create_recipe_from_scrape',
+        })
+        self.assertEqual(report['results']['recipe_list']['runs'], 3)
+        self.assertEqual(Recipe.objects.count(), 30)  # imports were rolled back
+
+
+class AsyncViewsTest(FreshIndexesMixin, TransactionTestCase):
+    """ The views served under ASGI. They query in other threads, so the data must be committed """
+
+    def setUp(self):
+        super().setUp()
+        self.factory = AsyncRequestFactory()
+        egg = Ingredient.objects.create(name='egg')
+        self.recipe = Recipe.objects.create(name='omelette', content='<p>Whisk the eggs</p>')
+        RecipeIngredient.objects.create(recipe=self.recipe, base_ingredient=egg)
+
+    async def test_search(self):
+        response = await async_views.search(self.factory.get('/?ingredients=egg&exclusive=inclusive'))
+        self.assertContains(response, 'Omelette')
+
+    async def test_recipe_pages(self):
+        view = async_views.RecipeDetailView.as_view()
+        response = await view(self.factory.get('/'), uuid=self.recipe.id, slug=self.recipe.slug)
+        self.assertContains(response, 'Whisk the eggs')
+        with self.assertRaises(Http404):
+            await view(self.factory.get('/'), uuid=uuid.uuid4(), slug='missing')
+        self.assertContains(await async_views.RecipeListView.as_view()(self.factory.get('/recipes/')), 'omelette')
+        self.assertEqual((await view(self.factory.post('/'), uuid=self.recipe.id, slug='')).status_code, 405)
+
+
+class LoadTestCommandTest(FreshIndexesMixin, LiveServerTestCase):
+
+    def test_loadtest(self):
+        call_command('generate_catalogue', recipes=30, ingredients=20, stdout=StringIO())
+        out = StringIO()
+        call_command('loadtest', f'a={self.live_server_url}', f'b={self.live_server_url}/', requests=20,
+                     concurrency=4, warmup=2, stdout=out, stderr=StringIO())
+        report = json.loads(out.getvalue())
+        self.assertEqual(set(report['results']), {'a', 'b'})
+        self.assertEqual(report['results']['a']['requests'], 20)
+        self.assertEqual(report['results']['a']['errors'], 0)
+        self.assertEqual(set(report['results']['a']['pages']) - {'search', 'recipe_detail', 'recipe_list'}, set())
+        self.assertEqual(set(report['comparison']), {'b'})
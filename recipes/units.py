@@ -0,0 +1,127 @@
+"""
+Scaling recipes to a number of servings, and conversion between the units of RecipeIngredient.Measurements.
+
+Amounts are stored for Recipe.serves servings. Scaled amounts are shown in the most readable unit of their family,
+e.g. 1500 g as 1.5 kg and 6 tsp as 2 tbsp. Families are never mixed on display, but spoons are measured in ml like
+the other volumes, so amounts of both can be added up (to_base). Other measurements (count, slices) are only scaled.
+"""
+from recipes.models import RecipeIngredient
+
+M = RecipeIngredient.Measurements
+
+# units of each family, smallest first, with their size in the family's base unit
+FAMILIES = {
+    'mass': ((M.GRAMS, 1), (M.KILOGRAMS, 1000)),
+    'volume': ((M.MILLILITERS, 1), (M.CENTILITERS, 10), (M.DECILITERS, 100), (M.LITERS, 1000)),
+    'spoons': ((M.TEASPOONS, 5), (M.TABLESPOONS, 15)),
+}
+BASE_UNITS = {'mass': M.GRAMS, 'volume': M.MILLILITERS, 'spoons': M.MILLILITERS}
+# amounts below this share of one of their unit are shown in the next smaller unit: 0.4 kg as 400 g, 0.5 kg as is
+SMALLER_BELOW = 0.5
+
+# unit -> (family, size in base units, position in the family)
+UNITS = {
+    unit: (family, size, position)
+    for family, units in FAMILIES.items() for position, (unit, size) in enumerate(units)
+}
+# (from unit, to unit) -> factor, for every pair of units with the same base unit
+CONVERSIONS = {
+    (a, b): UNITS[a][1] / UNITS[b][1]
+    for a in UNITS for b in UNITS if BASE_UNITS[UNITS[a][0]] == BASE_UNITS[UNITS[b][0]]
+}
+
+
+def convert(amount, from_unit, to_unit):
+    """ :raise ValueError: if the units measure different things """
+    if from_unit == to_unit:
+        return amount
+    try:
+        return amount * CONVERSIONS[from_unit, to_unit]
+    except KeyError:
+        raise ValueError(f"Can't convert {from_unit!r} to {to_unit!r}") from None
+
+
+def family(unit):
+    """ :return: the family of the unit ('mass', 'volume' or 'spoons'), or None if it can't be converted """
+    return UNITS[unit][0] if unit in UNITS else None
+
+
+def from_base(amount, family):
+    """ :return: (amount, unit) in the most readable unit of the family, for an amount in its base unit """
+    smallest, size = FAMILIES[family][0]
+    return normalise(amount / size, smallest)
+
+
+def to_base(amount, unit):
+    """ :return: (amount, unit) in the base unit of the unit's family (g or ml). Other units are kept """
+    if unit not in UNITS:
+        return amount, unit
+    family, size, _ = UNITS[unit]
+    return amount * size, BASE_UNITS[family]
+
+
+def normalise(amount, unit):
+    """ :return: (amount, unit) in the most readable unit of the unit's family. Other units are kept """
+    if amount is None or unit not in UNITS:
+        return amount, unit
+    family, size, position = UNITS[unit]
+    units = FAMILIES[family]
+    base = amount * size
+    while position + 1 < len(units) and base >= units[position + 1][1]:  # at least one of a larger unit
+        position += 1
+    while position > 0 and base < units[position][1] * SMALLER_BELOW:
+        position -= 1
+    return base / units[position][1], units[position][0]
+
+
+def format_amount(amount):
+    """ Rounded for reading: 1.333 -> 1.3, 0.333 -> 0.33, 250.0 -> 250 """
+    if amount is None:
+        return ''
+    return f'{round(amount, 1 if amount >= 1 else 2):g}'
+
+
+class ScaledIngredient:
+    def __init__(self, id, name, amount, measurement):
+        self.id = id
+        self.name = name
+        self.amount = amount
+        self.measurement = measurement
+
+    @property
+    def amount_display(self):
+        return format_amount(self.amount)
+
+    def as_dict(self):
+        return {
+            'id': self.id, 'name': self.name, 'amount': self.amount, 'measurement': self.measurement,
+            'amount_display': self.amount_display,
+        }
+
+
+def scale_ratio(serves, servings):
+    """ :param serves: Recipe.serves, the servings the amounts are for. If None, amounts are not scaled """
+    return servings / serves if serves and servings else 1
+
+
+def scale(rows, serves, servings):
+    """
+    Scales all of a recipe's ingredients in one pass
+    :param rows: (id, name, amount_per_serving, measurement) of the recipe's ingredients
+    :param serves: see scale_ratio
+    :return: list of ScaledIngredient
+    """
+    ratio = scale_ratio(serves, servings)
+    return [
+        ScaledIngredient(row_id, name, *normalise(None if amount is None else amount * ratio, measurement))
+        for row_id, name, amount, measurement in rows
+    ]
+
+
+def scale_recipe(recipe, servings=None):
+    """
+    :param servings: Recipe.serves by default
+    :return: list of ScaledIngredient of the recipe's ingredients, in the order they were added
+    """
+    rows = recipe.recipe_ingredients.order_by('id').values_list('id', 'name', 'amount_per_serving', 'measurement')
+    return scale(rows, recipe.serves, servings or recipe.serves)
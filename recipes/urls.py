@@ -1,10 +1,20 @@
+from django.conf import settings
 from django.urls import path
 
-from recipes.views import RecipeListView, search, RecipeDetailView, scrape_view
+from recipes import async_views, views
+from recipes.views import ingredient_suggestions, cache_stats, scrape_job_view, recipe_servings, \
+    shopping_list_view
+
+pages = async_views if settings.ASYNC_VIEWS else views  # search, recipe and scrape views
 
 urlpatterns = [
-    path('', search, name='search'),
-    path('scrape/', scrape_view, name='scrape'),
-    path('recipes/', RecipeListView.as_view(), name='recipe_list'),
-    path('<uuid:uuid>/<slug:slug>/', RecipeDetailView.as_view(), name='recipe_detail'),
-]
\ No newline at end of file
+    path('', pages.search, name='search'),
+    path('ingredients/suggest/', ingredient_suggestions, name='ingredient_suggestions'),
+    path('stats/cache/', cache_stats, name='cache_stats'),
+    path('scrape/', pages.scrape_view, name='scrape'),
+    path('scrape/<uuid:uuid>/', scrape_job_view, name='scrape_job'),
+    path('recipes/', pages.RecipeListView.as_view(), name='recipe_list'),
+    path('recipes/<uuid:uuid>/servings/', recipe_servings, name='recipe_servings'),
+    path('shopping-list/', shopping_list_view, name='shopping_list'),
+    path('<uuid:uuid>/<slug:slug>/', pages.RecipeDetailView.as_view(), name='recipe_detail'),
+]
@@ -1,59 +1,175 @@
-from collections import Counter
+import hashlib
 
-from django.http import HttpResponseRedirect
-from django.shortcuts import render
+from django.conf import settings
+from django.http import HttpResponseRedirect, Http404, JsonResponse
+from django.contrib.admin.views.decorators import staff_member_required
+from django.shortcuts import render, get_object_or_404
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
 from django.views.generic import ListView, DetailView
 
-from scrape.utils import create_recipe_from_scrape
-from recipes.models import Recipe, Ingredient
-from scrape.scrape import scrape, get_sites
+from recipes import jobs, units, shopping
+from recipes.models import Recipe, ScrapeJob
+from lib.pagination import keyset_paginate, KeysetPage
+from recipes import caching
+from recipes.fulltext import rank_recipes, analyze
+from recipes.search import ingredient_index, descendant_cache, database_search, SORT_ORDERINGS, \
+    ingredient_prefix_index
+from scrape.scrape import get_sites
+
+SEARCH_PAGE_SIZE = 20
+SUGGESTION_LIMIT = 10
+MAX_SERVINGS = 100
 
 
 class RecipeListView(ListView):
     model = Recipe
+    paginate_by = 24
+    ordering = ('name', 'id')  # total, so pages don't overlap
 
     def get_queryset(self):
-        return Recipe.objects.prefetch_related('recipe_ingredients__base_ingredient')
+        return Recipe.objects.for_listing()
 
 
 class RecipeDetailView(DetailView):
     model = Recipe
+    pk_url_kwarg = 'uuid'  # slugs aren't unique. Look recipes up by primary key
+
+    def get_queryset(self):
+        return Recipe.objects.defer('content', 'plain_text')  # only loaded to render the page on cache misses
+
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        ctx['recipe_body'] = caching.recipe_detail(self.object, self.render_body)
+        return ctx
+
+    def render_body(self):
+        ingredients = caching.scaled_recipe(
+            self.object, self.object.serves, lambda: units.scale_recipe(self.object),
+        )
+        return render_to_string('recipes/recipe_detail_body.html', {'recipe': self.object, 'ingredients': ingredients})
+
+
+def recipe_servings(request, uuid):
+    """ The recipe's ingredients scaled to ?servings=, as JSON. For adjusting the servings on the recipe page """
+    recipe = get_object_or_404(Recipe.objects.only('id', 'serves', 'datetime_updated'), id=uuid)
+    try:
+        servings = int(request.GET.get('servings', recipe.serves))
+    except (TypeError, ValueError):
+        raise Http404("Invalid servings")
+    if not recipe.serves or not 1 <= servings <= MAX_SERVINGS:
+        raise Http404("Invalid servings")
+    ingredients = caching.scaled_recipe(recipe, servings, lambda: units.scale_recipe(recipe, servings))
+    return JsonResponse({'servings': servings, 'ingredients': [ingredient.as_dict() for ingredient in ingredients]})
 
 
 def scrape_view(request):
     if url := request.POST.get("scrape_url"):
-        recipe = create_recipe_from_scrape(scrape(url))
-        return HttpResponseRedirect('/admin/recipes/recipe/' + str(recipe.id) + '/change')
+        job = jobs.submit(url)  # scraped in the background
+        return HttpResponseRedirect(reverse('scrape_job', kwargs={'uuid': job.id}))
     return render(request, template_name='scrape.html', context={'supported_sites': get_sites().keys()})
 
 
+def scrape_job_view(request, uuid):
+    """ Status of a scrape job. Redirects to the new recipe in the admin once it is done """
+    job = get_object_or_404(ScrapeJob, id=uuid)
+    if job.status == ScrapeJob.Status.DONE and job.recipe_id:
+        return HttpResponseRedirect(reverse('admin:recipes_recipe_change', args=(job.recipe_id,)))
+    return render(request, 'scrape_job.html', {'job': job, 'in_flight': job.status in ScrapeJob.IN_FLIGHT})
+
+
 def search(request):
     query = request.GET
-    ctx = {'ingredients': Ingredient.objects.all()}
-    if query:
+    ctx = {}
+    ingredients = sorted({name for name in query.get('ingredients', '').split(",") if name})
+    text = query.get('q', '').strip()  # full-text search in names, ingredients and instructions
+    if ingredients or text:
         exclusive = not query.get('exclusive') == "inclusive"  # default to exclusive
-        sort_by = query.get('sort_by')  # should support: "recent", "alphabetical", "most matches". Support ASC, DESC?
-        ingredients = query.get('ingredients', '').split(",")
-        if ingredients:
-            relevant_recipes = Recipe.objects.prefetch_related('recipe_ingredients__base_ingredient')\
-                .filter(recipe_ingredients__base_ingredient__name__in=ingredients)
-            if exclusive:
-                recipes = relevant_recipes.distinct()
-                include_ubiquitous = query.get('include-ubiquitous') == "on"
-                if include_ubiquitous:
-                    ingredients += Ingredient.objects.filter(ubiquitous=True).values_list('name', flat=True)
-                for recipe in list(recipes):
-                    if not all(ingredient in ingredients for ingredient in
-                               recipe.recipe_ingredients.all().values_list('base_ingredient')\
-                               .values_list('name',flat=True)):
-                        recipes = recipes.exclude(id=recipe.id)
-            if sort_by:
-                # default sorting is alphabetical, as specified in model.
-                if not exclusive and sort_by == 'best_match':  # sorting by best match is meaningless for exclusive
-                    recipes_counter = Counter(relevant_recipes)
-                    recipes = sorted(recipes_counter, key=recipes_counter.get, reverse=True)
-                elif sort_by == 'recent':
-                    recipes = sorted(recipes, key=lambda recipe: recipe.datetime_created, reverse=True)
-
-            ctx.update({'recipes': recipes})
+        include_ubiquitous = exclusive and query.get('include-ubiquitous') == "on"
+        descendants = query.get('include-descendants') == "on"  # "ost" also finds recipes using "parmesan"
+        sort_by = query.get('sort_by')  # "best_match", "recent", "alphabetical" or "relevance"
+        if sort_by not in SORT_ORDERINGS or sort_by == 'best_match' and not ingredients or \
+                sort_by == 'relevance' and not text:
+            sort_by = 'relevance' if text else 'alphabetical'
+        cursor = query.get('cursor')
+
+        key = caching.search_key(
+            ingredients=ingredients, exclusive=exclusive, include_ubiquitous=include_ubiquitous,
+            descendants=descendants and bool(ingredients), terms=analyze(text), sort_by=sort_by, cursor=cursor,
+        )
+        cached = caching.get_search(key)
+        if cached is None:
+            page = _search_page(ingredients, text, exclusive, include_ubiquitous, descendants, sort_by, cursor)
+            caching.set_search(key, [recipe.id for recipe in page], page.next_cursor)
+        else:
+            recipe_ids, next_cursor = cached
+            recipes = Recipe.objects.for_listing().in_bulk(recipe_ids)
+            page = KeysetPage([recipes[i] for i in recipe_ids if i in recipes], next_cursor)
+
+        ctx.update({'recipes': page})
+        if page.has_next():
+            next_query = query.copy()
+            next_query['cursor'] = page.next_cursor
+            ctx.update({'next_page_query': next_query.urlencode()})
     return render(request, 'home.html', ctx)
+
+
+def _search_page(ingredients, text, exclusive, include_ubiquitous, descendants, sort_by, cursor):
+    """ :raise Http404: if the cursor is invalid """
+    if ingredients:
+        ingredient_ids = None
+        if settings.RECIPE_SEARCH_BACKEND == 'index':
+            # resolved in memory, while the recipes are found, sorted and paginated in the database. A list of the ids
+            # of every matching recipe would grow with the number of matches
+            if descendants:
+                ingredient_ids = descendant_cache.descendant_ids(ingredients)
+            else:
+                ingredient_ids = ingredient_index.ingredient_ids(ingredients)
+        recipes = database_search(ingredients, exclusive, include_ubiquitous, descendants, ingredient_ids)
+    else:
+        recipes = Recipe.objects.all()
+    if text:
+        recipes = rank_recipes(recipes, text)
+    try:
+        return keyset_paginate(recipes.for_listing(), SORT_ORDERINGS[sort_by], cursor, per_page=SEARCH_PAGE_SIZE)
+    except ValueError:
+        raise Http404("Invalid cursor")
+
+
+def shopping_list_view(request):
+    """
+    The ingredients of the recipes in ?recipes= added up, see recipes.shopping. Ubiquitous ingredients are left out
+    with ?drop-ubiquitous=on, and ingredient families counted as their root with ?roll-up=on
+    """
+    try:
+        selection = shopping.parse_selection(request.GET.get('recipes', ''))
+    except ValueError:
+        raise Http404("Invalid recipes")
+    drop_ubiquitous = request.GET.get('drop-ubiquitous') == 'on'
+    roll_up = request.GET.get('roll-up') == 'on'
+    recipes, items = shopping.shopping_list(selection, drop_ubiquitous, roll_up)
+    for recipe in recipes:
+        recipe.servings = selection[recipe.id] or recipe.serves
+        recipe.without_query = shopping.format_selection({i: s for i, s in selection.items() if i != recipe.id})
+    return render(request, 'recipes/shopping_list.html', {
+        'recipes': recipes, 'items': items, 'selection': shopping.format_selection(selection),
+        'drop_ubiquitous': drop_ubiquitous, 'roll_up': roll_up,
+    })
+
+
+def ingredient_suggestions(request):
+    """ Autocompletion for the ingredient search bar: names of ingredients matching the prefix ?q= as JSON """
+    names = ingredient_prefix_index.suggest(request.GET.get('q', ''), SUGGESTION_LIMIT)
+    response = JsonResponse({'ingredients': names})
+    etag = quote_etag(hashlib.md5(response.content).hexdigest())
+    response['ETag'] = etag
+    patch_cache_control(response, max_age=60)
+    return get_conditional_response(request, etag=etag, response=response)
+
+
+@staff_member_required
+def cache_stats(request):
+    """ Hit ratios of the search and recipe page caches in this process """
+    return JsonResponse(caching.cache_stats.stats())
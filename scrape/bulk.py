@@ -0,0 +1,93 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing
+from urllib.parse import urlparse
+
+from scrape.http import fetch_stream, RateLimiter
+from scrape.scrape import parse_stream, get_parsers
+
+
+class ScrapeResult:
+    def __init__(self, url, data=None, error=None, seconds=0.0):
+        self.url = url
+        self.data = data  # see scrape.scrape.scrape
+        self.error = error
+        self.seconds = seconds
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class ScrapeStats:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.finished = None
+        self.succeeded = 0
+        self.failed = 0
+
+    def add(self, result):
+        if result.ok:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+
+    def mark_failed(self):
+        """ For a page that was scraped, but failed later on, e.g. when saving its recipe """
+        self.succeeded -= 1
+        self.failed += 1
+
+    @property
+    def total(self):
+        return self.succeeded + self.failed
+
+    @property
+    def seconds(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def pages_per_second(self):
+        return self.total / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return f"{self.succeeded}/{self.total} pages scraped in {self.seconds:.1f}s " \
+               f"({self.pages_per_second:.2f} pages/s), {self.failed} failed"
+
+
+def _scrape_one(url, rate_limiter, resolve_parsers, offline):
+    start = time.monotonic()
+    try:
+        parsers = resolve_parsers(url)
+        if not offline:
+            rate_limiter.wait(urlparse(url).netloc)
+        with closing(fetch_stream(url, offline=offline)) as chunks:
+            data = parse_stream(url, chunks, *parsers)
+        return ScrapeResult(url, data=data, seconds=time.monotonic() - start)
+    except Exception as e:  # one bad page should not stop the batch
+        return ScrapeResult(url, error=e, seconds=time.monotonic() - start)
+
+
+def scrape_many(urls, workers=8, per_domain_rate=None, resolve_parsers=None, stats=None, offline=False):
+    """
+    Fetches and parses the urls concurrently on a bounded thread pool.
+    Connections are pooled and kept alive per host, see scrape.http.get_session.
+    :param workers: max number of pages being fetched at once
+    :param per_domain_rate: max requests per second to any single domain. None for no limit
+    :param resolve_parsers: url -> (scrape function, JSON-LD scrape function). See scrape.scrape.get_parsers
+    :param stats: optional ScrapeStats that is updated as results come in
+    :param offline: only use pages in the response cache, see scrape.http.fetch_stream
+    :return: generator of ScrapeResults, in order of completion
+    """
+    rate_limiter = RateLimiter(per_domain_rate)
+    resolve_parsers = resolve_parsers or get_parsers
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(_scrape_one, url, rate_limiter, resolve_parsers, offline) for url in dict.fromkeys(urls)
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            if stats is not None:
+                stats.add(result)
+            yield result
+    if stats is not None:
+        stats.finished = time.monotonic()
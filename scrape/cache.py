@@ -0,0 +1,160 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+class CachedResponse:
+    def __init__(self, body, etag, last_modified):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+class ResponseCache:
+    """
+    On-disk cache of fetched pages, used by scrape.http.fetch_stream.
+    Bodies are stored zlib compressed and content addressed (named by their sha256), so pages with identical
+    content share a file. A sqlite index maps urls to bodies along with the validators (ETag, Last-Modified)
+    needed to revalidate them. When the stored bodies exceed max_bytes the least recently used urls are evicted.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS entries (url TEXT PRIMARY KEY, digest TEXT NOT NULL, etag TEXT, "
+                "last_modified TEXT, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+            db.execute("CREATE INDEX IF NOT EXISTS entries_digest ON entries (digest)")
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(os.path.join(self.directory, 'index.sqlite3'), timeout=30)
+        try:
+            with db:  # commits, or rolls back on errors
+                yield db
+        finally:
+            db.close()
+
+    def _path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def get(self, url):
+        """ :return: CachedResponse or None. Does not count as a hit or miss, see record() """
+        with self._lock, self._connect() as db:
+            row = db.execute("SELECT digest, etag, last_modified FROM entries WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return None
+            digest, etag, last_modified = row
+            try:
+                with open(self._path(digest), 'rb') as f:
+                    body = zlib.decompress(f.read()).decode('utf-8')
+            except (OSError, zlib.error):  # removed or corrupted behind our back
+                db.execute("DELETE FROM entries WHERE url = ?", (url,))
+                return None
+            db.execute("UPDATE entries SET last_used = ? WHERE url = ?", (time.time(), url))
+        return CachedResponse(body, etag, last_modified)
+
+    def put(self, url, body, etag=None, last_modified=None):
+        data = body.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        compressed = zlib.compress(data)
+        path = self._path(digest)
+        with self._lock, self._connect() as db:
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path + '.tmp', 'wb') as f:
+                    f.write(compressed)
+                os.replace(path + '.tmp', path)
+            old = db.execute("SELECT digest FROM entries WHERE url = ?", (url,)).fetchone()
+            db.execute(
+                "INSERT OR REPLACE INTO entries (url, digest, etag, last_modified, size, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (url, digest, etag, last_modified, len(compressed), time.time()),
+            )
+            if old and old[0] != digest:
+                self._remove_unused(db, old[0])
+            self._evict(db)
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _size(self, db):
+        return db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM (SELECT MAX(size) AS size FROM entries GROUP BY digest)"
+        ).fetchone()[0]
+
+    def _evict(self, db):
+        size = self._size(db)
+        while size > self.max_bytes:
+            url, digest, entry_size = db.execute(
+                "SELECT url, digest, size FROM entries ORDER BY last_used LIMIT 1"
+            ).fetchone()
+            db.execute("DELETE FROM entries WHERE url = ?", (url,))
+            if self._remove_unused(db, digest):  # other urls may still share the body
+                size -= entry_size
+
+    def _remove_unused(self, db, digest):
+        """ :return: whether the body was removed, as no entry uses it """
+        if db.execute("SELECT 1 FROM entries WHERE digest = ?", (digest,)).fetchone() is not None:
+            return False
+        try:
+            os.remove(self._path(digest))
+        except OSError:
+            pass
+        return True
+
+    def clear(self):
+        with self._lock, self._connect() as db:
+            for (digest,) in db.execute("SELECT DISTINCT digest FROM entries").fetchall():
+                try:
+                    os.remove(self._path(digest))
+                except OSError:
+                    pass
+            db.execute("DELETE FROM entries")
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock, self._connect() as db:
+            entries = db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            size = self._size(db)
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'entries': entries,
+            'bytes': size,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """ :return: the ResponseCache configured by SCRAPE_CACHE_DIR and SCRAPE_CACHE_MAX_BYTES, or None if disabled """
+    global _cache
+    directory = settings.SCRAPE_CACHE_DIR
+    if not directory:
+        return None
+    with _cache_lock:
+        if _cache is None or _cache.directory != directory:
+            _cache = ResponseCache(directory, settings.SCRAPE_CACHE_MAX_BYTES)
+        return _cache
@@ -0,0 +1,198 @@
+import asyncio
+import threading
+import time
+import weakref
+from urllib.parse import urlparse
+
+import requests
+from asgiref.sync import sync_to_async
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from scrape.cache import get_cache
+
+try:
+    import httpx
+except ImportError:  # optional, see fetch_async
+    httpx = None
+
+TIMEOUT = (5, 30)  # (connect, read) seconds
+RETRIES = Retry(
+    total=3,
+    backoff_factor=0.5,
+    status_forcelist=(429, 500, 502, 503, 504),
+    allowed_methods=('GET', 'HEAD'),
+)
+POOL_SIZE = 16
+CHUNK_SIZE = 16 * 1024
+HEADERS = {'User-Agent': 'kokebok-scraper (+https://github.com/jonaengs/kokebok)'}
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(url):
+    """
+    :return: the shared keep-alive session for the url's host. Sessions retry failed requests with backoff.
+    """
+    host = urlparse(url).netloc
+    with _sessions_lock:
+        if host not in _sessions:
+            session = requests.Session()
+            session.headers.update(HEADERS)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=RETRIES)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[host] = session
+        return _sessions[host]
+
+
+def close_sessions():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def _set_encoding(response):
+    # requests falls back to ISO-8859-1 for text/* without a charset. The sites we scrape are utf-8
+    if 'charset' not in response.headers.get('content-type', '').lower():
+        response.encoding = 'utf-8'
+
+
+def fetch(url, offline=False):
+    """
+    :raise requests.RequestException: on connection errors and non-2xx responses, after retrying
+    :return: the decoded body of the page
+    """
+    return ''.join(fetch_stream(url, offline=offline))
+
+
+def fetch_stream(url, chunk_size=CHUNK_SIZE, offline=False):
+    """
+    Like fetch, but yields the decoded body chunk by chunk as it is downloaded.
+    Goes through the response cache (scrape.cache) when it is enabled: cached pages are revalidated with their ETag or
+    Last-Modified and only downloaded again if they changed.
+    Closing the generator early, e.g. once the JSON-LD fast path found the recipe, closes the connection without
+    reading the rest of the page. Only whole pages are cached, so such a page is downloaded again next time.
+    :param offline: only serve pages from the cache. Raises OfflineCacheMiss for pages not in it
+    """
+    cache = get_cache()
+    cached = cache.get(url) if cache else None
+    if offline:
+        if cached is None:
+            raise OfflineCacheMiss(url)
+        cache.record(hit=True)
+        yield from _chunked(cached.body, chunk_size)
+        return
+
+    headers = _validator_headers(cached)
+    with get_session(url).get(url, headers=headers, timeout=TIMEOUT, stream=True) as response:
+        if response.status_code == 304 and cached is not None:
+            cache.record(hit=True)
+            yield from _chunked(cached.body, chunk_size)
+            return
+        response.raise_for_status()
+        _set_encoding(response)
+        chunks = response.iter_content(chunk_size, decode_unicode=True)
+        if cache is None:
+            yield from chunks
+            return
+        cache.record(hit=False)
+        validators = response.headers.get('ETag'), response.headers.get('Last-Modified')
+        body = []
+        for chunk in chunks:
+            body.append(chunk)
+            yield chunk
+        cache.put(url, ''.join(body), *validators)
+
+
+def _validator_headers(cached):
+    """ :return: headers revalidating the cached page, if any """
+    headers = {}
+    if cached is not None:
+        if cached.etag:
+            headers['If-None-Match'] = cached.etag
+        if cached.last_modified:
+            headers['If-Modified-Since'] = cached.last_modified
+    return headers
+
+
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """
+    :return: the keep-alive httpx client of the running event loop. Clients can't be shared between loops.
+        Like the sessions, they retry failed connections. Responses to retry are handled by fetch_async
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _async_clients:
+        _async_clients[loop] = httpx.AsyncClient(
+            headers=HEADERS,
+            timeout=httpx.Timeout(TIMEOUT[1], connect=TIMEOUT[0]),
+            limits=httpx.Limits(max_keepalive_connections=POOL_SIZE),
+            transport=httpx.AsyncHTTPTransport(retries=RETRIES.total),
+            follow_redirects=True,
+            default_encoding='utf-8',  # see _set_encoding
+        )
+    return _async_clients[loop]
+
+
+async def fetch_async(url, offline=False):
+    """
+    fetch() for async code. Downloads with httpx, so waiting for the site ties up no thread, and goes through the
+    response cache like fetch_stream. Without httpx installed fetch() is run in a thread instead.
+    :raise requests.RequestException or httpx.HTTPError: on connection errors and non-2xx responses, after retrying
+    :return: the decoded body of the page
+    """
+    if httpx is None or offline:
+        return await sync_to_async(fetch, thread_sensitive=False)(url, offline=offline)
+    cache = get_cache()
+    cached = await sync_to_async(cache.get, thread_sensitive=False)(url) if cache else None
+    client = get_async_client()
+    for attempt in range(RETRIES.total + 1):
+        response = await client.get(url, headers=_validator_headers(cached))
+        if response.status_code not in RETRIES.status_forcelist or attempt == RETRIES.total:
+            break
+        await asyncio.sleep(RETRIES.backoff_factor * 2 ** attempt)
+    if response.status_code == 304 and cached is not None:
+        cache.record(hit=True)
+        return cached.body
+    response.raise_for_status()
+    if cache is not None:
+        cache.record(hit=False)
+        await sync_to_async(cache.put, thread_sensitive=False)(
+            url, response.text, response.headers.get('ETag'), response.headers.get('Last-Modified'),
+        )
+    return response.text
+
+
+def _chunked(text, chunk_size):
+    return (text[i:i + chunk_size] for i in range(0, len(text), chunk_size))
+
+
+class OfflineCacheMiss(Exception):
+    pass
+
+
+class RateLimiter:
+    """
+    Spaces out calls to wait() with the same key (domain) to at most per_second per second.
+    Thread safe. Callers sleep outside the lock so different domains don't block each other.
+    """
+
+    def __init__(self, per_second=None):
+        self.interval = 1 / per_second if per_second else 0
+        self._lock = threading.Lock()
+        self._next_slot = {}
+
+    def wait(self, key):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(key, now))
+            self._next_slot[key] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
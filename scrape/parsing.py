@@ -0,0 +1,80 @@
+import json
+from html.parser import HTMLParser
+
+from bs4 import BeautifulSoup
+
+try:
+    import lxml  # noqa: F401
+    SOUP_PARSER = 'lxml'
+except ImportError:
+    SOUP_PARSER = 'html.parser'
+
+
+def make_soup(html):
+    """ BeautifulSoup tree built with the fastest parser installed """
+    return BeautifulSoup(html, SOUP_PARSER)
+
+
+def find_recipe(data):
+    """
+    :param data: decoded JSON-LD. May be a single node, a list of nodes or a graph
+    :return: the first node of type schema.org Recipe, or None
+    """
+    if isinstance(data, list):
+        return next((recipe for recipe in map(find_recipe, data) if recipe is not None), None)
+    if not isinstance(data, dict):
+        return None
+    types = data.get('@type')
+    if types == 'Recipe' or isinstance(types, list) and 'Recipe' in types:
+        return data
+    return find_recipe(data.get('@graph'))
+
+
+class JsonLdExtractor(HTMLParser):
+    """
+    Incremental parser that only looks at <script type="application/ld+json"> blocks, without building a tree.
+    Feed it the page chunk by chunk; recipe is set as soon as a block containing a Recipe has been read.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.recipe = None
+        self._in_json_ld = False
+        self._data = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'script' and (dict(attrs).get('type') or '').lower() == 'application/ld+json':
+            self._in_json_ld = True
+            self._data = []
+
+    def handle_data(self, data):
+        if self._in_json_ld:
+            self._data.append(data)
+
+    def handle_endtag(self, tag):
+        if tag != 'script' or not self._in_json_ld:
+            return
+        self._in_json_ld = False
+        try:
+            data = json.loads(''.join(self._data))
+        except ValueError:  # broken blocks are common enough. Keep looking
+            return
+        if self.recipe is None:
+            self.recipe = find_recipe(data)
+
+
+def extract_json_ld_recipe(chunks):
+    """
+    :param chunks: iterable of decoded page chunks
+    :return: (recipe, chunks read so far). Stops reading as soon as a recipe is found. recipe is None if not found,
+        in which case all chunks have been read
+    """
+    extractor = JsonLdExtractor()
+    read = []
+    for chunk in chunks:
+        read.append(chunk)
+        extractor.feed(chunk)
+        if extractor.recipe is not None:
+            return extractor.recipe, read
+    extractor.close()
+    return extractor.recipe, read
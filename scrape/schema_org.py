@@ -0,0 +1,98 @@
+"""
+Site independent scraping of schema.org Recipe data (https://schema.org/Recipe), from JSON-LD or microdata.
+"""
+import re
+
+from django.utils.html import escape
+
+from scrape.utils import parse_servings, parse_ingredient_line
+
+RECIPE_ITEMTYPE = re.compile(r'schema\.org/recipe', re.IGNORECASE)
+
+
+def _text(value):
+    if isinstance(value, list):
+        value = value[0] if value else ''
+    if isinstance(value, dict):
+        value = value.get('text') or value.get('name') or ''
+    return str(value or '').strip()
+
+
+def _instructions_html(instructions):
+    """ :param instructions: text, or a list of texts, HowToSteps and HowToSections """
+    if isinstance(instructions, str):
+        return ''.join(f"<p>{escape(line.strip())}</p>" for line in instructions.splitlines() if line.strip())
+    html = ''
+    steps = []
+    for item in instructions or []:
+        if isinstance(item, dict) and 'itemListElement' in item:  # HowToSection
+            html += _steps_html(steps)
+            steps = []
+            html += f"<h3>{escape(_text(item.get('name')))}</h3>" + _instructions_html(item['itemListElement'])
+        elif _text(item):
+            steps.append(_text(item))
+    return html + _steps_html(steps)
+
+
+def _steps_html(steps):
+    return f"<ol>{''.join(f'<li>{escape(step)}</li>' for step in steps)}</ol>" if steps else ''
+
+
+def _recipe_dict(name, description, recipe_yield, ingredient_lines, instructions_html):
+    content = f"<p>{escape(description)}</p>" if description else ''
+    return {
+        'name': name,
+        'content': content + instructions_html,
+        'serves': parse_servings(recipe_yield),
+        'ami': [parse_ingredient_line(line.lower()) for line in ingredient_lines if line.strip()],
+    }
+
+
+def scrape_json_ld(recipe):
+    """
+    :param recipe: a decoded JSON-LD Recipe node. See scrape.parsing.find_recipe
+    :raise ValueError: if the recipe has no ingredients
+    :return: see scrape.scrape.scrape
+    """
+    ingredient_lines = recipe.get('recipeIngredient') or recipe.get('ingredients') or []
+    if isinstance(ingredient_lines, str):
+        ingredient_lines = [ingredient_lines]
+    if not ingredient_lines:
+        raise ValueError("JSON-LD recipe has no ingredients")
+    return _recipe_dict(
+        _text(recipe.get('name')),
+        _text(recipe.get('description')),
+        recipe.get('recipeYield'),
+        [_text(line) for line in ingredient_lines],
+        _instructions_html(recipe.get('recipeInstructions')),
+    )
+
+
+def scrape_microdata(soup):
+    """
+    Site independent scrape function reading schema.org microdata (itemscope/itemprop attributes).
+    :param soup: the page, as is. See scrape.scrape.parse
+    :return: see scrape.scrape.scrape. None if the page has no microdata recipe with ingredients
+    """
+    root = soup.find(itemtype=RECIPE_ITEMTYPE)
+    if root is None:
+        return None
+
+    def props(name):
+        return root.find_all(itemprop=lambda value: value is not None and name in value.lower().split())
+
+    def value(element):
+        return (element.get('content') or element.get_text(' ', strip=True)).strip()
+
+    ingredients = [value(element) for element in props('recipeingredient') or props('ingredients')]
+    if not ingredients:
+        return None
+    names, descriptions, yields = props('name'), props('description'), props('recipeyield')
+    instructions = ''.join(str(element) for element in props('recipeinstructions'))
+    return _recipe_dict(
+        value(names[0]) if names else '',
+        value(descriptions[0]) if descriptions else '',
+        value(yields[0]) if yields else None,
+        ingredients,
+        instructions,
+    )
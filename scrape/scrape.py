@@ -1,10 +1,14 @@
+import json
+from contextlib import closing
+from itertools import chain
 from urllib.parse import urlparse
 
-from bs4 import BeautifulSoup
-import requests
-import json
+from asgiref.sync import sync_to_async
 
-from scrape.utils import unicode_fraction_to_float, conversions, is_number
+from scrape.http import fetch_stream, fetch_async
+from scrape.parsing import make_soup, extract_json_ld_recipe
+from scrape.schema_org import RECIPE_ITEMTYPE, scrape_json_ld, scrape_microdata
+from scrape.utils import unicode_fraction_to_float, parse_ingredient_line
 
 
 def get_sites():
@@ -15,18 +19,35 @@ def get_sites():
     }
 
 
-def get_scrape_func(url):
-    sites = get_sites()
+def get_site(url):
     netloc = urlparse(url).netloc.split(".")  # https://wwww.google.com/?q=aisdhaA_Sd => ['www', 'google', 'com']
-    site = netloc[1] if netloc[0].lower() == 'www' else netloc[0]  # some urls start 'www.', some dont
-    if site not in sites.keys():
-        raise ValueError("Domain of passed url not found in scrape table")
-    return sites[site]
+    return netloc[1] if netloc[0].lower() == 'www' else netloc[0]  # some urls start 'www.', some dont
+
+
+def get_scrape_func(url):
+    """
+    :return: scrape function for pages at the url without schema.org recipe data, see parse. The site specific one in
+        get_sites() if there is one
+    """
+    site_scrape_func = get_sites().get(get_site(url))
+    if site_scrape_func is not None:
+        return site_scrape_func
+
+    def no_scrape_func(soup):
+        raise ValueError("No schema.org recipe on page, and no scrape function for the site")
+    return no_scrape_func
+
+
+def get_parsers(url):
+    """
+    :return: (scrape function, JSON-LD scrape function) for the url. The JSON-LD one is tried first, see parse_stream
+    """
+    return get_scrape_func(url), scrape_json_ld
 
 
 def scrape(url):
     """
-    :param url: site to be scraped. Must be present in the sites map in scrape_linker()
+    :param url: page to be scraped. Any site with schema.org recipe data, or one of the sites in get_sites()
     :return: Dictionary containing data for creation of a recipe and corresponding ingredients and recipe_ingredients.
         All keys and values are strings.
         'name': name string
@@ -35,15 +56,55 @@ def scrape(url):
         'ami': list of tuples (amount, measurement, ingredient) for the creation of recipe ingredients
         'origin': the given url
     """
-    page = requests.get(url)
-    soup = BeautifulSoup(page.text.lower(), 'html.parser')
-    scrape_dict = get_scrape_func(url)(soup) | {'origin_url': url}
-    return scrape_dict
+    with closing(fetch_stream(url)) as chunks:  # closed right away if parse_stream stops reading early
+        return parse_stream(url, chunks, *get_parsers(url))
+
+
+async def scrape_async(url):
+    """
+    scrape() for async code: the page is downloaded with scrape.http.fetch_async, then parsed in a thread
+    :return: see scrape()
+    """
+    html = await fetch_async(url)
+    return await sync_to_async(parse_stream, thread_sensitive=False)(url, (html,), *get_parsers(url))
+
+
+def parse_stream(url, chunks, scrape_func, json_ld_func=None):
+    """
+    Parses the page as it is downloaded. If there is a json_ld_func and the page has a JSON-LD recipe, only the page
+    up to the recipe is read, and no DOM is built. Otherwise the whole page is parsed with scrape_func.
+    :param chunks: iterable of decoded chunks of the page found at url. See scrape.http.fetch_stream
+    :return: see scrape()
+    """
+    if json_ld_func is not None:
+        chunks = iter(chunks)
+        recipe, read = extract_json_ld_recipe(chunks)
+        if recipe is not None:
+            try:
+                return json_ld_func(recipe) | {'origin_url': url}
+            except (ValueError, KeyError, TypeError):  # incomplete or unusual JSON-LD. Parse the whole page instead
+                pass
+        chunks = chain(read, chunks)
+    return parse(url, ''.join(chunks), scrape_func)
+
+
+def parse(url, html, scrape_func=None):
+    """
+    Reads the page's schema.org microdata recipe, falling back to scrape_func if it has none.
+    :param html: the page found at url
+    :param scrape_func: fallback parser, given the lowercased page. Looked up from the url by default
+    :return: see scrape()
+    """
+    scrape_dict = scrape_microdata(make_soup(html)) if RECIPE_ITEMTYPE.search(html) else None
+    if scrape_dict is None:
+        scrape_func = scrape_func or get_scrape_func(url)
+        scrape_dict = scrape_func(make_soup(html.lower()))
+    return scrape_dict | {'origin_url': url}
 
 
 def scrape_matprat(soup):
     title = soup.find('h1', {'class': 'article-title lp_is_start'}).text
-    serves = soup.find('input', {'id': 'portionsInput'}).get('value')
+    serves = soup.find('input', {'id': 'portionsinput'}).get('value')  # the page is lowercased before parsing
     instructions = str(soup.find('div', {'class': 'rich-text'}))
 
     ingredient_lists = soup.find_all('li', {"itemprop": "ingredients"})
@@ -66,14 +127,14 @@ def scrape_matprat(soup):
 def scrape_meny(soup):  # Does not find ingredient amounts or measurements :(
     # Meny laster inn / renderer oppskriftdata etter siden har lastet. Noe data sendes som json
     page_json_content = soup.find('script', {'type': 'application/ld+json'})
-    json_data = json.loads(page_json_content.text)
+    json_data = json.loads(page_json_content.text)  # the page is lowercased before parsing, keys included
 
     title = soup.find('h1', {'class': 'c-h1'}).text
-    serves = json_data['recipeYield'][-1]  # incorrect if n >= 10
-    ingredients = [ingredient.strip() for ingredient in json_data["recipeIngredient"]]
+    serves = json_data['recipeyield'][-1]  # incorrect if n >= 10
+    ingredients = [ingredient.strip() for ingredient in json_data["recipeingredient"]]
 
     instructions = str(soup.find('div', {'class': 'c-recipe__intro'})) + "\n\n"
-    instructions += "\n".join(map(lambda elem: elem['text'], json_data['recipeInstructions']))
+    instructions += "\n".join(map(lambda elem: elem['text'], json_data['recipeinstructions']))
     return {
         'name': title,
         'content': instructions,
@@ -83,23 +144,6 @@ def scrape_meny(soup):  # Does not find ingredient amounts or measurements :(
 
 
 def scrape_nrk(soup):
-    def ingredients_list_to_ami(ingredients):
-        # example ingredient strings: "200 g spagetti", "4 cherrytomater", "nykvernet pepper", "2 ss smør til steking"
-        ami = []
-        for ingredient in ingredients:
-            parts = ingredient.split(" ")
-            amount, measure, ingredient = None, None, None
-            if is_number(parts[0]):  # Amount specified
-                amount = parts.pop(0)
-                if len(parts) >= 2:  # measurement given requires length of 3+
-                    if parts[0] in conversions.keys():  # measurement is known
-                        measure = parts.pop(0)
-                if measure is None:  # Didn't find measure, assume count
-                    measure = 'stk'
-            ingredient = " ".join(parts)
-            ami.append((amount, measure, ingredient))
-        return ami
-
     def build_instructions():
         instructions_div = soup.find('div', {'class': 'article-content'})
         instructions = soup.find('div', {'itemprop': 'description'}).text  # introduction
@@ -122,7 +166,7 @@ def scrape_nrk(soup):
     ami = []
     for ul in ingredient_uls:  # a recipe may contain multiple ingredient lists
         ul_ingredients = [li.text.strip() for li in ul.find_all('li')]
-        ami += ingredients_list_to_ami(ul_ingredients)
+        ami += [parse_ingredient_line(ingredient) for ingredient in ul_ingredients]
 
     return {
         'name': title,
@@ -0,0 +1,426 @@
+import json
+import os
+import tempfile
+import zlib
+import threading
+import time
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from io import StringIO
+from unittest import mock
+from urllib.parse import urlencode
+
+from asgiref.sync import sync_to_async
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, AsyncRequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from recipes import jobs, async_views
+from recipes.models import Recipe, Ingredient, ScrapeJob
+from recipes.matching import ingredient_matcher
+from recipes.search import ingredient_index
+from recipes.testing import FreshIndexesMixin
+from scrape.bulk import scrape_many, ScrapeStats
+from scrape.cache import ResponseCache, get_cache
+from scrape.http import RateLimiter, close_sessions, fetch, fetch_stream, fetch_async, OfflineCacheMiss
+from scrape.parsing import extract_json_ld_recipe
+from scrape.schema_org import scrape_json_ld
+from scrape.scrape import scrape_meny, parse, parse_stream, scrape_matprat, scrape_nrk, get_scrape_func
+from scrape.utils import create_recipe_from_scrape
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+class FixtureRequestHandler(SimpleHTTPRequestHandler):
+    """ Serves the files in FIXTURES_DIR. Paths starting with /flaky/ answer 503 to the first request. """
+    failed_once = set()
+
+    def do_GET(self):
+        if self.path.startswith('/flaky/') and self.path not in self.failed_once:
+            self.failed_once.add(self.path)
+            self.send_error(503)
+            return
+        self.path = self.path.replace('/flaky/', '/', 1)
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FixtureServerMixin:
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        handler = partial(FixtureRequestHandler, directory=FIXTURES_DIR)
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_port}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        close_sessions()
+        super().tearDownClass()
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), encoding='utf-8') as f:
+        return f.read()
+
+
+def chunked(text, size=100):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class ParseTest(SimpleTestCase):
+
+    def test_matprat(self):
+        data = parse('https://www.matprat.no/x', read_fixture('matprat.html'), scrape_matprat)
+        self.assertEqual(data['name'], 'kyllinggryte med ris')
+        self.assertEqual(data['serves'], '4')
+        self.assertEqual(data['ami'][2], (2.5, 'dl', 'matfløte'))
+
+    def test_nrk(self):
+        data = parse('https://www.nrk.no/x', read_fixture('nrk.html'), scrape_nrk)
+        self.assertEqual(data['serves'], '4')
+        self.assertEqual(data['ami'][0], (400, 'g', 'spagetti'))
+        self.assertEqual(data['ami'][-1], (None, None, 'nykvernet pepper'))
+        self.assertIn('TIPS', data['content'])
+
+    def test_json_ld_stream(self):
+        chunks = iter(chunked(read_fixture('meny.html')))
+        data = parse_stream('https://meny.no/x', chunks, scrape_meny, scrape_json_ld)
+        self.assertEqual(data['name'], 'Pannekaker')
+        self.assertEqual(data['serves'], 4)
+        self.assertEqual(data['ami'][:2], [(3, 'stk', 'egg'), (5, 'dl', 'melk')])
+        self.assertEqual(data['ami'][-1], (None, None, 'smør til steking'))
+        self.assertIn('<li>Stek tynne pannekaker i smør på middels varme.</li>', data['content'])
+        self.assertTrue(next(chunks, None))  # the body was never read
+
+    def test_json_ld_fallback(self):
+        html = read_fixture('meny.html').replace('"Recipe"', '"WebPage"')
+        data = parse_stream('https://meny.no/x', chunked(html), scrape_meny, scrape_json_ld)
+        self.assertEqual(data['name'], 'pannekaker')  # through the lowercased soup
+
+    def test_microdata(self):
+        html = """<div itemscope itemtype="https://schema.org/Recipe">
+            <h1 itemprop="name">Vafler</h1><meta itemprop="recipeYield" content="6 stykker">
+            <ul><li itemprop="recipeIngredient">2,5 dl Hvetemel</li><li itemprop="recipeIngredient">2 egg</li></ul>
+            <div itemprop="recipeInstructions"><p>Rør og stek.</p></div></div>"""
+        data = parse('https://unknown.example.com/vafler', html, get_scrape_func('https://unknown.example.com'))
+        self.assertEqual(data['name'], 'Vafler')
+        self.assertEqual(data['serves'], 6)
+        self.assertEqual(data['ami'], [(2.5, 'dl', 'hvetemel'), (2, 'stk', 'egg')])
+
+    def test_site_fallback(self):
+        # the nrk page has a microdata recipe, but without ingredients
+        data = parse('https://www.nrk.no/x', read_fixture('nrk.html'), get_scrape_func('https://www.nrk.no/x'))
+        self.assertEqual(data['name'], 'spagetti med tomatsaus')
+        with self.assertRaises(ValueError):
+            parse('https://unknown.example.com/x', read_fixture('nrk.html'))
+
+    def test_microdata_first(self):
+        html = """<div itemscope itemtype="https://schema.org/Recipe"><h1 itemprop="name">Vafler</h1>
+            <ul><li itemprop="recipeIngredient">2 egg</li></ul></div>"""  # not laid out like an nrk page
+        data = parse('https://www.nrk.no/vafler', html, get_scrape_func('https://www.nrk.no/vafler'))
+        self.assertEqual(data['name'], 'Vafler')
+
+    def test_json_ld_graph(self):
+        html = '<script type="application/ld+json">{"@graph": [{"@type": "WebPage"}, ' \
+               '{"@type": ["Recipe"], "name": "æbleskiver"}]}</script>'
+        recipe, _ = extract_json_ld_recipe(chunked(html, 7))
+        self.assertEqual(recipe['name'], 'æbleskiver')
+
+
+@override_settings(SCRAPE_CACHE_DIR=None)
+class BulkScrapeTest(FixtureServerMixin, SimpleTestCase):
+
+    def test_scrape_many(self):
+        urls = [f'{self.base_url}/meny.html', f'{self.base_url}/flaky/meny.html', f'{self.base_url}/missing.html']
+        stats = ScrapeStats()
+        results = {
+            r.url: r for r in scrape_many(urls, workers=2, resolve_parsers=lambda url: (scrape_meny, None), stats=stats)
+        }
+
+        self.assertEqual(results[urls[0]].data['name'], 'pannekaker')
+        self.assertEqual(results[urls[0]].data['origin_url'], urls[0])
+        self.assertTrue(results[urls[1]].ok)  # retried after the 503
+        self.assertFalse(results[urls[2]].ok)
+        self.assertEqual((stats.succeeded, stats.failed), (2, 1))
+
+    def test_any_site(self):
+        [result] = scrape_many([f'{self.base_url}/meny.html'])  # through the schema.org JSON-LD
+        self.assertEqual(result.data['name'], 'Pannekaker')
+        [result] = scrape_many([f'{self.base_url}/matprat.html'])  # no schema.org data, and an unknown site
+        self.assertIsInstance(result.error, ValueError)
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter(per_second=20)
+        start = time.monotonic()
+        for _ in range(3):
+            limiter.wait('example.com')
+        limiter.wait('example.org')  # other domains are not held back
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+        self.assertLess(time.monotonic() - start, 0.5)
+
+
+class ResponseCacheTest(FixtureServerMixin, SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = self.settings(SCRAPE_CACHE_DIR=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_revalidation(self):
+        url = f'{self.base_url}/nrk.html'
+        page = fetch(url)
+        self.assertEqual(fetch(url), page)  # 304 Not Modified, served from the cache
+        self.assertEqual(get_cache().stats()['hits'], 1)
+        self.assertEqual(get_cache().stats()['misses'], 1)
+        self.assertEqual(fetch(url, offline=True), page)
+        with self.assertRaises(OfflineCacheMiss):
+            fetch(f'{self.base_url}/matprat.html', offline=True)
+
+    def test_only_whole_pages_are_cached(self):
+        url = f'{self.base_url}/meny.html'
+        chunks = fetch_stream(url, chunk_size=100)
+        next(chunks)
+        chunks.close()  # the rest of the page is never downloaded
+        with self.assertRaises(OfflineCacheMiss):
+            fetch(url, offline=True)
+        fetch(url)
+        self.assertEqual(fetch(url, offline=True), read_fixture('meny.html'))
+
+    def test_lru_eviction(self):
+        size = len(zlib.compress(b'a' * 1000))
+        cache = ResponseCache(get_cache().directory, max_bytes=3 * size)  # room for three pages
+        cache.put('a', 'a' * 1000)
+        cache.put('b', 'b' * 1000)
+        cache.put('c', 'a' * 1000)  # same content as a, stored once
+        cache.put('d', 'd' * 1000)
+        self.assertEqual(cache.stats()['bytes'], 3 * size)
+        cache.get('a')
+        cache.put('e', 'e' * 1000)  # b is the least recently used
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c').body, 'a' * 1000)
+        self.assertEqual(cache.stats()['entries'], 4)
+
+
+@override_settings(SCRAPE_CACHE_DIR=None)
+class ScrapeBulkCommandTest(FixtureServerMixin, FreshIndexesMixin, TestCase):
+
+    def test_command(self):
+        out = StringIO()
+        call_command('scrape_bulk', f'{self.base_url}/meny.html', '--rate', '0', stdout=out)
+        recipe = Recipe.objects.get()
+        self.assertEqual(recipe.name, 'Pannekaker')  # read from JSON-LD, which is not lowercased
+        self.assertEqual(recipe.recipe_ingredients.count(), 5)
+        self.assertIn('1/1 pages scraped', out.getvalue())
+
+    def test_failed_save_does_not_stop_the_batch(self):
+        saved = []
+
+        def create_recipe(data):
+            saved.append(create_recipe_from_scrape(data))
+            if len(saved) == 1:
+                raise ValueError("bad recipe")  # after the recipe was written, which is rolled back
+        out, err = StringIO(), StringIO()
+        urls = [f'{self.base_url}/meny.html', f'{self.base_url}/flaky/meny.html']
+        with mock.patch('recipes.management.commands.scrape_bulk.create_recipe_from_scrape', create_recipe):
+            call_command('scrape_bulk', *urls, '--rate', '0', '--workers', '1', stdout=out, stderr=err)
+        self.assertEqual(list(Recipe.objects.all()), saved[1:])
+        self.assertIn('FAILED to save', err.getvalue())
+        self.assertIn('1/2 pages scraped', out.getvalue())
+
+
+class CreateRecipeFromScrapeTest(FreshIndexesMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        Ingredient.objects.create(name='egg')
+        Ingredient.objects.create(name='milk')
+        Ingredient.objects.create(name='rød løk')
+
+    def test_constant_query_count(self):
+        ami = [(1, 'dl', 'milk'), (2, 'stk', 'egg'), (None, None, 'fresh egg'), (None, None, 'something unknown')]
+        ami += [(i, 'g', f'ingredient{i}') for i in range(16)]
+        ingredient_matcher.match('')  # built once per process, not per import
+        with CaptureQueriesContext(connection) as queries:
+            recipe = create_recipe_from_scrape({'name': 'recipe', 'content': '', 'serves': 2, 'ami': ami})
+        # two of them lock the tree ids of the created ingredients, one looks up the unmatched names
+        self.assertLessEqual(len(queries), 10)
+
+        recipe_ingredients = {ri.name: ri for ri in recipe.recipe_ingredients.select_related('base_ingredient')}
+        self.assertEqual(len(recipe_ingredients), 20)
+        self.assertEqual(recipe_ingredients['fresh egg'].base_ingredient.name, 'egg')
+        self.assertIsNone(recipe_ingredients['something unknown'].base_ingredient)
+        self.assertEqual(recipe_ingredients['ingredient3'].base_ingredient.name, 'ingredient3')  # created
+        self.assertEqual(recipe_ingredients['milk'].measurement, 'dl')
+        Ingredient.objects.create(name='another root')  # tree ids of the bulk created roots must not collide
+        another_root = Ingredient.objects.get(name='another root')
+        self.assertEqual(Ingredient.objects.filter(tree_id=another_root.tree_id).count(), 1)
+
+    def test_matching(self):
+        ami = [(None, None, 'finhakket Rød løk'), (None, None, 'løk'), (None, None, 'skiver Rod-lok, til pynt')]
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = create_recipe_from_scrape({'name': 'recipe', 'content': '', 'ami': ami})
+        recipe_ingredients = {ri.name: ri.base_ingredient for ri in recipe.recipe_ingredients.all()}
+        self.assertEqual(recipe_ingredients['finhakket Rød løk'].name, 'rød løk')  # longest match wins
+        self.assertEqual(recipe_ingredients['skiver Rod-lok, til pynt'].name, 'rød løk')
+        self.assertEqual(recipe_ingredients['løk'].name, 'løk')  # created
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.filter(name='rød løk').get().delete()
+        self.assertEqual(ingredient_matcher.match('finhakket rød løk'), Ingredient.objects.get(name='løk').id)
+
+    def test_matcher_behind_the_database(self):
+        ingredient_matcher.match('')  # build it
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                create_recipe_from_scrape({'name': 'recipe', 'content': '', 'ami': [(None, None, 'tomat')]})
+                transaction.set_rollback(True)
+        self.assertIsNone(ingredient_matcher.match('tomat'))  # the created ingredient was rolled back
+
+        # created without this process' matcher knowing
+        Ingredient.objects.bulk_create([Ingredient(name='kanel', tree_id=100, lft=1, rght=2, level=0)])
+        ami = [(None, None, 'tomat'), (None, None, 'kanel')]
+        recipe = create_recipe_from_scrape({'name': 'recipe', 'content': '', 'ami': ami})
+        recipe_ingredients = {ri.name: ri.base_ingredient.name for ri in recipe.recipe_ingredients.all()}
+        self.assertEqual(recipe_ingredients, {'tomat': 'tomat', 'kanel': 'kanel'})
+
+    def test_updates_search_index(self):
+        ingredient_index.ingredient_ids(['egg'])  # build the index
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = create_recipe_from_scrape({'name': 'recipe', 'content': '', 'ami': [(None, None, 'egg')]})
+        egg = Ingredient.objects.get(name='egg')
+        self.assertEqual(ingredient_index.ingredient_ids(['egg']), {egg.id})
+        response = self.client.get(reverse('search'), {'ingredients': 'egg', 'exclusive': 'inclusive'})
+        self.assertEqual(list(response.context['recipes']), [recipe])
+
+
+@override_settings(SCRAPE_CACHE_DIR=None)
+class RefreshRecipesCommandTest(FixtureServerMixin, FreshIndexesMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.checkpoint = os.path.join(directory.name, 'checkpoint')
+
+    def refresh(self, *args):
+        out = StringIO()
+        call_command('refresh_recipes', '--rate', '0', '--checkpoint', self.checkpoint, *args, stdout=out, stderr=out)
+        return out.getvalue()
+
+    def test_refresh(self):
+        stale = Recipe.objects.create(name='stale', origin_url=f'{self.base_url}/meny.html', scrape_hash='stale')
+        missing = Recipe.objects.create(name='missing', origin_url=f'{self.base_url}/missing.html')
+        Recipe.objects.create(name='not scraped')
+
+        self.assertIn('1 updated, 0 unchanged, 1 failed', self.refresh())
+        stale.refresh_from_db()
+        self.assertEqual(stale.name, 'Pannekaker')
+        self.assertEqual(stale.recipe_ingredients.count(), 5)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+        self.assertIn('0 updated, 1 unchanged, 1 failed', self.refresh())
+        self.assertEqual(Recipe.objects.get(id=stale.id).datetime_updated, stale.datetime_updated)
+        self.assertEqual(stale.recipe_ingredients.count(), 5)
+        self.assertEqual(missing.name, Recipe.objects.get(id=missing.id).name)
+
+    def test_legacy_recipes_are_only_hashed(self):
+        legacy = Recipe.objects.create(name='edited', origin_url=f'{self.base_url}/meny.html')
+        self.assertIn('0 updated, 1 unchanged', self.refresh())
+        legacy.refresh_from_db()
+        self.assertEqual(legacy.name, 'edited')
+        self.assertTrue(legacy.scrape_hash)
+        self.assertIn('0 updated, 1 unchanged', self.refresh())
+
+        Recipe.objects.filter(id=legacy.id).update(scrape_hash='')
+        self.assertIn('1 updated', self.refresh('--force'))
+        self.assertEqual(Recipe.objects.get(id=legacy.id).name, 'Pannekaker')
+
+    def test_resume(self):
+        first, second = sorted(
+            (Recipe.objects.create(name=str(i), origin_url=f'{self.base_url}/meny.html', scrape_hash='stale')
+             for i in range(2)),
+            key=lambda recipe: recipe.id,
+        )
+        with open(self.checkpoint, 'w') as f:
+            json.dump({'last_id': str(first.id), 'updated': 0, 'unchanged': 0, 'failed': 0}, f)
+        self.assertIn('1 updated', self.refresh('--chunk-size', '1'))
+        self.assertEqual(Recipe.objects.get(id=first.id).name, first.name)  # done before the interruption
+        self.assertEqual(Recipe.objects.get(id=second.id).name, 'Pannekaker')
+
+
+@override_settings(SCRAPE_CACHE_DIR=None, SCRAPE_JOB_WORKERS=0)  # jobs run when the submitting transaction commits
+class ScrapeJobTest(FixtureServerMixin, FreshIndexesMixin, TestCase):
+
+    def submit(self, url):
+        return self.client.post(reverse('scrape'), {'scrape_url': url})
+
+    def test_job(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.submit(f'{self.base_url}/meny.html')
+        job = ScrapeJob.objects.get()
+        self.assertRedirects(response, reverse('scrape_job', kwargs={'uuid': job.id}))
+        self.assertContains(self.client.get(response.url), 'Pending')
+
+        for callback in callbacks:
+            callback()
+        job.refresh_from_db()
+        self.assertEqual(job.status, ScrapeJob.Status.DONE)
+        self.assertEqual(job.recipe.name, 'Pannekaker')
+        self.assertGreater(job.scrape_seconds, 0)
+        self.assertIsNotNone(job.save_seconds)
+        admin_url = reverse('admin:recipes_recipe_change', args=(job.recipe_id,))
+        self.assertRedirects(self.client.get(response.url), admin_url, fetch_redirect_response=False)
+
+    def test_failed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.submit(f'{self.base_url}/missing.html')
+        job = ScrapeJob.objects.get()
+        self.assertEqual(job.status, ScrapeJob.Status.FAILED)
+        self.assertIn('404', job.error)
+        self.assertContains(self.client.get(response.url), 'Scraping failed')
+
+    def test_in_flight_urls_are_deduplicated(self):
+        url = f'{self.base_url}/meny.html'
+        with self.captureOnCommitCallbacks() as callbacks:
+            first, second = jobs.submit(url), jobs.submit(url)
+        self.assertEqual(first, second)
+        self.assertEqual(len(callbacks), 1)
+        callbacks[0]()
+        self.assertNotEqual(jobs.submit(url), first)  # done, so it may be scraped again
+
+    def test_run_pending(self):
+        ScrapeJob.objects.create(url=f'{self.base_url}/meny.html')
+        ScrapeJob.objects.create(url=f'{self.base_url}/missing.html', status=ScrapeJob.Status.RUNNING)
+        out = StringIO()
+        call_command('run_scrape_jobs', '--requeue-running', stdout=out, stderr=out)
+        self.assertIn('Ran 2 jobs, 1 failed', out.getvalue())
+        self.assertFalse(ScrapeJob.objects.filter(status__in=ScrapeJob.IN_FLIGHT).exists())
+
+
+@override_settings(SCRAPE_CACHE_DIR=None, SCRAPE_JOB_WORKERS=0)  # jobs are awaited by the view
+class AsyncScrapeJobTest(FixtureServerMixin, FreshIndexesMixin, TransactionTestCase):
+    """ The scrape submission path under ASGI. It saves in other threads, so the data must be committed """
+
+    async def test_fetch(self):
+        self.assertEqual(await fetch_async(f'{self.base_url}/meny.html'), read_fixture('meny.html'))
+
+    async def test_job(self):
+        request = AsyncRequestFactory().post('/scrape/', urlencode({'scrape_url': f'{self.base_url}/meny.html'}),
+                                             content_type='application/x-www-form-urlencoded')
+        response = await async_views.scrape_view(request)
+        job = await sync_to_async(ScrapeJob.objects.select_related('recipe').get)()
+        self.assertEqual(response.url, reverse('scrape_job', kwargs={'uuid': job.id}))
+        self.assertEqual(job.status, ScrapeJob.Status.DONE)
+        self.assertEqual(job.recipe.name, 'Pannekaker')
+        self.assertGreater(job.scrape_seconds, 0)
@@ -1,6 +1,13 @@
+import hashlib
+import json
+import re
 from unicodedata import numeric
 
+from django.db import transaction
+
+from recipes.matching import ingredient_matcher
 from recipes.models import Recipe, Ingredient, RecipeIngredient
+from recipes.signals import recipe_ingredients_changed
 
 M = RecipeIngredient.Measurements
 conversions = {
@@ -16,6 +23,8 @@ conversions = {
     'kg': M.KILOGRAMS,
     'håndfull': M.COUNT,
     'skiver': M.SLICES,
+    'l': M.LITERS,
+    'liter': M.LITERS,
 
     **dict((str(m), m) for m in M)  # add already defined conversions. (tbsp => tbsp, '' => count, etc.)
 }
@@ -31,32 +40,110 @@ def unicode_fraction_to_float(num):
         return float(num[:-1]) + numeric(num[-1])
 
 
-def create_recipe_ingredient_from_ami(ami, recipe):
+def create_recipe_ingredients_from_ami(ami, recipe):
+    """ Creates all the recipe's ingredients with a constant number of queries """
+    base_ingredients = find_base_ingredients([i for _, _, i in ami])
+    recipe_ingredients = []
     for a, m, i in ami:
-        base_ingredient = find_base_ingredient(i)
-        RecipeIngredient.objects.create(
+        recipe_ingredient = RecipeIngredient(
             name=i,
             recipe=recipe,
-            base_ingredient=base_ingredient,
+            base_ingredient=base_ingredients[i],
             amount_per_serving=a,
             measurement=conversions[m] if m else ""
         )
+        # bulk_create skips save(), which is where validation normally happens. The relations are known to exist,
+        # and validating them would cost a query each
+        recipe_ingredient.full_clean(exclude=('recipe', 'base_ingredient'))
+        recipe_ingredients.append(recipe_ingredient)
+    RecipeIngredient.objects.bulk_create(recipe_ingredients)
+    recipe_ingredients_changed.send(sender=RecipeIngredient, recipe_id=recipe.id)
 
 
 def create_recipe_from_scrape(scrape_dict):
+    scrape_dict = dict(scrape_dict, scrape_hash=hash_scrape(scrape_dict))
     ami = scrape_dict.pop('ami')
-    recipe = Recipe.objects.create(**scrape_dict)
-    create_recipe_ingredient_from_ami(ami, recipe=recipe)
+    with transaction.atomic():
+        recipe = Recipe.objects.create(**scrape_dict)
+        create_recipe_ingredients_from_ami(ami, recipe=recipe)
+    return recipe
+
+
+def update_recipe_from_scrape(recipe, scrape_dict):
+    """ Replaces the recipe's content and ingredients with the scraped ones """
+    with transaction.atomic():
+        recipe.name = scrape_dict['name']
+        recipe.content = scrape_dict['content']
+        recipe.serves = scrape_dict.get('serves')
+        recipe.scrape_hash = hash_scrape(scrape_dict)
+        recipe.save(update_fields=['name', 'content', 'serves', 'scrape_hash', 'datetime_updated'])
+        recipe.recipe_ingredients.all().delete()
+        create_recipe_ingredients_from_ami(scrape_dict['ami'], recipe=recipe)
     return recipe
 
 
-def find_base_ingredient(ingredient_name):
-    candidates = Ingredient.objects.filter(name__in=ingredient_name.split(" "))
-    if not candidates.exists() and len(ingredient_name.split(" ")) == 1:
-        # one word => no adjectives. Create ingredient with same name
-        return Ingredient.objects.create(name=ingredient_name, ubiquitous=False)
-    return candidates[0] if candidates else None
+def hash_scrape(scrape_dict):
+    """ :return: hex digest identifying the scraped recipe data, independent of the url it was found at """
+    data = {key: value for key, value in scrape_dict.items() if key not in ('origin_url', 'scrape_hash')}
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def find_base_ingredients(ingredient_names):
+    """
+    Finds the base ingredient of each ingredient name: the longest ingredient name found in it.
+    See recipes.matching.IngredientMatcher.
+    Names with no match are looked up as ingredient names, as the matcher may not know of ingredients created by
+    other processes yet. One word names that aren't found are assumed to be free of adjectives, and are created as new
+    ingredients.
+    :return: dict of ingredient name -> Ingredient or None
+    """
+    matches = ingredient_matcher.match_many(ingredient_names)
+    ingredients = Ingredient.objects.in_bulk(set(i for i in matches.values() if i is not None))
+    unmatched = set(name for name, match in matches.items() if match not in ingredients)  # or deleted since
+    by_name = Ingredient.objects.in_bulk(unmatched, field_name='name') if unmatched else {}
+    new = [name for name in unmatched if name not in by_name and len(name.split(" ")) == 1]
+    if new:
+        by_name.update((ingredient.name, ingredient) for ingredient in Ingredient.bulk_create_roots(new))
+    return {
+        name: ingredients[match] if match in ingredients else by_name.get(name)
+        for name, match in matches.items()
+    }
+
+
+def parse_servings(recipe_yield):
+    """
+    :param recipe_yield: e.g. 4, "4", "4 porsjoner" or ["4", "4 porsjoner"]
+    :return: the first whole number found, or None
+    """
+    if isinstance(recipe_yield, list):
+        recipe_yield = recipe_yield[0] if recipe_yield else None
+    match = re.search(r'\d+', str(recipe_yield or ''))
+    return int(match.group()) if match else None
+
+
+AMOUNT = re.compile(r'^(\d+(?:[.,]\d+)?)?([\u00bc-\u00be\u2150-\u215e]?)$')  # "2", "2,5", "½", "1½"
+
+
+def parse_amount(s):
+    """ :return: the amount as a float, or None if s is not an amount """
+    match = AMOUNT.match(s)
+    if not match or not any(match.groups()):
+        return None
+    whole, fraction = match.groups()
+    return float(whole.replace(",", ".") if whole else 0) + (numeric(fraction) if fraction else 0)
 
 
-def is_number(s):
-    return s.replace(",", ".").isdigit()  # replace commas with dots before checking for digit
+def parse_ingredient_line(line):
+    """
+    :param line: e.g. "200 g spagetti", "4 cherrytomater", "nykvernet pepper", "2 ss smør til steking"
+    :return: (amount, measurement, ingredient) tuple. See scrape.scrape.scrape
+    """
+    parts = line.split()
+    amount, measure = None, None
+    if parts and (amount := parse_amount(parts[0])) is not None:  # Amount specified
+        parts.pop(0)
+        if len(parts) >= 2 and parts[0].lower() in conversions.keys():  # measurement given and known
+            measure = parts.pop(0).lower()
+        else:  # Didn't find measure, assume count
+            measure = 'stk'
+    return amount, measure, " ".join(parts)
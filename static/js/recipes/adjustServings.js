@@ -1,27 +1,37 @@
-let servingsCounter = parseInt(document.getElementById("servings").innerText);
-let ingredientServings = Array.from(document.getElementsByClassName("serving-span"));
-const defaultRecipeServings = servingsCounter;
-const defaultIngredientServings = ingredientServings.map(elem => parseFloat(elem.innerText));
+// Amounts are scaled, and their units converted, by the server. See recipes.views.recipe_servings
+let servingsElem = document.getElementById("servings");
+let servingsCounter = servingsElem ? parseInt(servingsElem.innerText) : null;
+let amountSpans = Array.from(document.getElementsByClassName("serving-span"));
+let measurementSpans = Array.from(document.getElementsByClassName("measurement-span"));
+let _servings_request = null;  // AbortController of the request in flight
 
 function decrServings() {
     if (servingsCounter > 1) {
-        addToServings(-1)
+        addToServings(-1);
     }
 }
 
 function incrServings() {
-    addToServings(1)
+    addToServings(1);
 }
 
 function addToServings(num) {
     servingsCounter = servingsCounter + num;
-    let ratio = servingsCounter / defaultRecipeServings;
-
-    document.getElementById("servings").innerText = servingsCounter;
-    for (let i = 0; i < ingredientServings.length; i++) {
-        amount = (defaultIngredientServings[i] * ratio).toFixed(1) / 1;
-        console.log(amount + ": " + isNaN(amount));
-        ingredientServings[i].innerText = isNaN(amount) ? "": amount;
+    servingsElem.innerText = servingsCounter;
+    if (_servings_request !== null) {
+        _servings_request.abort();
     }
+    _servings_request = new AbortController();
+    fetch(servingsElem.dataset.url + "?servings=" + servingsCounter, {signal: _servings_request.signal})
+        .then(response => {
+            if (!response.ok) throw new Error(response.statusText);
+            return response.json();
+        })
+        .then(data => data.ingredients.forEach((ingredient, i) => {
+            amountSpans[i].innerText = ingredient.amount_display;
+            measurementSpans[i].innerText = ingredient.measurement;
+        }))
+        .catch(error => {
+            if (error.name !== "AbortError") throw error;
+        });
 }
-addToServings(0);
\ No newline at end of file
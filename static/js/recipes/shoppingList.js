@@ -0,0 +1,31 @@
+// The recipes picked for the shopping list are kept in localStorage, as "<id>:<servings>" by recipe id.
+// The shopping list page is the source of truth: removing recipes there updates the stored list.
+const SHOPPING_LIST_KEY = "shoppingList";
+
+function loadShoppingList() {
+    return JSON.parse(localStorage.getItem(SHOPPING_LIST_KEY) || "{}");
+}
+
+function saveShoppingList(selection) {
+    localStorage.setItem(SHOPPING_LIST_KEY, JSON.stringify(selection));
+}
+
+function addToShoppingList(button) {
+    // servingsCounter is set by adjustServings.js on recipes with servings
+    let selection = loadShoppingList();
+    let servings = typeof servingsCounter === "number" && !isNaN(servingsCounter) ? servingsCounter : null;
+    selection[button.dataset.recipe] = servings ? button.dataset.recipe + ":" + servings : button.dataset.recipe;
+    saveShoppingList(selection);
+    window.location = button.dataset.url + "?recipes=" + Object.values(selection).join(",");
+}
+
+let _recipesParam = new URLSearchParams(window.location.search).get("recipes");
+if (document.getElementById("add-to-shopping-list") === null) {  // on the shopping list page
+    if (_recipesParam !== null) {
+        saveShoppingList(Object.fromEntries(
+            _recipesParam.split(",").filter(Boolean).map(part => [part.split(":")[0], part])
+        ));
+    } else if (Object.keys(loadShoppingList()).length) {  // e.g. from the navbar
+        window.location.search = "?recipes=" + Object.values(loadShoppingList()).join(",");
+    }
+}
@@ -1,24 +1,57 @@
 let ingredient_search = document.getElementById("ingredient-search");
-let all_ingredients = Array.from(document.getElementById("ingredients").children);
+let suggestions = document.getElementById("ingredients");
 let _selected_ingredients = [];  // internal list, used to keep track of ingredients selected from search bar
+let _suggestion_timeout = null;
+let _suggestion_request = null;  // AbortController of the suggestion request in flight
 
 let urlParams = new URLSearchParams(window.location.search);
 
 // set same settings as search
-urlParams.get('ingredients').split(",").forEach(ingredient => append_ingredient_to_list(ingredient));
+(urlParams.get('ingredients') || "").split(",").filter(Boolean).forEach(ingredient => append_ingredient_to_list(ingredient));
 if (urlParams.get('exclusive') === 'False') {
     document.getElementById("radio-inclusive").checked = true;
     document.getElementById("ubiq-checkbox-container").style.display = 'none';
 } else {
     document.getElementById("include-ubiquitous").checked = urlParams.get('include-ubiquitous') === 'on';
 }
+document.getElementById("include-descendants").checked = urlParams.get('include-descendants') === 'on';
+
+ingredient_search.addEventListener("input", () => {
+    clearTimeout(_suggestion_timeout);
+    _suggestion_timeout = setTimeout(load_suggestions, 150);
+});
+
+function load_suggestions() {
+    // Fills the datalist with the ingredients matching what has been typed so far
+    let prefix = ingredient_search.value.trim();
+    if (_suggestion_request !== null) {
+        _suggestion_request.abort();
+    }
+    if (!prefix) {
+        suggestions.replaceChildren();
+        return;
+    }
+    _suggestion_request = new AbortController();
+    fetch(suggestions.dataset.url + "?q=" + encodeURIComponent(prefix), {signal: _suggestion_request.signal})
+        .then(response => response.json())
+        .then(data => suggestions.replaceChildren(...data.ingredients
+            .filter(ingredient => !_selected_ingredients.includes(ingredient))
+            .map(ingredient => new Option(ingredient, ingredient))))
+        .catch(error => {
+            if (error.name !== "AbortError") throw error;
+        });
+}
 
 function append_ingredient_to_list(ingredient = null) {
     if (ingredient === null) {
         ingredient = ingredient_search.value;
     }
+    if (!ingredient || _selected_ingredients.includes(ingredient)) {
+        ingredient_search.value = "";
+        return;
+    }
     _selected_ingredients.push(ingredient);
-    all_ingredients.find(elem => elem.value === ingredient).remove();
+    suggestions.replaceChildren();
 
     add_to_selected_ingredients(ingredient);
     ingredient_search.value = "";
@@ -37,11 +70,9 @@ function set_ingredients() {
 }
 
 function make_ingredient_searchable(event) {
-    // Run when selected base_ingredient is removed (X clicked). Removes the html and makes the base_ingredient searchable again
+    // Run when selected base_ingredient is removed (X clicked). Removes the html and makes the base_ingredient suggestable again
     let ingredient_name = event.target.previousSibling.innerText;
     let ingredient_p = document.getElementById(ingredient_name + "-select-p");
     ingredient_p.remove();
     _selected_ingredients = _selected_ingredients.filter(ingr => ingr !== ingredient_name);
-    let ingredient_option = all_ingredients.find(ingr => ingr.value === ingredient_name);
-    document.getElementById("ingredients").appendChild(ingredient_option);
 }
\ No newline at end of file